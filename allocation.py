@@ -0,0 +1,160 @@
+"""
+Motor de reparto proporcional con topes (sin DB, sin Streamlit).
+
+allocate_capped(total, caps) reparte `total` pesos enteros entre filas con
+capacidad `caps`, proporcional a `weights` (por defecto la propia capacidad),
+sin pasarse del tope de ninguna fila:
+
+  1. Water-filling: se busca el nivel λ tal que sum(min(cap_i, λ·w_i)) = total.
+     Ordenando por cap_i/w_i basta un recorrido -> O(n log n).
+  2. Resto mayor: se toma el piso de cada parte y los pesos que faltan se dan,
+     de a uno, a las filas con mayor parte decimal (empates: la primera fila).
+
+Todo en aritmética entera: los pesos se llevan a enteros (exacto, también si
+vienen como float), λ es la fracción p/q y cada parte es p·w_i // q con resto
+p·w_i % q. Sin punto flotante no hay empates que dependan del redondeo.
+
+Las filas "fijadas" (pinned) conservan su monto y sólo se reparte el resto.
+Sobre LARGE_N filas se usa la versión vectorizada con NumPy (enteros de 64
+bits; si los productos no caben, o el orden en float no alcanza para ubicar
+λ, vuelve a la versión Python). Las dos dan exactamente el mismo resultado.
+"""
+import math
+from fractions import Fraction
+
+LARGE_N = 512
+
+def allocate_capped(total, caps, weights=None, pinned=None):
+    """
+    total   -> monto entero a repartir
+    caps    -> capacidad (tope) entera de cada fila
+    weights -> peso de cada fila (por defecto = caps)
+    pinned  -> {índice: monto} filas fijadas que no se rebalancean
+    Devuelve (alloc, leftover): lista de ints por fila y lo que no cupo.
+    """
+    caps = [max(0, int(c)) for c in caps]
+    n = len(caps)
+    weights = caps if weights is None else _integer_weights(weights)
+    if len(weights) != n:
+        raise ValueError("weights y caps deben tener el mismo largo")
+
+    total = int(total)
+    alloc = [0] * n
+    free = list(range(n))
+    if pinned:
+        for i, amt in pinned.items():
+            amt = int(amt)
+            if not 0 <= amt <= caps[i]:
+                raise ValueError(f"monto fijado fuera de rango en la fila {i}: {amt}")
+            alloc[i] = amt
+        total -= sum(alloc)
+        if total < 0:
+            raise ValueError("las filas fijadas suman más que el total")
+        free = [i for i in range(n) if i not in pinned]
+
+    if total <= 0 or not free:
+        return alloc, max(0, total)
+
+    sub_caps = [caps[i] for i in free]
+    sub_w = [weights[i] for i in free]
+    part = _allocate_np(total, sub_caps, sub_w) if len(free) >= LARGE_N else None
+    if part is None:
+        part = _allocate_py(total, sub_caps, sub_w)
+    for i, amt in zip(free, part):
+        alloc[i] = amt
+    return alloc, total - sum(part)
+
+def _integer_weights(weights):
+    """Pesos (>= 0) escalados a enteros sin perder precisión: mismas proporciones."""
+    try:
+        fr = [max(Fraction(0), Fraction(w)) for w in weights]
+    except (ValueError, OverflowError, TypeError):
+        raise ValueError("weights debe tener números finitos") from None
+    den = math.lcm(*(f.denominator for f in fr)) if fr else 1
+    return [int(f * den) for f in fr]
+
+# ---------- versión pura Python ----------
+
+def _water_level_py(total, caps, weights):
+    """
+    λ = p/q tal que sum(min(cap, λ·w)) = total, o None si todo se llena.
+    Las comparaciones son productos enteros, nunca divisiones.
+    """
+    order = sorted((i for i in range(len(caps)) if weights[i] > 0),
+                   key=lambda i: Fraction(caps[i], weights[i]))
+    remaining = total
+    w_left = sum(weights[i] for i in order)
+    for i in order:
+        if remaining * weights[i] <= caps[i] * w_left:  # remaining/w_left <= cap/w
+            return remaining, w_left
+        remaining -= caps[i]
+        w_left -= weights[i]
+    return None
+
+def _allocate_py(total, caps, weights):
+    level = _water_level_py(total, caps, weights)
+    if level is None:
+        return [c if w > 0 else 0 for c, w in zip(caps, weights)]
+    p, q = level
+    alloc, rest = [], []
+    for c, w in zip(caps, weights):
+        if w <= 0:
+            alloc.append(0)
+            rest.append(0)
+        elif c * q <= p * w:  # llena: cap <= λ·w
+            alloc.append(c)
+            rest.append(0)
+        else:
+            a, r = divmod(p * w, q)
+            alloc.append(a)
+            rest.append(r)
+    # Los restos suman exactamente (total - sum(alloc))·q: faltan tantos pesos
+    # como indica diff, y cada fila con resto tiene espacio para uno más.
+    diff = total - sum(alloc)
+    for i in sorted(range(len(caps)), key=lambda i: (-rest[i], i))[:diff]:
+        alloc[i] += 1
+    return alloc
+
+# ---------- versión NumPy (muchas filas) ----------
+
+_INT64_SAFE = 1 << 62
+
+def _allocate_np(total, caps, weights):
+    """Como _allocate_py; None si no se puede hacer exacto con int64."""
+    import numpy as np
+
+    max_w, sum_w = max(weights), sum(weights)
+    if (total + sum(caps)) * max_w >= _INT64_SAFE or max(caps) * sum_w >= _INT64_SAFE:
+        return None
+    c = np.asarray(caps, dtype=np.int64)
+    w = np.asarray(weights, dtype=np.int64)
+    active = w > 0
+    if total >= int(c[active].sum()):
+        return np.where(active, c, 0).tolist()
+
+    # El orden por cap/w se saca en float; la condición de cada nivel es entera.
+    idx = np.flatnonzero(active)
+    order = idx[np.argsort(c[idx] / w[idx], kind="stable")]
+    cs, ws = c[order], w[order]
+    remaining = total - np.concatenate(([0], np.cumsum(cs)[:-1]))
+    w_left = np.cumsum(ws[::-1])[::-1]
+    ok = remaining * ws <= cs * w_left
+    k = int(np.argmax(ok))
+    p, q = int(remaining[k]), int(w_left[k])
+    # Si el float ordenó mal dos cocientes casi iguales, λ no es consistente:
+    # las filas antes de k deben quedar llenas y las demás no.
+    if not (ok[k] and (cs[:k] * q <= p * ws[:k]).all() and (cs[k:] * q >= p * ws[k:]).all()):
+        return None
+
+    pw = p * w
+    full = active & (c * q <= pw)
+    alloc = np.where(full, c, pw // q)
+    rest = np.where(full, 0, pw % q)
+    alloc[~active] = 0
+    rest[~active] = 0
+    diff = total - int(alloc.sum())
+    if diff > 0:
+        # Mayor resto primero; empates por índice (mismo criterio que _allocate_py).
+        top = np.lexsort((np.arange(c.size), -rest))[:diff]
+        alloc[top] += 1
+    return alloc.tolist()
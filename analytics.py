@@ -0,0 +1,111 @@
+"""
+Tendencias de varios años a partir de los totales ya agregados.
+
+balances guarda cuánto aportó cada usuario a cada presupuesto y cada
+presupuesto pertenece a un mes, así que es el rollup mensual: una sola
+consulta (pd.read_sql) trae el rango completo en columnas y todo lo demás es
+groupby/pivot sobre ese DataFrame, sin recorrer list_budgets ni sumar por
+presupuesto. Los ingresos salen de incomes agrupado por mes más
+income_rollups de los meses cerrados.
+
+Los DataFrames devueltos por frame()/incomes_frame() se comparten vía caché:
+no modificarlos in place.
+"""
+import pandas as pd
+
+import db
+from simulation import SAVINGS_KEYS
+
+def month_range(end, n):
+    """Los n meses (YYYY-MM) que terminan en `end`, en orden."""
+    y, m = map(int, db._check_month(end).split("-"))
+    last = y * 12 + m - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(last - n + 1, last + 1)]
+
+@db.cached_read
+def frame(start, end):
+    """
+    Una fila por (presupuesto, usuario) entre start y end:
+    month, ckey, name, ctype, owner, limit_total, user, amount.
+    Presupuestos sin aportes vienen con user=None y amount=0.
+    """
+    with db.connection() as conn:
+        return pd.read_sql(
+            """
+            SELECT b.month, b.template_key AS ckey, t.name, t.ctype, t.owner, b.limit_total,
+                   s.user, COALESCE(s.amount, 0) AS amount
+            FROM budgets b
+            JOIN template_versions t ON t.id = b.template_version_id
+            LEFT JOIN balances s ON s.budget_id = b.id
+            WHERE b.month BETWEEN ? AND ?
+            """,
+            conn, params=(start, end),
+        )
+
+@db.cached_read
+def incomes_frame(start, end):
+    """Ingresos por (month, user), incluidos los meses cerrados."""
+    with db.connection() as conn:
+        return pd.read_sql(
+            """
+            SELECT substr(ts, 1, 7) AS month, user, SUM(amount) AS amount
+            FROM incomes WHERE ts >= ? AND ts < ?
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT month, user, amount FROM income_rollups WHERE month BETWEEN ? AND ?
+            """,
+            conn, params=(start, db._next_month(end), start, end),
+        )
+
+def visible(df, user):
+    """Compartidas + las categorías individuales de `user` (lo mismo que muestra la app)."""
+    return df[(df["ctype"] == "shared") | (df["owner"] == user)]
+
+def cube(df, months=None):
+    """
+    Matriz mes × categoría × usuario con los aportes.
+    Devuelve (months, ckeys, users, array de shape (M, C, U)).
+    """
+    data = df.dropna(subset=["user"])
+    months = list(months) if months is not None else sorted(df["month"].unique())
+    ckeys = sorted(df["ckey"].unique())
+    users = sorted(data["user"].unique())
+    full = pd.MultiIndex.from_product([months, ckeys, users], names=["month", "ckey", "user"])
+    values = (data.groupby(["month", "ckey", "user"])["amount"].sum()
+              .reindex(full, fill_value=0)
+              .to_numpy()
+              .reshape(len(months), len(ckeys), len(users)))
+    return months, ckeys, users, values
+
+def labels(df):
+    """ckey -> nombre para mostrar (el más reciente; las individuales con su dueño)."""
+    last = df.sort_values("month").drop_duplicates("ckey", keep="last").set_index("ckey")
+    return last["name"].where(last["ctype"] == "shared", last["name"] + " (" + last["owner"].fillna("") + ")").to_dict()
+
+def fill_rate(df, months=None):
+    """Mes × categoría (ckey): aportado / límite, entre 0 y 1."""
+    per_budget = df.groupby(["month", "ckey"]).agg(
+        limit_total=("limit_total", "first"), amount=("amount", "sum"))
+    rate = (per_budget["amount"] / per_budget["limit_total"].where(per_budget["limit_total"] > 0)).clip(upper=1)
+    out = rate.unstack("ckey")
+    return out.reindex(months) if months is not None else out
+
+def savings(df, user, months=None):
+    """Mes -> lo que `user` aportó a sus categorías de ahorro (individuales; ver simulation.SAVINGS_KEYS)."""
+    mask = df["ckey"].str.startswith(SAVINGS_KEYS) & (df["ctype"] == "individual") & (df["user"] == user)
+    out = df[mask].groupby("month")["amount"].sum()
+    return out.reindex(months, fill_value=0) if months is not None else out
+
+def shared_split(df, months=None):
+    """Mes × usuario: fracción de lo aportado a compartidos que puso cada uno."""
+    shared = df[(df["ctype"] == "shared") & df["user"].notna()]
+    totals = shared.pivot_table(index="month", columns="user", values="amount", aggfunc="sum", fill_value=0)
+    split = totals.div(totals.sum(axis=1).where(lambda s: s > 0), axis=0)
+    return split.reindex(months) if months is not None else split
+
+def contributed_vs_income(df, incomes, user, months=None):
+    """Mes × [Ingresos, Aportado] de `user`."""
+    inc = incomes[incomes["user"] == user].groupby("month")["amount"].sum()
+    con = df[df["user"] == user].groupby("month")["amount"].sum()
+    out = pd.DataFrame({"Ingresos": inc, "Aportado": con}).fillna(0)
+    return out.reindex(months, fill_value=0) if months is not None else out
@@ -1,25 +1,29 @@
 import streamlit as st
 import pandas as pd
+import functools
 import json
-import re
-
-from db import (
-    init_db, ensure_users, load_templates_from_yaml, ensure_budgets_for_month,
-    list_budgets, sum_contribs_by_user, add_income, incomes_for_user,
-    current_month, month_name
+import os
+import uuid
+
+import cache
+import metrics
+import storage
+from bootstrap import ensure_bootstrapped
+from db import current_month, month_name
+from allocation import allocate_capped
+from utils import (
+    fmt_clp, parse_money, proportional_allocate, summary_rows_from
 )
-from utils import fmt_clp, proportional_allocate, progress_of_row
+
+# Backend elegido con BUDGET_BACKEND (por defecto SQLite en DB_PATH).
+# Importar, Exportar, Análisis y Proyección usan SQL directo: sólo con backends SQLite.
+store = storage.get_backend()
+sql_ok = storage.sql_scope(store) is not None
+SQL_ONLY = "Disponible sólo con un backend SQLite (BUDGET_BACKEND=sqlite o sqlite-memory)."
 
 # =======================
 #  Helpers de dinero y shares
 # =======================
-def parse_money(s: str) -> int:
-    """Convierte '$200.000', '200000', '200,000' -> 200000 (int)."""
-    if not s:
-        return 0
-    digits = re.sub(r"[^\d]", "", s)
-    return int(digits) if digits else 0
-
 def money_input(label: str, key: str, default: int = 0) -> int:
     """
     Input de texto 'tipo moneda' que acepta $ y puntos.
@@ -31,26 +35,76 @@ def money_input(label: str, key: str, default: int = 0) -> int:
     st.caption(f"Interpretado: **{fmt_clp(val)}**")
     return val
 
-def share_to_fraction(v) -> float:
+def idempotency_key(scope: str, *inputs) -> str:
     """
-    Acepta 50 o '50%' -> 0.5 ; acepta 0.5 -> 0.5.
-    Si no se puede parsear, retorna 0.5.
+    Clave de idempotencia estable mientras no cambien los datos del formulario:
+    un doble clic sobre el mismo ingreso reutiliza la clave y no se aplica dos veces.
     """
-    try:
-        if isinstance(v, str):
-            v = v.strip().replace("%", "")
-        val = float(v)
-    except Exception:
-        return 0.5
-    return val if val <= 1 else (val / 100.0)
+    sig = json.dumps([str(v) for v in inputs])
+    state = st.session_state.setdefault(f"_idem_{scope}", {})
+    if state.get("sig") != sig:
+        state.update(sig=sig, key=uuid.uuid4().hex)
+    return state["key"]
+
+# =======================
+#  Fragmentos (reruns parciales)
+# =======================
+# Escribir un monto o editar la tabla del rebalance sólo vuelve a correr el
+# fragmento que tiene el widget, no toda la página. Streamlit no deja que un
+# fragmento haga correr a otro: cuando un fragmento escribe, guarda cómo
+# mostrar el resultado y pide un rerun completo (after_write), así el Resumen
+# y el Historial se actualizan sólo cuando hubo una escritura en esta sesión.
+# Para ver también lo que registre la otra persona, BUDGET_REFRESH_S=30 hace
+# que el Resumen se refresque solo cada 30 s (lee de la caché versionada:
+# cuesta una consulta a data_version por sesión abierta). Por defecto, apagado.
+REFRESH_S = float(os.environ.get("BUDGET_REFRESH_S", "0"))
+
+def fragment(name, run_every=None):
+    """
+    st.fragment medido con metrics.section(name). Dentro del rerun completo es
+    una sección más; cuando corre solo, cuenta como un rerun propio
+    ("fragmento <name>") salvo los refrescos periódicos, que no se registran.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            own = metrics.current_run() is None and run_every is None
+            if own:
+                metrics.start_run(f"fragmento {name}")
+            try:
+                with metrics.section(name):
+                    return fn(*args, **kwargs)
+            finally:
+                if own:
+                    metrics.end_run()
+        return st.fragment(body, run_every=run_every)
+    return decorator
+
+def after_write(scope, show):
+    """
+    Tras una escritura: guarda show() (lo que el fragmento muestra como
+    resultado) y hace un rerun completo para que el resto de la página vea
+    los datos nuevos. El fragmento llama a show_written(scope) en ese rerun.
+    """
+    st.session_state[f"_written_{scope}"] = show
+    st.rerun()
+
+def show_written(scope):
+    show = st.session_state.pop(f"_written_{scope}", None)
+    if show is not None:
+        show()
 
 # =======================
 #  Inicialización
 # =======================
-init_db()
-ensure_users()
-load_templates_from_yaml()
-ensure_budgets_for_month()
+# Sólo hace trabajo la primera vez en el proceso, al cambiar de mes, cuando
+# budgets.yaml cambia o tras un restore; un rerun normal sólo lee data_version.
+metrics.start_run()
+with metrics.section("bootstrap"):
+    ensure_bootstrapped(backend=store)
+    if storage.is_default(store):
+        import backup
+        backup.start_scheduler()  # BUDGET_BACKUP_EVERY_MIN; no hace nada si es 0
 
 st.set_page_config(page_title="Finanzas Familia Jack & Jasmin", page_icon="💸", layout="wide")
 
@@ -81,9 +135,20 @@ month = current_month()
 st.sidebar.caption(f"Mes actual: **{month_name(month)}**")
 
 if st.sidebar.button("🔄 Reiniciar / Crear mes nuevo"):
-    ensure_budgets_for_month(month)
+    store.ensure_budgets_for_month(month)
     st.sidebar.success("Mes verificado/creado.")
 
+with st.sidebar.expander("📅 Crear meses por rango"):
+    desde = st.text_input("Desde (YYYY-MM)", value=month, key="rango_desde")
+    hasta = st.text_input("Hasta (YYYY-MM)", value=month, key="rango_hasta")
+    if st.button("Crear / completar meses"):
+        try:
+            creados = store.ensure_budgets_for_range(desde.strip(), hasta.strip())
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success(f"{creados} presupuesto(s) creados entre {desde} y {hasta}.")
+
 # =======================
 #  Encabezado
 # =======================
@@ -93,7 +158,8 @@ st.write("Registra ingresos, distribuye automáticamente por categorías y sigue
 # =======================
 #  Registrar y distribuir (automático)
 # =======================
-with st.expander("➕ Registrar ingreso y distribuir automáticamente", expanded=True):
+@fragment("distribución automática")
+def auto_distribution(username: str, month: str):
     col1, col2, col3 = st.columns([2, 1, 2])
     with col1:
         amount = money_input(
@@ -110,19 +176,36 @@ with st.expander("➕ Registrar ingreso y distribuir automáticamente", expanded
         if amount <= 0:
             st.warning("Ingresa un monto mayor que cero.")
         else:
-            add_income(username, int(amount), f"{tipo} - {nota}".strip())
-            allocs, leftover = proportional_allocate(username, int(amount), month)
-            if not allocs:
-                st.info("No hay categorías con saldo pendiente para ti. No se hizo distribución.")
-            else:
-                df = pd.DataFrame([{
-                    "Categoría": a["name"] if a["type"] == "individual" else f"{a['name']} (compartido)",
-                    "Asignado": fmt_clp(a["allocated"])
-                } for a in allocs])
-                st.success("Ingreso registrado y distribuido por tus metas del mes.")
-                st.dataframe(df, use_container_width=True)
-                if leftover > 0:
-                    st.info(f"Saldo no asignado (metas completas): **{fmt_clp(leftover)}**")
+            key = idempotency_key("auto", username, month, amount, tipo, nota)
+            allocs, leftover, applied = proportional_allocate(
+                username, int(amount), month,
+                note=f"{tipo} - {nota}".strip(), idempotency_key=key, backend=store,
+            )
+
+            def show():
+                if not applied:
+                    st.info("Este ingreso ya estaba registrado (no se aplicó dos veces). "
+                            "Cambia el monto o la nota para registrar otro.")
+                if not allocs:
+                    st.info("No hay categorías con saldo pendiente para ti. No se hizo distribución.")
+                else:
+                    df = pd.DataFrame([{
+                        "Categoría": a["name"] if a["type"] == "individual" else f"{a['name']} (compartido)",
+                        "Asignado": fmt_clp(a["allocated"])
+                    } for a in allocs])
+                    st.success("Ingreso registrado y distribuido por tus metas del mes.")
+                    st.dataframe(df, use_container_width=True)
+                    if leftover > 0:
+                        st.info(f"Saldo no asignado (metas completas): **{fmt_clp(leftover)}**")
+
+            if applied:
+                after_write("auto", show)
+            show()
+    else:
+        show_written("auto")
+
+with st.expander("➕ Registrar ingreso y distribuir automáticamente", expanded=True):
+    auto_distribution(username, month)
 
 # =======================
 #  Distribución editable con rebalance (nuevo flujo)
@@ -132,75 +215,30 @@ def build_plan_for_user(user: str, month: str):
     Devuelve la lista de categorías visibles para el usuario con su capacidad
     restante (lo que falta para completar su tope personal este mes).
     """
-    plan = []
-    rows = list_budgets(month)  # (id, tkey, name, ctype, owner, limit_total, shares_json)
-    for r in rows:
-        b_id, tkey, name, ctype, owner, limit_total, shares_json = r
-
-        # Solo veo compartidas y mis individuales
-        if ctype == "shared" or (ctype == "individual" and owner == user):
-            # tope personal
-            if ctype == "shared":
-                try:
-                    shares = json.loads(shares_json) if shares_json else {}
-                except Exception:
-                    shares = {}
-                frac = share_to_fraction(shares.get(user, 50))
-                personal_cap = int(round(limit_total * frac))
-            else:
-                personal_cap = int(limit_total)
-
-            ya_aportado = sum_contribs_by_user(b_id, user)
-            restante = max(0, personal_cap - ya_aportado)
-            if restante > 0:
-                plan.append({
-                    "id": b_id,
-                    "name": name + (" (comp.)" if ctype == "shared" else ""),
-                    "capacity": restante
-                })
-    return plan
-
-def suggest_by_capacity(plan, total: int):
+    return [{
+        "id": r[0],
+        "name": r[2] + (" (comp.)" if r[3] == "shared" else ""),
+        "capacity": restante,
+    } for r, restante in store.remaining_for_user(month, user)]
+
+def suggest_by_capacity(plan, total: int, pinned=None):
     """
     Sugerencia proporcional (capada por capacidad) para un total dado.
+    pinned: {índice: monto} filas fijadas que no cambian.
     Devuelve lista de ints y posible 'leftover' si ya no hay dónde poner.
     """
     if total <= 0 or not plan:
         return [0]*len(plan), total
+    return allocate_capped(total, [p["capacity"] for p in plan], pinned=pinned)
 
-    caps = [p["capacity"] for p in plan]
-    cap_total = sum(caps)
-    if cap_total == 0:
-        return [0]*len(plan), total
-
-    # Proporcional
-    raw = [total * c / cap_total for c in caps]
-    alloc = [min(int(round(x)), caps[i]) for i, x in enumerate(raw)]
-
-    # Ajuste por redondeo/caps
-    diff = total - sum(alloc)
-    i = 0
-    while diff != 0 and i < 10000:  # tope de seguridad
-        for j in range(len(alloc)):
-            if diff == 0:
-                break
-            if diff > 0 and alloc[j] < caps[j]:
-                alloc[j] += 1
-                diff -= 1
-            elif diff < 0 and alloc[j] > 0:
-                alloc[j] -= 1
-                diff += 1
-        i += 1
-
-    leftover = max(0, total - sum(alloc))
-    return alloc, leftover
-
-with st.expander("✏️ Distribuir manualmente con rebalance", expanded=False):
+@fragment("distribución manual")
+def manual_rebalance(username: str, month: str):
     manual_total = money_input("Monto a distribuir (CLP)", key="manual_monto", default=0)
     tipo2 = st.selectbox("Tipo de ingreso", ["Sueldo", "Quincena", "Otro"], index=1, key="manual_tipo")
     nota2 = st.text_input("Nota (opcional)", value="", key="manual_nota")
 
     plan = build_plan_for_user(username, month)
+    submitted = False
 
     if not plan:
         st.info("No hay categorías con capacidad disponible para este mes.")
@@ -238,7 +276,7 @@ with st.expander("✏️ Distribuir manualmente con rebalance", expanded=False):
         if submitted:
             if manual_total <= 0:
                 st.warning("Ingresa un monto mayor que cero.")
-                st.stop()
+                return
 
             # Limpia y recorta por capacidad
             edit_df["Asignar"] = edit_df[["Asignar", "Capacidad"]].min(axis=1)
@@ -253,103 +291,143 @@ with st.expander("✏️ Distribuir manualmente con rebalance", expanded=False):
                     f"Las filas fijadas suman {fmt_clp(fixed_sum)}, que es mayor al total {fmt_clp(manual_total)}. "
                     "Baja algún valor o desmarca Fijar."
                 )
-                st.stop()
+                return
 
             # Repartir el resto entre las NO fijadas, proporcional a su capacidad restante
-            free_df = edit_df.loc[~fixed_mask].copy()
-            free_total_target = manual_total - fixed_sum
-
-            # Si no hay libres, sólo se registran las fijadas
-            if free_df.empty:
-                final_df = edit_df.copy()
-            else:
-                caps = free_df["Capacidad"].tolist()
-                alloc, leftover = suggest_by_capacity(
-                    [{"capacity": c} for c in caps], free_total_target
-                )
-                free_df["Asignar"] = alloc
-                final_df = pd.concat([edit_df.loc[fixed_mask], free_df], ignore_index=True)
+            final_df = edit_df.copy()
+            pinned = {
+                i: int(v) for i, (v, fijar) in enumerate(zip(edit_df["Asignar"], fixed_mask)) if fijar
+            }
+            alloc, leftover = suggest_by_capacity(
+                [{"capacity": int(c)} for c in edit_df["Capacidad"]], manual_total, pinned=pinned
+            )
+            final_df["Asignar"] = alloc
 
             total_final = int(final_df["Asignar"].sum())
 
-            # Registrar ingreso + aportes
-            add_income(username, int(manual_total), f"{tipo2} - Manual editable - {nota2}".strip())
-            from db import add_contribution
-            applied_rows = 0
-            for _, row in final_df.iterrows():
-                val = int(row["Asignar"])
-                if val > 0:
-                    add_contribution(int(row["ID"]), username, val)
-                    applied_rows += 1
+            # Registrar ingreso + aportes (una sola transacción)
+            pairs = [(int(b_id), int(val)) for b_id, val in zip(final_df["ID"], final_df["Asignar"]) if int(val) > 0]
+            key = idempotency_key("manual", username, month, manual_total, tipo2, nota2, pairs)
+            _, applied = store.record_distribution(
+                username, int(manual_total), f"{tipo2} - Manual editable - {nota2}".strip(),
+                pairs, idempotency_key=key,
+            )
+            applied_rows = len(pairs)
 
             # Mostrar resultado
             shown = final_df.copy()
             shown["Asignar"] = shown["Asignar"].astype(int)
-            st.success(f"Aplicado: {applied_rows} aportes por un total de {fmt_clp(total_final)}.")
-            if total_final < manual_total:
-                st.info(f"No se pudo asignar {fmt_clp(manual_total - total_final)} porque ya no quedaba capacidad en las categorías.")
-            st.dataframe(
-                shown[["Categoría", "Capacidad", "Asignar", "Fijar"]].sort_values("Categoría"),
-                use_container_width=True, hide_index=True
+
+            def show():
+                if not applied:
+                    st.info("Esta distribución ya estaba registrada (no se aplicó dos veces).")
+                st.success(f"Aplicado: {applied_rows} aportes por un total de {fmt_clp(total_final)}.")
+                if total_final < manual_total:
+                    st.info(f"No se pudo asignar {fmt_clp(manual_total - total_final)} porque ya no quedaba capacidad en las categorías.")
+                st.dataframe(
+                    shown[["Categoría", "Capacidad", "Asignar", "Fijar"]].sort_values("Categoría"),
+                    use_container_width=True, hide_index=True
+                )
+
+            if applied:
+                after_write("manual", show)
+            show()
+    # Fuera del else: tras aplicar, la capacidad puede quedar en cero y no hay formulario.
+    if not submitted:
+        show_written("manual")
+
+with st.expander("✏️ Distribuir manualmente con rebalance", expanded=False):
+    manual_rebalance(username, month)
+
+# =======================
+#  Importar ingresos (CSV)
+# =======================
+with st.expander("📥 Importar ingresos desde CSV", expanded=False), metrics.section("importar CSV"):
+    st.caption("Encabezado: fecha, monto y opcionalmente usuario y nota. "
+               "Las filas ya importadas se omiten al volver a subir el archivo.")
+    archivo = st.file_uploader("Archivo CSV", type=["csv"], key="import_csv")
+    replay = st.checkbox("Distribuir cada ingreso en el mes de su fecha", value=False, key="import_replay")
+    if archivo is not None and not sql_ok:
+        st.info(SQL_ONLY)
+    elif archivo is not None and st.button("Importar", key="import_go"):
+        import importer
+        try:
+            with st.spinner("Importando..."), storage.sql_scope(store):
+                report = importer.import_upload(archivo, default_user=username, replay=replay)
+        except ValueError as e:
+            # Sin st.stop(): el resto de la página (tabs, panel, métricas) sigue.
+            st.error(f"No se pudo importar: {e}")
+        else:
+            st.success(
+                f"Leídas {report['read']} filas: {report['inserted']} importadas, "
+                f"{report['duplicates']} ya existían, {report['rejected']} rechazadas "
+                f"({report['rows_per_sec']} filas/s)."
             )
+            if report["rejected_rows"]:
+                st.dataframe(
+                    pd.DataFrame(report["rejected_rows"], columns=["Línea", "Motivo"]),
+                    use_container_width=True, hide_index=True,
+                )
+
+# =======================
+#  Exportar libro contable
+# =======================
+LEDGER_MIME = {"csv": "text/csv", "jsonl": "application/x-ndjson",
+               "parquet": "application/vnd.apache.parquet"}
+
+@fragment("exportar libro")
+def export_ledger():
+    import ledger, tempfile
+    st.caption("Todos los ingresos y aportes con su categoría. Se escribe por lotes "
+               "a un archivo temporal; meses vacíos = sin límite.")
+    c1, c2, c3 = st.columns(3)
+    desde = c1.text_input("Desde (YYYY-MM)", value="", key="ledger_from").strip() or None
+    hasta = c2.text_input("Hasta (YYYY-MM)", value="", key="ledger_to").strip() or None
+    quien = c3.selectbox("Usuario", ["Todos"] + usernames, key="ledger_user")
+    fmt = st.radio("Formato", ledger.FORMATS, horizontal=True, key="ledger_fmt")
+    params = (desde, hasta, quien, fmt)
+    if st.button("Preparar archivo", key="ledger_go"):
+        fd, tmp = tempfile.mkstemp(suffix="." + fmt)
+        os.close(fd)
+        try:
+            with st.spinner("Exportando..."), storage.sql_scope(store):
+                n = ledger.export(tmp, fmt, start=desde, end=hasta,
+                                  user=None if quien == "Todos" else quien)
+            # download_button necesita los bytes: el archivo final queda en memoria,
+            # pero nunca la lista de filas.
+            with open(tmp, "rb") as f:
+                st.session_state["ledger_file"] = (params, n, f.read())
+        except ValueError as e:
+            st.error(f"No se pudo exportar: {e}")
+            return
+        finally:
+            os.remove(tmp)
+    prepared = st.session_state.get("ledger_file")
+    if prepared and prepared[0] == params:
+        _, n, data = prepared
+        name = f"libro-{desde or 'inicio'}-{hasta or 'hoy'}.{fmt}"
+        st.download_button(f"Descargar {name} ({n} filas)", data, file_name=name,
+                           mime=LEDGER_MIME[fmt], key="ledger_download")
+
+with st.expander("📤 Exportar libro contable", expanded=False):
+    if not sql_ok:
+        st.info(SQL_ONLY)
+    else:
+        export_ledger()
 
 # =======================
 #  Tabs (sin 'Aportes manuales')
 # =======================
-tabs = st.tabs(["📊 Resumen", "📜 Historial"])
+tabs = st.tabs(["📊 Resumen", "📜 Historial", "📈 Análisis", "🔮 Proyección"])
 
 # -------- Resumen --------
-with tabs[0]:
-    rows = list_budgets(month)
-    # r = (b.id, template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json)
-    shared_rows = [r for r in rows if r[3] == "shared"]
-    my_rows     = [r for r in rows if (r[3] == "individual" and r[4] == username)]
+@fragment("tab Resumen", run_every=REFRESH_S or None)
+def resumen(username: str, month: str):
+    sdata, pdata = summary_rows_from(store, month, username)
 
     # ==== Tabla con tope por persona en categorías compartidas ====
     st.subheader("Gastos compartidos (visibles para ambos)")
 
-    sdata = []
-    for r in shared_rows:
-        b_id, tkey, name, ctype, owner, limit_total, shares_json = r
-
-        # Porcentajes por persona desde budgets.yaml (por defecto 50/50)
-        try:
-            shares = json.loads(shares_json) if shares_json else {}
-        except Exception:
-            shares = {}
-
-        jack_frac   = share_to_fraction(shares.get("Jack", 50))
-        jasmin_frac = share_to_fraction(shares.get("Jasmin", 50))
-
-        # Topes individuales
-        tope_jack   = int(round(limit_total * jack_frac))
-        tope_jasmin = int(round(limit_total * jasmin_frac))
-
-        # Aportes realizados
-        ap_jack   = sum_contribs_by_user(b_id, "Jack")
-        ap_jasmin = sum_contribs_by_user(b_id, "Jasmin")
-
-        # Estados individuales
-        est_jack   = "✅ Listo" if ap_jack >= tope_jack else f"⏳ {fmt_clp(ap_jack)}/{fmt_clp(tope_jack)}"
-        est_jasmin = "✅ Listo" if ap_jasmin >= tope_jasmin else f"⏳ {fmt_clp(ap_jasmin)}/{fmt_clp(tope_jasmin)}"
-
-        # Estado general (como referencia global)
-        total, pct, done = progress_of_row(r)
-        est_general = "✅ GASTO LISTO" if done else "⏳ En progreso"
-
-        sdata.append({
-            "Categoría":       name,
-            "Aportado Jack":   fmt_clp(ap_jack),
-            "Tope Jack":       fmt_clp(tope_jack),
-            "Estado Jack":     est_jack,
-            "Aportado Jasmin": fmt_clp(ap_jasmin),
-            "Tope Jasmin":     fmt_clp(tope_jasmin),
-            "Estado Jasmin":   est_jasmin,
-            "Aportado total":  fmt_clp(total),
-            "Límite total":    fmt_clp(limit_total),
-            "Estado general":  est_general,
-        })
-
     if sdata:
         cols = [
             "Categoría",
@@ -364,40 +442,224 @@ with tabs[0]:
 
     # ==== Tus categorías individuales ====
     st.subheader(f"Tus categorías (solo {username})")
-    pdata = []
-    for r in my_rows:
-        total_u = sum_contribs_by_user(r[0], username)
-        total_cat, pct, done = progress_of_row(r)
-        state = "✅ GASTO LISTO" if done else "⏳ En progreso"
-        pdata.append({
-            "Categoría":            r[2],
-            "Tu aporte":            fmt_clp(total_u),
-            "Límite (tu objetivo)": fmt_clp(r[5]),
-            "Estado":               state
-        })
     if pdata:
         pdf = pd.DataFrame(pdata)
         st.dataframe(pdf, use_container_width=True, hide_index=True)
     else:
         st.info("No tienes categorías personales configuradas.")
 
+with tabs[0]:
+    resumen(username, month)
+
 # -------- Historial --------
-with tabs[1]:
-    st.subheader("Tus últimos ingresos")
-    rows = incomes_for_user(username, limit=50)
-    if rows:
-        df = pd.DataFrame([
+HIST_PAGE = 50
+
+def history_frame(kind, rows):
+    """Filas de history_page -> tabla del Historial."""
+    if kind == "incomes":
+        return pd.DataFrame([
             {"Monto": fmt_clp(a), "Fecha": ts.replace("T", " "), "Nota": (note or "")}
-            for a, ts, note in rows
-        ])
-        st.dataframe(df, use_container_width=True)
+            for _id, ts, a, note in rows
+        ], columns=["Monto", "Fecha", "Nota"])
+    return pd.DataFrame([
+        {"Monto": fmt_clp(a), "Fecha": ts.replace("T", " "), "Mes": m or "", "Categoría": name or ""}
+        for _id, ts, a, m, name, _inc in rows
+    ], columns=["Monto", "Fecha", "Mes", "Categoría"])
+
+def load_more_history(username, filters):
+    # Callback de "Cargar más": corre antes del rerun y agrega sólo la página siguiente.
+    rows, cursor = store.history_page(username, cursor=st.session_state["hist_cursor"],
+                                      limit=HIST_PAGE, **filters)
+    st.session_state["hist_df"] = pd.concat(
+        [st.session_state["hist_df"], history_frame(filters["kind"], rows)], ignore_index=True)
+    st.session_state["hist_cursor"] = cursor
+
+@fragment("tab Historial")
+def historial(username: str):
+    st.subheader("Tu historial")
+    hc1, hc2, hc3 = st.columns([1, 2, 2])
+    with hc1:
+        kind = st.radio("Ver", ["Ingresos", "Aportes"], key="hist_kind")
+    with hc2:
+        rango = st.date_input("Rango de fechas (opcional)", value=(), key="hist_rango")
+    with hc3:
+        cats = {"(todas)": None}
+        if kind == "Aportes":
+            cats.update({
+                f"{name} ({'compartido' if ctype == 'shared' else owner})": ckey
+                for ckey, name, ctype, owner in store.list_categories()
+                if ctype == "shared" or owner == username
+            })
+        cat_label = st.selectbox("Categoría", list(cats), key="hist_cat", disabled=kind != "Aportes")
+
+    date_from = rango[0] if len(rango) > 0 else None
+    date_to = rango[1] if len(rango) > 1 else date_from
+    filters = dict(
+        kind="incomes" if kind == "Ingresos" else "contributions",
+        date_from=date_from, date_to=date_to, category=cats.get(cat_label),
+    )
+
+    # La tabla ya armada y el cursor de la siguiente página viven en
+    # session_state: un rerun no vuelve a consultar y "Cargar más" trae y
+    # convierte sólo la página nueva. Si cambian los filtros o hubo escrituras
+    # (data_version), se vuelve a la primera página.
+    sig = json.dumps([username, filters, store.data_version()], default=str)
+    if st.session_state.get("hist_sig") != sig:
+        rows, cursor = store.history_page(username, limit=HIST_PAGE, **filters)
+        st.session_state.update(hist_sig=sig, hist_df=history_frame(filters["kind"], rows),
+                                hist_cursor=cursor)
+    df, cursor = st.session_state["hist_df"], st.session_state["hist_cursor"]
+
+    if df.empty:
+        st.info("Sin movimientos registrados para estos filtros.")
     else:
-        st.info("Sin ingresos registrados aún.")
+        st.dataframe(df, use_container_width=True, hide_index=True)
 
-st.caption("Edita límites en budgets.yaml. Cada nuevo mes se crea automáticamente con los límites configurados.")
+    if cursor is not None:
+        st.button("⬇️ Cargar más", key="hist_more", on_click=load_more_history, args=(username, filters))
 
+with tabs[1]:
+    historial(username)
 
+# -------- Análisis --------
+with tabs[2], metrics.section("tab Análisis"):
+    if not sql_ok:
+        st.info(SQL_ONLY)
+    else:
+        with storage.sql_scope(store):
+            import analytics
+
+            span = st.select_slider("Período", options=[6, 12, 24, 36, 60, 120], value=12,
+                                    format_func=lambda n: f"{n} meses", key="an_span")
+            an_months = analytics.month_range(month, span)
+            # Una consulta para todo el período; el resto es groupby/pivot en memoria.
+            df = analytics.visible(analytics.frame(an_months[0], an_months[-1]), username)
+            if df.empty:
+                st.info("No hay presupuestos en este período.")
+            else:
+                incomes = analytics.incomes_frame(an_months[0], an_months[-1])
+
+                st.subheader("Ahorro por mes")
+                ahorro = analytics.savings(df, username, an_months)
+                st.bar_chart(ahorro.rename("Ahorro"))
+                flujo = analytics.contributed_vs_income(df, incomes, username, an_months)
+                c1, c2 = st.columns(2)
+                c1.metric("Ahorro del período", fmt_clp(int(ahorro.sum())))
+                ingresos_total = int(flujo["Ingresos"].sum())
+                c2.metric("Tasa de ahorro", f"{100 * ahorro.sum() / ingresos_total:.1f}%" if ingresos_total else "—")
+
+                st.subheader("Ingresos vs aportado")
+                st.line_chart(flujo)
+
+                st.subheader("Cumplimiento por categoría")
+                rate = analytics.fill_rate(df, an_months).rename(columns=analytics.labels(df)) * 100
+                st.line_chart(rate)
+                st.caption("Porcentaje del límite mensual cubierto (máximo 100%).")
+
+                st.subheader("Reparto de gastos compartidos")
+                split = analytics.shared_split(df, an_months) * 100
+                if split.dropna(how="all").empty:
+                    st.info("Sin aportes a categorías compartidas en el período.")
+                else:
+                    st.bar_chart(split)
+                    st.caption("Porcentaje de lo aportado a compartidos que puso cada uno.")
+
+# -------- Proyección --------
+def band_chart(months, bands, title):
+    """Banda P10–P90 con la mediana (bands = arreglo (3, M) de simulation.bands)."""
+    import altair as alt
+
+    data = pd.DataFrame({"Mes": months, "P10": bands[0], "P50": bands[1], "P90": bands[2]})
+    base = alt.Chart(data).encode(x=alt.X("Mes:O", title=None))
+    band = base.mark_area(opacity=0.3).encode(
+        y=alt.Y("P10:Q", title=title), y2="P90:Q",
+        tooltip=["Mes", alt.Tooltip("P10:Q", format=",.0f"), alt.Tooltip("P50:Q", format=",.0f"),
+                 alt.Tooltip("P90:Q", format=",.0f")],
+    )
+    st.altair_chart(band + base.mark_line().encode(y="P50:Q"), use_container_width=True)
+
+with tabs[3], metrics.section("tab Proyección"):
+    if not sql_ok:
+        st.info(SQL_ONLY)
+    else:
+        with storage.sql_scope(store):
+            import simulation
+
+            st.caption("Simula miles de escenarios con ingresos que varían como en los meses anteriores "
+                       "y los reparte con las mismas reglas que *Distribuir ahora*. No escribe nada.")
+            pc1, pc2, pc3 = st.columns(3)
+            with pc1:
+                horizonte = st.slider("Meses a proyectar", 6, 60, 24, key="sim_meses")
+                meses_hist = st.slider("Meses de historial", 3, 36, 12, key="sim_hist")
+            with pc2:
+                escenarios = st.select_slider("Escenarios", options=[1000, 2000, 5000, 10000, 20000],
+                                              value=10000, key="sim_n")
+                metodo = st.radio("Variación de ingresos", ["bootstrap", "normal"], key="sim_metodo",
+                                  format_func=lambda m: "Repetir meses reales" if m == "bootstrap" else "Normal (media ± desv.)")
+            with pc3:
+                meta = money_input("Meta de ahorro acumulado (CLP)", key="sim_meta", default=0)
+
+            try:
+                proy = simulation.project(horizonte, escenarios, meses_hist, metodo, int(meta))
+            except ValueError as e:
+                st.info(str(e))
+            else:
+                st.caption(f"Historial usado: {len(proy['history_months'])} mes(es) con ingresos. "
+                           "Banda = percentiles 10–90, línea = mediana.")
+                st.subheader("Ahorro acumulado")
+                band_chart(proy["months"], proy["savings"][username], "Ahorro acumulado (CLP)")
+                if meta > 0:
+                    idx = proy["goal_month"][username]
+                    if idx is None:
+                        st.warning(f"En la mitad de los escenarios no se llega a {fmt_clp(meta)} en {horizonte} meses.")
+                    else:
+                        prob_fin = proy["goal_prob"][username][-1]
+                        st.success(f"Meta de {fmt_clp(meta)}: mediana en **{month_name(proy['months'][idx])}** "
+                                   f"({100 * prob_fin:.0f}% de los escenarios la alcanzan en el período).")
+
+                st.subheader("Probabilidad de completar cada categoría")
+                prob = pd.DataFrame(proy["complete_prob"].T * 100, index=proy["months"], columns=proy["categories"])
+                visibles = [c for c, o in zip(proy["categories"], proy["owners"]) if o in (None, username)]
+                st.dataframe(
+                    prob[visibles].mean().rename("% de meses completa").round(1).to_frame(),
+                    use_container_width=True,
+                )
+                st.line_chart(prob[visibles])
 
+                st.subheader("Ingreso sin asignar por mes")
+                band_chart(proy["months"], proy["leftover"][username], "Sin asignar (CLP)")
 
+st.caption("Edita límites en budgets.yaml. Cada nuevo mes se crea automáticamente con los límites configurados.")
 
+# =======================
+#  Panel de depuración (tiempos del rerun)
+# =======================
+def debug_panel():
+    run = metrics.current_run()
+    snap = metrics.snapshot(top=10)
+    with st.sidebar.expander("🐞 Tiempos de este rerun", expanded=True):
+        st.caption(f"Total {run['total_ms']:.1f} ms · {run['queries']} consultas SQL "
+                   f"({run['query_ms']:.1f} ms) · umbral lento {metrics.SLOW_QUERY_MS:g} ms")
+        if run["sections"]:
+            st.dataframe(pd.DataFrame(run["sections"]).rename(columns={
+                "name": "Sección", "ms": "ms", "queries": "Consultas", "query_ms": "ms SQL",
+            }), use_container_width=True, hide_index=True)
+        c = cache.stats()
+        st.caption(f"Proceso: {snap['connections']} conexiones creadas, {snap['queries']} consultas · "
+                   f"caché {c['size']}/{c['maxsize']} ({c['hits']} aciertos, {c['misses']} fallos)")
+        if snap["statements"]:
+            st.write("Sentencias más costosas (acumulado)")
+            st.dataframe(pd.DataFrame(snap["statements"])[["sql", "count", "total_ms", "max_ms"]],
+                         use_container_width=True, hide_index=True)
+        if snap["slow_queries"]:
+            st.write("Consultas lentas")
+            st.dataframe(pd.DataFrame(snap["slow_queries"][-10:]), use_container_width=True, hide_index=True)
+        st.download_button(
+            "⬇️ Exportar métricas (JSON)",
+            data=json.dumps(metrics.snapshot(top=200), indent=2, ensure_ascii=False),
+            file_name="metricas.json", mime="application/json",
+        )
 
+if st.sidebar.checkbox("🐞 Panel de depuración", value=os.environ.get("BUDGET_DEBUG") == "1", key="debug_panel"):
+    debug_panel()
+metrics.end_run()
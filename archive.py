@@ -0,0 +1,129 @@
+"""
+Cierre de meses: compacta la base "caliente" y archiva el detalle.
+
+close_month("2025-08"):
+  1. Escribe los aportes e ingresos crudos del mes en
+     <carpeta de DB_PATH>/archive/2025-08.contributions.csv.gz y .incomes.csv.gz
+  2. Reemplaza los aportes del mes por una fila por (presupuesto, usuario)
+     (contributions.rollup_n = cuántas filas resume) y los ingresos por
+     income_rollups(month, user). balances no cambia: los triggers restan lo
+     borrado y suman el rollup. Los aportes de otros meses que venían de un
+     ingreso archivado quedan con income_id NULL.
+  3. Marca el mes en month_closures; desde ahí no admite movimientos nuevos.
+
+Todo ocurre dentro de una transacción de escritura: si algo falla, la DB queda
+como estaba (y el archivo se vuelve a escribir en el próximo intento).
+El detalle sigue disponible con read_archive() / archived_history().
+"""
+import csv, datetime, gzip, os
+
+import db
+
+CONTRIB_COLUMNS = ("id", "budget_id", "user", "amount", "ts", "income_id", "month", "template_key")
+INCOME_COLUMNS = ("id", "user", "amount", "ts", "note", "idem_key")
+
+def archive_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(db.current_path())), "archive")
+
+def archive_path(month, kind):
+    if kind not in ("contributions", "incomes"):
+        raise ValueError(f"kind inválido: {kind!r}")
+    return os.path.join(archive_dir(), f"{month}.{kind}.csv.gz")
+
+def _dump(cursor, columns, path):
+    """Escribe el cursor (streaming) a un CSV gzip de forma atómica. Devuelve filas escritas."""
+    tmp = path + ".tmp"
+    n = 0
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for row in cursor:
+            w.writerow(row)
+            n += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return n
+
+def close_month(month):
+    """Cierra un mes ya terminado. Devuelve un resumen con conteos y archivos."""
+    db._check_month(month)
+    if month >= db.current_month():
+        raise ValueError(f"Sólo se pueden cerrar meses terminados ({month} aún no termina).")
+    os.makedirs(archive_dir(), exist_ok=True)
+    start, end = month, db._next_month(month)
+    c_path, i_path = archive_path(month, "contributions"), archive_path(month, "incomes")
+
+    with db.transaction() as conn:
+        if conn.execute("SELECT 1 FROM month_closures WHERE month=?", (month,)).fetchone():
+            raise ValueError(f"El mes {month} ya está cerrado.")
+
+        n_c = _dump(conn.execute("""
+            SELECT c.id, c.budget_id, c.user, c.amount, c.ts, c.income_id, b.month, b.template_key
+            FROM contributions c JOIN budgets b ON b.id = c.budget_id
+            WHERE b.month = ? AND c.rollup_n IS NULL
+            ORDER BY c.id
+        """, (month,)), CONTRIB_COLUMNS, c_path)
+        n_i = _dump(conn.execute("""
+            SELECT id, user, amount, ts, note, idem_key FROM incomes
+            WHERE ts >= ? AND ts < ? ORDER BY id
+        """, (start, end)), INCOME_COLUMNS, i_path)
+
+        # Primero el rollup (rollup_n no nulo) y después se borran las filas crudas.
+        conn.execute("""
+            INSERT INTO contributions(budget_id, user, amount, ts, rollup_n)
+            SELECT c.budget_id, c.user, SUM(c.amount), MAX(c.ts), COUNT(*)
+            FROM contributions c JOIN budgets b ON b.id = c.budget_id
+            WHERE b.month = ? AND c.rollup_n IS NULL
+            GROUP BY c.budget_id, c.user
+        """, (month,))
+        conn.execute("""
+            DELETE FROM contributions
+            WHERE rollup_n IS NULL AND budget_id IN (SELECT id FROM budgets WHERE month = ?)
+        """, (month,))
+        conn.execute("""
+            INSERT INTO income_rollups(month, user, amount, n)
+            SELECT ?, user, SUM(amount), COUNT(*) FROM incomes
+            WHERE ts >= ? AND ts < ? GROUP BY user
+        """, (month, start, end))
+        # Un ingreso del mes puede haber aportado a presupuestos de otro mes
+        # (p. ej. importado con --replay): sin esto quedarían colgando.
+        conn.execute("""
+            UPDATE contributions SET income_id = NULL
+            WHERE income_id IN (SELECT id FROM incomes WHERE ts >= ? AND ts < ?)
+        """, (start, end))
+        conn.execute("DELETE FROM incomes WHERE ts >= ? AND ts < ?", (start, end))
+        conn.execute("""
+            INSERT INTO month_closures(month, closed_at, contributions_file, incomes_file,
+                                       n_contributions, n_incomes)
+            VALUES(?,?,?,?,?,?)
+        """, (month, datetime.datetime.now().isoformat(timespec="seconds"),
+              os.path.basename(c_path), os.path.basename(i_path), n_c, n_i))
+        db._bump_data_version(conn)
+
+    return {"month": month, "contributions": n_c, "incomes": n_i,
+            "contributions_file": c_path, "incomes_file": i_path}
+
+def close_months(start, end):
+    """Cierra todos los meses abiertos con presupuestos o ingresos entre start y end."""
+    db._check_month(start)
+    db._check_month(end)
+    closed = db.closed_months()
+    with db.connection() as conn:
+        months = sorted({r[0] for r in conn.execute(
+            "SELECT DISTINCT month FROM budgets WHERE month BETWEEN ? AND ?", (start, end))} |
+            {r[0] for r in conn.execute(
+            "SELECT DISTINCT substr(ts, 1, 7) FROM incomes WHERE ts >= ? AND ts < ?", (start, db._next_month(end)))})
+    return [close_month(m) for m in months if m not in closed and m < db.current_month()]
+
+def read_archive(month, kind):
+    """Itera (sin cargar todo) las filas archivadas de un mes como dicts."""
+    path = archive_path(month, kind)
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+def archived_history(user, month, kind="incomes"):
+    """Filas archivadas de `user` en un mes cerrado."""
+    return [r for r in read_archive(month, kind) if r["user"] == user]
@@ -0,0 +1,267 @@
+"""
+Respaldos en caliente de la base con la API de backup de SQLite.
+
+backup() copia la base página a página (PAGES por paso) desde una conexión
+propia y duerme PAUSE_MS entre pasos. Esa conexión mantiene abierta una
+transacción de lectura durante toda la copia: con WAL eso fija una foto
+consistente sin bloquear a nadie (las sesiones siguen leyendo y escribiendo;
+sin ella, cada escritura ajena reiniciaría la copia desde cero y con uso
+continuo no terminaría nunca). Nunca queda un archivo a medio escribir, como
+al copiar budget.db con cp. La copia se verifica con PRAGMA quick_check, se
+comprime a <carpeta>/<base>-AAAAMMDD-HHMMSS-ffffff.db.gz (con microsegundos:
+dos respaldos del mismo segundo, como el de seguridad que toma restore(), se
+ordenan por nombre) y se conservan las KEEP más recientes. En una base en memoria (sin WAL) la lectura sí frena a los
+escritores mientras dura la copia.
+
+restore(archivo) vuelve la base a un respaldo: primero respalda el estado
+actual y después lo reemplaza con la misma API (una sola transacción de
+escritura), aplica las migraciones pendientes y avanza data_version para que
+ningún proceso siga sirviendo lecturas de la caché ni dé por verificados los
+presupuestos del mes (bootstrap vuelve a correr ensure_budgets_for_month).
+
+start_scheduler() deja un hilo de fondo que respalda cada EVERY_MIN minutos
+(la app lo arranca si BUDGET_BACKUP_EVERY_MIN > 0).
+
+Variables de entorno:
+  BUDGET_BACKUP_DIR        carpeta (por defecto backups/ junto a la base)
+  BUDGET_BACKUP_KEEP       respaldos que se conservan (7)
+  BUDGET_BACKUP_PAGES      páginas por paso (256; 4 KB cada una)
+  BUDGET_BACKUP_PAUSE_MS   pausa entre pasos (10)
+  BUDGET_BACKUP_EVERY_MIN  cada cuántos minutos respalda la app (0 = nunca)
+"""
+import datetime, gzip, os, re, shutil, sqlite3, threading, time
+
+import cache
+import db
+
+BACKUP_DIR = os.environ.get("BUDGET_BACKUP_DIR")
+KEEP = int(os.environ.get("BUDGET_BACKUP_KEEP", "7"))
+PAGES = int(os.environ.get("BUDGET_BACKUP_PAGES", "256"))
+PAUSE_MS = float(os.environ.get("BUDGET_BACKUP_PAUSE_MS", "10"))
+EVERY_MIN = float(os.environ.get("BUDGET_BACKUP_EVERY_MIN", "0"))
+
+def _log():
+    import logging
+    return logging.getLogger("finanzas.backup")
+
+def _stem(path):
+    if path.startswith(db.MEMORY_PREFIX):
+        return path[len(db.MEMORY_PREFIX):] or "budget"
+    return os.path.splitext(os.path.basename(path))[0]
+
+def backup_dir(path=None):
+    path = path or db.current_path()
+    if BACKUP_DIR:
+        return BACKUP_DIR
+    base = db.DB_PATH if path.startswith(db.MEMORY_PREFIX) else path
+    return os.path.join(os.path.dirname(os.path.abspath(base)), "backups")
+
+def list_backups(directory=None, path=None):
+    """Respaldos de la base, del más nuevo al más viejo: [(ruta, bytes, fecha ISO)]."""
+    directory = directory or backup_dir(path)
+    # Sufijo de 6 dígitos: microsegundos; más corto: el "-n" de los nombres viejos
+    # (sin microsegundos) para dos respaldos del mismo segundo.
+    pattern = re.compile(re.escape(_stem(path or db.current_path())) + r"-(\d{8}-\d{6})(?:-(\d+))?\.db\.gz$")
+    if not os.path.isdir(directory):
+        return []
+    out = []
+    for name in os.listdir(directory):
+        m = pattern.match(name)
+        if m:
+            when = datetime.datetime.strptime(m.group(1), "%Y%m%d-%H%M%S")
+            suffix, seq = m.group(2) or "", 0
+            if len(suffix) == 6:
+                when = when.replace(microsecond=int(suffix))
+            elif suffix:
+                seq = int(suffix)
+            out.append((when, seq, os.path.join(directory, name)))
+    out.sort(reverse=True)
+    return [(full, os.path.getsize(full), when.isoformat()) for when, _, full in out]
+
+def _copy(src, dst, pages, pause_ms):
+    """src.backup(dst) por pasos con pausa entre ellos. Devuelve cuántos pasos dio."""
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause_ms:
+            time.sleep(pause_ms / 1000)
+
+    src.backup(dst, pages=max(1, int(pages)), progress=progress)
+    return steps
+
+def _check(conn):
+    result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if result != "ok":
+        raise ValueError(f"respaldo dañado: {result}")
+
+def backup(directory=None, keep=None, pages=None, pause_ms=None, path=None):
+    """
+    Respalda la base activa (o `path`) sin bloquear a las sesiones.
+    Devuelve dict con file, bytes, compressed, pages, steps, seconds, removed.
+    """
+    path = path or db.current_path()
+    directory = directory or backup_dir(path)
+    keep = KEEP if keep is None else int(keep)
+    pages = PAGES if pages is None else pages
+    pause_ms = PAUSE_MS if pause_ms is None else pause_ms
+    os.makedirs(directory, exist_ok=True)
+
+    t0 = time.perf_counter()
+    while True:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        final = os.path.join(directory, f"{_stem(path)}-{stamp}.db.gz")
+        if not os.path.exists(final):
+            break
+        time.sleep(0.001)
+    raw = final[:-len(".gz")] + ".tmp"
+    src = db.get_conn(path)
+    try:
+        dst = sqlite3.connect(raw)
+        try:
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()  # fija la foto
+            steps = _copy(src, dst, pages, pause_ms)
+            src.execute("COMMIT")
+            _check(dst)
+            n_pages = dst.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            dst.close()
+    except BaseException:
+        if os.path.exists(raw):
+            os.remove(raw)
+        raise
+    finally:
+        src.close()
+
+    try:
+        with open(raw, "rb") as f_in, gzip.open(final + ".tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(final + ".tmp", final)
+        size = os.path.getsize(raw)
+    finally:
+        for leftover in (raw, final + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    removed = []
+    for old, _, _ in list_backups(directory, path)[max(1, keep):]:
+        os.remove(old)
+        removed.append(old)
+    return {
+        "file": final,
+        "bytes": size,
+        "compressed": os.path.getsize(final),
+        "pages": n_pages,
+        "steps": steps,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "removed": removed,
+    }
+
+def restore(file, pages=None, path=None, safety_backup=True):
+    """
+    Reemplaza la base activa (o `path`) por el respaldo `file` (.db.gz o .db).
+    Antes respalda el estado actual (safety_backup). Devuelve dict con
+    restored, safety (el respaldo previo o None) y seconds.
+    """
+    path = path or db.current_path()
+    pages = PAGES if pages is None else pages
+    if not os.path.isfile(file):
+        raise ValueError(f"no existe el respaldo: {file}")
+    t0 = time.perf_counter()
+
+    # Se descomprime antes del respaldo de seguridad: la rotación podría borrar `file`.
+    raw = os.path.join(os.path.dirname(os.path.abspath(file)), f".restore-{os.getpid()}.db")
+    try:
+        if file.endswith(".gz"):
+            with gzip.open(file, "rb") as f_in, open(raw, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+        else:
+            shutil.copyfile(file, raw)
+        src = sqlite3.connect(raw)
+        try:
+            try:
+                _check(src)
+                src.execute("SELECT 1 FROM schema_version LIMIT 1")
+            except sqlite3.DatabaseError as e:
+                raise ValueError(f"{file} no es un respaldo válido: {e}") from e
+
+            safety = backup(path=path)["file"] if safety_backup else None
+            with db.use(path):
+                old_version = db.data_version()
+            dst = db.get_conn(path)
+            try:
+                # Sin pausas: la base destino queda bloqueada hasta el último paso.
+                _copy(src, dst, pages, 0)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    finally:
+        if os.path.exists(raw):
+            os.remove(raw)
+
+    with db.use(path):
+        db.init_db()  # un respaldo viejo puede no tener las últimas migraciones
+        with db.transaction() as conn:
+            # data_version nunca retrocede: si no, la caché podría servir datos de antes.
+            conn.execute("UPDATE data_version SET n = MAX(n, ?) + 1 WHERE id=1", (old_version,))
+    cache.clear()
+    import bootstrap
+    bootstrap.reset()
+    return {"restored": file, "safety": safety, "seconds": round(time.perf_counter() - t0, 3)}
+
+# === RESPALDOS PROGRAMADOS ====================================================
+
+class _Scheduler:
+    def __init__(self, path, every_min, directory):
+        self.path, self.every, self.directory = path, every_min * 60, directory
+        self.last = None  # último resultado (o excepción)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+        self.thread.start()
+
+    def _wait(self):
+        # Tras un reinicio no respalda de inmediato si el último respaldo es reciente.
+        latest = list_backups(self.directory, self.path)
+        if not latest:
+            return 0
+        age = (datetime.datetime.now() - datetime.datetime.fromisoformat(latest[0][2])).total_seconds()
+        return max(0.0, self.every - age)
+
+    def _run(self):
+        while not self.stopping.wait(self._wait()):
+            try:
+                self.last = backup(self.directory, path=self.path)
+                _log().info("respaldo %s (%d páginas, %.1f s)", self.last["file"],
+                            self.last["pages"], self.last["seconds"])
+            except Exception as e:
+                self.last = e
+                _log().exception("falló el respaldo de %s", self.path)
+                self.stopping.wait(min(self.every, 300))  # reintenta más tarde
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def start_scheduler(every_min=None, directory=None, path=None):
+    """
+    Respalda `path` cada every_min minutos en un hilo de fondo. Idempotente:
+    una sola tarea por base y proceso. Con every_min <= 0 no hace nada (None).
+    """
+    every_min = EVERY_MIN if every_min is None else every_min
+    if every_min <= 0:
+        return None
+    path = path or db.current_path()
+    with _schedulers_lock:
+        s = _schedulers.get(path)
+        if s is None:
+            s = _schedulers[path] = _Scheduler(path, every_min, directory or backup_dir(path))
+        return s
+
+def stop_scheduler(path=None):
+    with _schedulers_lock:
+        s = _schedulers.pop(path or db.current_path(), None)
+    if s is not None:
+        s.stopping.set()
+        s.thread.join()
@@ -0,0 +1,212 @@
+"""
+Benchmarks de db.py / utils.py sobre una base sintética (nunca toca budget.db).
+
+    python bench.py                              # tamaño "small"
+    python bench.py --size large --save base.json
+    python bench.py --size large --compare base.json   # exit 1 si hay regresión
+
+Genera categorías, años de presupuestos mensuales, aportes e ingresos
+aleatorios (semilla fija), mide cada función varias veces y reporta
+p50/p95 en milisegundos y cuántas sentencias SQL ejecuta por llamada.
+"""
+import argparse, datetime, json, os, platform, random, sqlite3, sys, tempfile, time
+
+import db
+import utils
+from allocation import allocate_capped
+
+SIZES = {
+    #          categorías, años, aportes,  ingresos
+    "small":  (20,         1,    5_000,    500),
+    "medium": (100,        5,    100_000,  10_000),
+    "large":  (1_000,      10,   500_000,  100_000),
+}
+USERS = ("Jack", "Jasmin")
+
+# ---------- conteo de consultas ----------
+_queries = [0]
+
+def _count_queries(conn):
+    def trace(_sql):
+        _queries[0] += 1
+    conn.set_trace_callback(trace)
+
+# ---------- datos sintéticos ----------
+
+def _months_back(n):
+    """Los últimos n meses (YYYY-MM), terminando en el actual."""
+    y, m = map(int, db.current_month().split("-"))
+    out = []
+    for _ in range(n):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y, m - 1) if m > 1 else (y - 1, 12)
+    return out[::-1]
+
+def generate(path, categories, years, contributions, incomes, seed=7):
+    """Crea una base sintética en `path` y devuelve la lista de meses."""
+    rnd = random.Random(seed)
+    db.DB_PATH = path
+    db.close_all()
+    db.init_db()
+    db.ensure_users(USERS)
+
+    cats = []
+    for i in range(categories):
+        if i % 3 == 0:
+            cats.append({"key": f"cat{i}", "name": f"Compartida {i}", "type": "shared",
+                         "limit_total": rnd.randrange(10_000, 500_000, 1000),
+                         "shares": {"Jack": 0.5, "Jasmin": 0.5}})
+        else:
+            cats.append({"key": f"cat{i}", "name": f"Categoría {i}", "type": "individual",
+                         "owner": USERS[i % 2], "limit_total": rnd.randrange(10_000, 300_000, 1000)})
+    db.sync_templates(cats)
+    months = _months_back(years * 12)
+    db.ensure_budgets_for_range(months[0], months[-1])
+    with db.transaction() as conn:
+        budget_ids = [r[0] for r in conn.execute("SELECT id FROM budgets")]
+
+        def ts_in(month):
+            return f"{month}-{rnd.randint(1, 28):02d}T{rnd.randint(0, 23):02d}:00:00"
+
+        batch = []
+        for _ in range(contributions):
+            batch.append((rnd.choice(budget_ids), rnd.choice(USERS),
+                          rnd.randrange(1_000, 50_000, 100), ts_in(rnd.choice(months))))
+            if len(batch) >= 10_000:
+                conn.executemany("INSERT INTO contributions(budget_id, user, amount, ts) VALUES(?,?,?,?)", batch)
+                batch = []
+        conn.executemany("INSERT INTO contributions(budget_id, user, amount, ts) VALUES(?,?,?,?)", batch)
+        conn.executemany(
+            "INSERT INTO incomes(user, amount, ts, note) VALUES(?,?,?,?)",
+            [(rnd.choice(USERS), rnd.randrange(100_000, 2_000_000, 1000), ts_in(rnd.choice(months)), "bench")
+             for _ in range(incomes)],
+        )
+    conn = db.get_conn()
+    conn.execute("ANALYZE")
+    conn.close()
+    return months
+
+# ---------- medición ----------
+
+def _pct(sorted_vals, p):
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def measure(fn, repeat):
+    times, queries = [], []
+    for i in range(repeat):
+        q0 = _queries[0]
+        t0 = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - t0) * 1000)
+        queries.append(_queries[0] - q0)
+    times.sort()
+    return {
+        "p50_ms": round(_pct(times, 50), 4),
+        "p95_ms": round(_pct(times, 95), 4),
+        "mean_ms": round(sum(times) / len(times), 4),
+        "queries": round(sum(queries) / len(queries), 2),
+    }
+
+def _summary_uncached(month, username):
+    # summary_rows.uncached() sólo salta la capa de afuera: por dentro seguiría
+    # leyendo month_snapshot de la caché.
+    return utils._summary(db.month_snapshot.uncached(month), username)
+
+def run(months, repeat, seed=11):
+    rnd = random.Random(seed)
+    month = months[-1]
+    with db.connection() as conn:
+        budget_ids = [r[0] for r in conn.execute("SELECT id FROM budgets WHERE month=?", (month,))]
+        caps = [r[0] for r in conn.execute("SELECT limit_total FROM budgets WHERE month=?", (month,))]
+
+    cases = {
+        "list_budgets": lambda i: db.list_budgets.uncached(month),
+        "month_snapshot": lambda i: db.month_snapshot.uncached(month),
+        "month_snapshot (caché)": lambda i: db.month_snapshot(month),
+        "sum_contribs": lambda i: db.sum_contribs(rnd.choice(budget_ids)),
+        "sum_contribs_by_user": lambda i: db.sum_contribs_by_user(rnd.choice(budget_ids), rnd.choice(USERS)),
+        "ensure_budgets_for_month (existente)": lambda i: db.ensure_budgets_for_month(month),
+        "ensure_budgets_for_month (nuevo)": lambda i: db.ensure_budgets_for_month(f"{2100 + i:04d}-01"),
+        "incomes_for_user": lambda i: db.incomes_for_user.uncached(rnd.choice(USERS), limit=50),
+        "resumen (summary_rows)": lambda i: _summary_uncached(month, rnd.choice(USERS)),
+        "resumen (caché)": lambda i: utils.summary_rows(month, rnd.choice(USERS)),
+        "proportional_allocate": lambda i: utils.proportional_allocate(
+            rnd.choice(USERS), rnd.randrange(50_000, 1_000_000, 1000), month, note="bench"),
+        "allocate_capped": lambda i: allocate_capped(sum(caps) // 2, caps),
+    }
+    return {name: measure(fn, repeat) for name, fn in cases.items()}
+
+# ---------- reporte / baseline ----------
+
+def report(results, baseline=None, tolerance=1.25):
+    regressions = []
+    print(f"{'caso':40} {'p50 ms':>10} {'p95 ms':>10} {'queries':>8}  vs base")
+    for name, r in results.items():
+        extra = ""
+        base = (baseline or {}).get(name)
+        if base and base["p50_ms"] > 0:
+            ratio = r["p50_ms"] / base["p50_ms"]
+            extra = f"x{ratio:.2f}"
+            if ratio > tolerance:
+                extra += "  <-- REGRESIÓN"
+                regressions.append(name)
+        print(f"{name:40} {r['p50_ms']:10.3f} {r['p95_ms']:10.3f} {r['queries']:8.1f}  {extra}")
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks de db.py/utils.py")
+    ap.add_argument("--size", choices=SIZES, default="small")
+    ap.add_argument("--categories", type=int)
+    ap.add_argument("--years", type=int)
+    ap.add_argument("--contributions", type=int)
+    ap.add_argument("--incomes", type=int)
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--db", help="ruta de la base sintética (por defecto, temporal)")
+    ap.add_argument("--save", help="guarda los resultados como baseline JSON")
+    ap.add_argument("--compare", help="compara contra un baseline JSON")
+    ap.add_argument("--tolerance", type=float, default=1.25, help="p50 nuevo / p50 base tolerado")
+    args = ap.parse_args(argv)
+
+    cats, years, contribs, incs = SIZES[args.size]
+    params = {
+        "categories": args.categories or cats,
+        "years": args.years or years,
+        "contributions": args.contributions if args.contributions is not None else contribs,
+        "incomes": args.incomes if args.incomes is not None else incs,
+    }
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    if os.path.exists(path):
+        sys.exit(f"{path} ya existe; usa otra ruta para no pisar datos.")
+
+    db.CONNECT_HOOKS.append(_count_queries)
+    t0 = time.perf_counter()
+    months = generate(path, **params)
+    print(f"Base sintética {path}: {params} ({time.perf_counter() - t0:.1f}s)")
+
+    results = run(months, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        if saved.get("params") != params:
+            print(f"Ojo: el baseline usa otros tamaños {saved.get('params')}; la comparación no es 1:1.")
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "params": params,
+                "repeat": args.repeat,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Baseline guardado en {args.save}")
+    db.close_all()
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
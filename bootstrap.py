@@ -0,0 +1,82 @@
+import hashlib, os, threading
+
+import db
+import storage
+
+# === ARRANQUE UNA VEZ POR PROCESO ============================================
+# Streamlit re-ejecuta app.py en cada interacción. Este módulo se importa una
+# sola vez por proceso, así que su estado sobrevive entre reruns y permite
+# saltarse el bootstrap cuando ya se hizo:
+#   - init_db() / ensure_users()      -> una vez por proceso (y por base/backend)
+#   - load_templates_from_yaml()      -> sólo si budgets.yaml cambió
+#   - ensure_budgets_for_month()      -> una vez por mes calendario, y de nuevo
+#                                        si data_version avanzó (otra escritura o
+#                                        un restore, quizás desde otro proceso)
+
+_lock = threading.Lock()
+_state = {
+    "db_path": None,     # base (o backend) ya inicializada
+    "yaml_stat": None,   # (mtime_ns, size) del último budgets.yaml leído
+    "yaml_hash": None,   # sha256 del contenido sincronizado
+    "months": set(),     # meses con presupuestos ya verificados
+    "version": None,     # data_version con el que se verificaron esos meses
+}
+
+def _yaml_changed():
+    """
+    None si budgets.yaml no cambió desde la última sincronización; si cambió,
+    el (stat, hash) que hay que registrar una vez sincronizado.
+    Un rerun normal cuesta un stat(); el hash sólo se calcula si cambia mtime/tamaño.
+    """
+    st = os.stat(db.YAML_PATH)
+    stat = (st.st_mtime_ns, st.st_size)
+    if stat == _state["yaml_stat"]:
+        return None
+    with open(db.YAML_PATH, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if digest == _state["yaml_hash"]:
+        _state["yaml_stat"] = stat  # sólo cambió el mtime: nada que sincronizar
+        return None
+    return stat, digest
+
+def _key(b):
+    if isinstance(b, storage.SQLiteBackend):
+        return b.path or db.current_path()
+    return id(b)
+
+def ensure_bootstrapped(month=None, backend=None):
+    """
+    Deja la DB lista para `month` (por defecto el mes actual) haciendo sólo el trabajo pendiente.
+    backend: por defecto storage.get_backend() (BUDGET_BACKEND).
+    """
+    month = month or db.current_month()
+    b = backend or storage.get_backend()
+    with _lock:
+        if _state["db_path"] != _key(b):
+            b.init_db()
+            b.ensure_users()
+            _state.update(db_path=_key(b), yaml_stat=None, yaml_hash=None, months=set(), version=None)
+        changed = _yaml_changed()
+        if changed:
+            b.load_templates_from_yaml()
+            # Se registra recién después de sincronizar: si falla (YAML inválido,
+            # base bloqueada), el próximo rerun lo vuelve a intentar.
+            _state["yaml_stat"], _state["yaml_hash"] = changed
+            # Templates nuevos deben aparecer también en los meses ya verificados.
+            _state["months"] = set()
+        # Un restore (en este u otro proceso) puede traer una base sin los
+        # presupuestos del mes: data_version avanza con él, así que si cambió
+        # los meses ya verificados se vuelven a verificar. Cuesta una consulta.
+        version = b.data_version()
+        if version != _state["version"]:
+            _state["months"] = set()
+        if month not in _state["months"]:
+            if b.ensure_budgets_for_month(month):
+                version = b.data_version()  # la versión que dejó nuestra propia escritura
+            _state["months"].add(month)
+        _state["version"] = version
+
+def reset():
+    """Olvida lo hecho (el próximo ensure_bootstrapped() vuelve a hacer todo)."""
+    with _lock:
+        _state.update(db_path=None, yaml_stat=None, yaml_hash=None, months=set(), version=None)
@@ -0,0 +1,78 @@
+"""
+Caché LRU acotada para lecturas, invalidada por versión de datos.
+
+La clave de cada entrada incluye un "token" (en db.py: ruta de la DB, el
+contador data_version y el mes actual). Cualquier escritura sube el contador,
+así que la siguiente lectura no encuentra su clave y va a la DB; las entradas
+viejas salen solas por LRU. Los resultados se comparten entre sesiones:
+quien los recibe no debe mutarlos.
+"""
+import functools, os, threading
+from collections import OrderedDict
+
+class LRUCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+_MISSING = object()
+_cache = LRUCache(int(os.environ.get("BUDGET_CACHE_SIZE", "256")))
+
+def versioned(token_fn):
+    """
+    Decorador: memoriza fn(*args, **kwargs) bajo (nombre, args, token_fn()).
+    token_fn debe ser barato (una lectura por PK) y cambiar con cada escritura.
+    Si devuelve None la llamada va directo a fn, sin leer ni guardar en caché.
+    """
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = token_fn()
+            if token is None:
+                return fn(*args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())), token)
+            value = _cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                _cache.put(key, value)
+            return value
+
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
+
+def clear():
+    _cache.clear()
+
+def stats():
+    return _cache.stats()
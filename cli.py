@@ -0,0 +1,343 @@
+"""
+Comandos sin Streamlit (cron, scripts, mantenimiento). No importa streamlit,
+pandas ni numpy; yaml sólo se carga en los comandos que sincronizan plantillas.
+
+    python -m cli status [--month 2025-10] [--user Jack]   # estado del mes
+    python -m cli income Jack 850000 --note "Sueldo" --key sueldo-2025-10  # registra y distribuye
+    python -m cli income Jack 50000 --no-distribute        # sólo registra el ingreso
+    python -m cli rollover [--month 2025-11]               # sincroniza plantillas y crea el mes
+    python -m cli export --kind budgets -o octubre.csv     # exporta el mes en CSV
+    python -m cli ledger --from 2024-01 --to 2024-12 -o libro.parquet  # libro contable completo (streaming)
+    python -m cli balances            # verifica balances contra contributions
+    python -m cli balances --rebuild  # y los reconstruye si hay diferencias
+    python -m cli months 2024-01 2026-12  # crea/completa presupuestos de un rango
+    python -m cli import ingresos.csv --user Jack --replay  # importa ingresos desde CSV
+    python -m cli close 2024-01 2024-12   # cierra y archiva meses terminados
+    python -m cli archive 2024-03 --kind incomes --user Jack  # muestra lo archivado
+    python -m cli backup [--keep 7]       # respaldo en caliente (comprimido, con rotación)
+    python -m cli backup --list           # respaldos disponibles
+    python -m cli restore latest          # vuelve al último respaldo (o a un archivo .db.gz)
+"""
+import argparse, csv, os, sys
+
+import db
+from utils import fmt_clp
+
+def _visible(row, user):
+    # row = (b.id, template_key, name, ctype, owner, limit_total, shares_json)
+    return user is None or row[3] == "shared" or row[4] == user
+
+def cmd_status(args):
+    from utils import contrib_of
+
+    db.init_db()
+    month = args.month or db.current_month()
+    db._check_month(month)
+    rows, contribs, targets = db.month_snapshot(month)
+    rows = [r for r in rows if _visible(r, args.user)]
+    if not rows:
+        print(f"{db.month_name(month)}: sin presupuestos (crea el mes con: python -m cli rollover --month {month}).")
+        return 1
+    closed = " (cerrado)" if month in db.closed_months() else ""
+    print(f"{db.month_name(month)}{closed}")
+    total_done = total_limit = 0
+    for r in rows:
+        b_id, _, name, ctype, owner, limit_total, _ = r
+        done = contrib_of(contribs, b_id)
+        total_done += min(done, limit_total)
+        total_limit += limit_total
+        mark = "✅" if done >= limit_total else "⏳"
+        label = f"{name} (compartido)" if ctype == "shared" else f"{name} ({owner})"
+        detail = ""
+        if ctype == "shared":
+            detail = "  " + "  ".join(
+                f"{u} {fmt_clp(contrib_of(contribs, b_id, u))}/{fmt_clp(t)}"
+                for u, t in sorted(targets.get(b_id, {}).items()))
+        print(f"  {mark} {label:32} {fmt_clp(done):>12} / {fmt_clp(limit_total):<12}{detail}")
+    pct = 100 * total_done / total_limit if total_limit else 100.0
+    print(f"Total: {fmt_clp(total_done)} de {fmt_clp(total_limit)} ({pct:.0f}%)")
+    return 0
+
+def cmd_income(args):
+    from bootstrap import ensure_bootstrapped
+    from utils import parse_money, proportional_allocate
+
+    amount = parse_money(args.amount)
+    if amount <= 0:
+        raise ValueError(f"monto inválido: {args.amount!r}")
+    month = args.month or db.current_month()
+    ensure_bootstrapped(month)
+    if args.user not in db.list_users():
+        raise ValueError(f"usuario desconocido: {args.user!r}")
+    if args.no_distribute:
+        _, applied = db.record_distribution(args.user, amount, args.note, idempotency_key=args.key, ts=args.ts)
+        print(f"Ingreso de {fmt_clp(amount)} registrado para {args.user}." if applied
+              else "Ese ingreso ya estaba registrado (misma --key); no se aplicó de nuevo.")
+        return 0
+    allocs, leftover, applied = proportional_allocate(
+        args.user, amount, month, note=args.note, idempotency_key=args.key, ts=args.ts)
+    if not applied:
+        print("Ese ingreso ya estaba registrado (misma --key); no se aplicó de nuevo.")
+    for a in allocs:
+        print(f"  {a['name']:32} {fmt_clp(a['allocated']):>12}")
+    if leftover:
+        print(f"Sin asignar (metas completas): {fmt_clp(leftover)}")
+    return 0
+
+def cmd_rollover(args):
+    from bootstrap import ensure_bootstrapped
+
+    month = args.month or db.current_month()
+    db._check_month(month)
+    db.init_db()
+    before = len(db.list_budgets.uncached(month))
+    ensure_bootstrapped(month)
+    after = len(db.list_budgets.uncached(month))
+    print(f"{db.month_name(month)}: {after} presupuesto(s), {after - before} nuevo(s).")
+    return 0
+
+def cmd_export(args):
+    from utils import contrib_of, target_of
+
+    db.init_db()
+    month = args.month or db.current_month()
+    db._check_month(month)
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        w = csv.writer(out)
+        if args.kind == "budgets":
+            rows, contribs, targets = db.month_snapshot(month)
+            users = db.list_users()
+            w.writerow(["month", "key", "name", "type", "owner", "limit_total", "contributed"]
+                       + [f"contributed_{u}" for u in users] + [f"target_{u}" for u in users])
+            for r in rows:
+                if not _visible(r, args.user):
+                    continue
+                b_id, key, name, ctype, owner, limit_total, _ = r
+                w.writerow([month, key, name, ctype, owner or "", limit_total, contrib_of(contribs, b_id)]
+                           + [contrib_of(contribs, b_id, u) for u in users]
+                           + [target_of(targets, b_id, u) if ctype == "shared" else "" for u in users])
+        else:
+            w.writerow(["id", "ts", "user", "amount", "note"])
+            end = db._next_month(month)
+            with db.connection() as conn:
+                cur = conn.execute(
+                    "SELECT id, ts, user, amount, note FROM incomes WHERE ts >= ? AND ts < ?"
+                    + (" AND user = ?" if args.user else "") + " ORDER BY ts, id",
+                    (month, end) + ((args.user,) if args.user else ()))
+                for row in cur:
+                    w.writerow(row)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+def cmd_ledger(args):
+    import ledger
+
+    db.init_db()
+    kinds = ledger.KINDS if args.kind == "all" else (args.kind,)
+    n = ledger.export(args.output, args.format, start=args.start, end=args.end, user=args.user,
+                      kinds=kinds, batch_size=args.batch)
+    if args.output not in (None, "-"):
+        print(f"{n} filas en {args.output} ({ledger.format_for(args.output, args.format)}).")
+    return 0
+
+def cmd_balances(args):
+    db.init_db()
+    drift = db.rebuild_balances() if args.rebuild else db.verify_balances()
+    if not drift:
+        print("balances OK: coincide con contributions.")
+        return 0
+    print(f"{len(drift)} diferencia(s) en balances:")
+    for budget_id, user, stored, actual in drift:
+        print(f"  budget {budget_id} / {user}: guardado {fmt_clp(stored)} vs real {fmt_clp(actual)}")
+    if args.rebuild:
+        print("balances reconstruido desde contributions.")
+        return 0
+    return 1
+
+def cmd_months(args):
+    db.init_db()
+    created = db.ensure_budgets_for_range(args.start, args.end or args.start)
+    print(f"{created} presupuesto(s) creados entre {args.start} y {args.end or args.start}.")
+    return 0
+
+def cmd_import(args):
+    import importer
+    from bootstrap import ensure_bootstrapped
+
+    ensure_bootstrapped()
+
+    def progress(r):
+        print(f"  ... {r['read']} filas leídas, {r['inserted']} insertadas", file=sys.stderr)
+
+    report = importer.import_file(
+        args.file, default_user=args.user, replay=args.replay,
+        chunk=args.chunk, delimiter=args.delimiter, progress=progress,
+    )
+    print(f"Leídas: {report['read']}  insertadas: {report['inserted']}  "
+          f"duplicadas: {report['duplicates']}  rechazadas: {report['rejected']}")
+    print(f"Tiempo: {report['seconds']} s ({report['rows_per_sec']} filas/s)")
+    for line_no, reason in report["rejected_rows"][:args.show_rejected]:
+        print(f"  línea {line_no}: {reason}")
+    return 1 if report["rejected"] else 0
+
+def cmd_close(args):
+    import archive
+
+    db.init_db()
+    done = archive.close_months(args.start, args.end or args.start)
+    for r in done:
+        print(f"{r['month']}: {r['contributions']} aportes y {r['incomes']} ingresos archivados "
+              f"en {os.path.dirname(r['incomes_file'])}")
+    if not done:
+        print("No había meses abiertos y terminados en ese rango.")
+    return 0
+
+def cmd_archive(args):
+    import archive
+
+    db.init_db()
+    if args.month not in db.closed_months():
+        raise ValueError(f"El mes {args.month} no está cerrado.")
+    cols = archive.CONTRIB_COLUMNS if args.kind == "contributions" else archive.INCOME_COLUMNS
+    w = csv.DictWriter(sys.stdout, fieldnames=cols)
+    w.writeheader()
+    for row in archive.read_archive(args.month, args.kind):
+        if args.user is None or row["user"] == args.user:
+            w.writerow(row)
+    return 0
+
+def _mb(n):
+    return f"{n / 1e6:.1f} MB"
+
+def cmd_backup(args):
+    import backup
+
+    if args.list:
+        found = backup.list_backups(args.dir)
+        for path, size, when in found:
+            print(f"{when}  {_mb(size):>9}  {path}")
+        if not found:
+            print(f"No hay respaldos en {args.dir or backup.backup_dir()}.")
+        return 0
+    db.init_db()
+    r = backup.backup(args.dir, keep=args.keep, pages=args.pages, pause_ms=args.pause)
+    print(f"Respaldo {r['file']}: {r['pages']} páginas en {r['steps']} pasos, "
+          f"{_mb(r['bytes'])} -> {_mb(r['compressed'])} ({r['seconds']} s)")
+    for old in r["removed"]:
+        print(f"  borrado {old}")
+    return 0
+
+def cmd_restore(args):
+    import backup
+
+    file = args.file
+    if file == "latest":
+        found = backup.list_backups(args.dir)
+        if not found:
+            raise ValueError(f"No hay respaldos en {args.dir or backup.backup_dir()}.")
+        file = found[0][0]
+    r = backup.restore(file, safety_backup=not args.no_safety)
+    print(f"Base restaurada desde {r['restored']} ({r['seconds']} s).")
+    if r["safety"]:
+        print(f"El estado anterior quedó en {r['safety']}.")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Finanzas Familia (sin Streamlit)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("status", help="estado del mes (aportado vs límite por categoría)")
+    p.add_argument("--month", help="mes (YYYY-MM); por defecto el actual")
+    p.add_argument("--user", help="sólo compartidas y las categorías de este usuario")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("income", help="registra un ingreso y lo distribuye según las metas del mes")
+    p.add_argument("user")
+    p.add_argument("amount", help="monto (acepta $ y puntos: 850.000)")
+    p.add_argument("--note", default="", help="nota del ingreso")
+    p.add_argument("--month", help="mes al que se distribuye (YYYY-MM); por defecto el actual")
+    p.add_argument("--ts", help="fecha ISO del ingreso (por defecto, ahora)")
+    p.add_argument("--key", help="clave de idempotencia: repetir el comando con la misma clave no duplica")
+    p.add_argument("--no-distribute", action="store_true", help="sólo registra el ingreso, sin aportes")
+    p.set_defaults(func=cmd_income)
+
+    p = sub.add_parser("rollover", help="sincroniza budgets.yaml y crea los presupuestos del mes")
+    p.add_argument("--month", help="mes (YYYY-MM); por defecto el actual")
+    p.set_defaults(func=cmd_rollover)
+
+    p = sub.add_parser("export", help="exporta en CSV los presupuestos o ingresos de un mes")
+    p.add_argument("--kind", choices=("budgets", "incomes"), default="budgets")
+    p.add_argument("--month", help="mes (YYYY-MM); por defecto el actual")
+    p.add_argument("--user", help="filtra por usuario")
+    p.add_argument("-o", "--output", help="archivo de salida (por defecto, stdout)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("ledger", help="exporta el libro de ingresos y aportes (CSV, JSONL o Parquet) en streaming")
+    p.add_argument("--from", dest="start", help="primer mes (YYYY-MM); por defecto, desde el inicio")
+    p.add_argument("--to", dest="end", help="último mes (YYYY-MM); por defecto, hasta el final")
+    p.add_argument("--user", help="filtra por usuario")
+    p.add_argument("--kind", choices=("all", "incomes", "contributions"), default="all")
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"),
+                   help="formato (por defecto, el de la extensión de -o; si no, csv)")
+    p.add_argument("--batch", type=int, default=5000, help="filas leídas por lote")
+    p.add_argument("-o", "--output", help="archivo de salida (por defecto, stdout)")
+    p.set_defaults(func=cmd_ledger)
+
+    p = sub.add_parser("balances", help="verifica/reconstruye la tabla de saldos")
+    p.add_argument("--rebuild", action="store_true", help="recalcula balances desde contributions")
+    p.set_defaults(func=cmd_balances)
+
+    p = sub.add_parser("months", help="crea/completa los presupuestos de un rango de meses")
+    p.add_argument("start", help="primer mes (YYYY-MM)")
+    p.add_argument("end", nargs="?", help="último mes (YYYY-MM); por defecto = start")
+    p.set_defaults(func=cmd_months)
+
+    p = sub.add_parser("import", help="importa ingresos desde un CSV (streaming)")
+    p.add_argument("file", help="archivo CSV con encabezado (fecha, monto, [usuario], [nota])")
+    p.add_argument("--user", help="usuario para filas sin columna usuario")
+    p.add_argument("--replay", action="store_true", help="distribuye cada ingreso en el mes de su fecha")
+    p.add_argument("--chunk", type=int, default=5000, help="filas por transacción")
+    p.add_argument("--delimiter", help="separador (por defecto se detecta , o ;)")
+    p.add_argument("--show-rejected", type=int, default=20, help="cuántas filas rechazadas mostrar")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("close", help="cierra meses terminados y archiva su detalle")
+    p.add_argument("start", help="primer mes (YYYY-MM)")
+    p.add_argument("end", nargs="?", help="último mes (YYYY-MM); por defecto = start")
+    p.set_defaults(func=cmd_close)
+
+    p = sub.add_parser("archive", help="muestra (CSV) el detalle archivado de un mes cerrado")
+    p.add_argument("month", help="mes cerrado (YYYY-MM)")
+    p.add_argument("--kind", choices=("incomes", "contributions"), default="incomes")
+    p.add_argument("--user", help="filtra por usuario")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("backup", help="respaldo en caliente de la base (API de backup de SQLite)")
+    p.add_argument("--list", action="store_true", help="sólo lista los respaldos existentes")
+    p.add_argument("--dir", help="carpeta de respaldos (por defecto BUDGET_BACKUP_DIR o backups/)")
+    p.add_argument("--keep", type=int, help="cuántos respaldos conservar (por defecto BUDGET_BACKUP_KEEP)")
+    p.add_argument("--pages", type=int, help="páginas copiadas por paso")
+    p.add_argument("--pause", type=float, help="ms de pausa entre pasos")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("restore", help="reemplaza la base por un respaldo (antes respalda la actual)")
+    p.add_argument("file", help="archivo .db.gz (o .db), o 'latest' para el más reciente")
+    p.add_argument("--dir", help="carpeta donde buscar 'latest'")
+    p.add_argument("--no-safety", action="store_true", help="no respaldar el estado actual antes")
+    p.set_defaults(func=cmd_restore)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,160 @@
-import sqlite3, json, os, datetime, yaml
+import sqlite3, json, math, os, re, datetime, threading
+import atexit, functools, queue
+# yaml y concurrent.futures se importan donde se usan: el CLI arranca sin ellos.
+from contextlib import contextmanager
+
+import cache
+import metrics
 
 # === RUTA DE LA BASE DE DATOS (local o Render) ==============================
 # Si existe la variable de entorno BUDGET_DB (ej: "/data/budget.db" en Render),
 # la usamos. Si no, guardamos "budget.db" junto al código (modo local).
 DB_PATH = os.environ.get("BUDGET_DB", os.path.join(os.path.dirname(__file__), "budget.db"))
 
+# BUDGET_DB=":memory:" (o ":memory:nombre") usa una base SQLite en memoria
+# compartida por todas las conexiones del proceso (tests, benchmarks).
+MEMORY_PREFIX = ":memory:"
+
 # Crea la carpeta del DB si no existe (útil cuando DB_PATH es /data/budget.db)
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+if not DB_PATH.startswith(MEMORY_PREFIX) and os.path.dirname(DB_PATH):
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 # ============================================================================
 
 YAML_PATH = os.path.join(os.path.dirname(__file__), "budgets.yaml")
 
-def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+# === CONEXIONES ==============================================================
+# Pool pequeño de conexiones ya configuradas. Cada hilo (sesión de Streamlit)
+# toma una con connection()/transaction() y la devuelve al salir; las llamadas
+# anidadas dentro del mismo hilo reutilizan la misma conexión.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # lectores no bloquean al escritor
+    "PRAGMA synchronous=NORMAL",     # fsync sólo en checkpoints (seguro con WAL)
+    "PRAGMA busy_timeout=5000",      # espera hasta 5 s en vez de "database is locked"
+    "PRAGMA cache_size=-8000",       # ~8 MB de caché de páginas por conexión
+    "PRAGMA temp_store=MEMORY",
+)
+POOL_SIZE = int(os.environ.get("BUDGET_DB_POOL", "4"))
 
-def init_db():
-    conn = get_conn()
-    c = conn.cursor()
+# Funciones hook(conn) que se llaman con cada conexión nueva (p. ej. bench.py
+# registra aquí un trace callback para contar consultas).
+CONNECT_HOOKS = []
+
+_pool = {}                  # ruta -> [conexiones libres]
+_pool_lock = threading.Lock()
+_local = threading.local()  # conexión en uso (y ruta elegida con use()) del hilo actual
+_anchors = {}               # ruta en memoria -> conexión que la mantiene viva
+
+def current_path():
+    """La base activa en este hilo: la de use(path) si hay una, si no DB_PATH."""
+    return getattr(_local, "path", None) or DB_PATH
+
+@contextmanager
+def use(path):
+    """
+    with use(":memory:tests"): ...  -> todo db.* de este hilo apunta a `path`.
+    Sirve para elegir la base por llamada (storage.SQLiteBackend lo usa).
+    """
+    prev = getattr(_local, "path", None)
+    _local.path = path
+    try:
+        yield path
+    finally:
+        _local.path = prev
+
+def get_conn(path=None):
+    """Abre una conexión nueva ya afinada (autocommit; las transacciones son explícitas)."""
+    path = path or current_path()
+    if path.startswith(MEMORY_PREFIX):
+        name = path[len(MEMORY_PREFIX):] or "budget"
+        target, uri = f"file:{name}?mode=memory&cache=shared", True
+    else:
+        target, uri = path, False
+    conn = sqlite3.connect(target, check_same_thread=False, isolation_level=None, timeout=5,
+                           uri=uri, factory=metrics.TracedConnection)
+    metrics.record_connection()
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    for hook in CONNECT_HOOKS:
+        hook(conn)
+    if uri:
+        with _pool_lock:
+            # La base en memoria existe mientras haya una conexión abierta.
+            _anchors.setdefault(path, sqlite3.connect(target, uri=True, check_same_thread=False))
+    return conn
+
+def _pool_get(path):
+    with _pool_lock:
+        free = _pool.get(path)
+        if free:
+            return free.pop()
+    return get_conn(path)
+
+def _pool_put(path, conn):
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        free = _pool.setdefault(path, [])
+        if path == current_path() and len(free) < POOL_SIZE:
+            free.append(conn)
+            return
+    conn.close()
+
+@contextmanager
+def connection():
+    """Presta una conexión del pool al hilo actual (reentrante)."""
+    held = getattr(_local, "held", None)
+    path = current_path()
+    if held is not None and held[0] == path:
+        yield held[1]
+        return
+    conn = _pool_get(path)
+    _local.held = (path, conn)
+    try:
+        yield conn
+    finally:
+        _local.held = held
+        _pool_put(path, conn)
+
+@contextmanager
+def transaction():
+    """
+    with transaction() as conn: ...  -> BEGIN IMMEDIATE / COMMIT (o ROLLBACK si hay error).
+    Si ya hay una transacción abierta en este hilo, se une a ella.
+    """
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def close_all():
+    """Cierra las conexiones libres del pool (tests, scripts, backups)."""
+    with _pool_lock:
+        conns = [c for free in _pool.values() for c in free]
+        _pool.clear()
+    for conn in conns:
+        conn.close()
+
+def drop_memory(path):
+    """Descarta una base en memoria: cierra sus conexiones libres y la conexión que la sostenía."""
+    with _pool_lock:
+        conns = _pool.pop(path, []) + [c for c in [_anchors.pop(path, None)] if c is not None]
+    for conn in conns:
+        conn.close()
+
+# === MIGRACIONES ==============================================================
+# Cada paso se aplica una sola vez, en orden, dentro de su propia transacción,
+# y queda registrado en schema_version. Para cambiar el esquema se agrega un
+# paso nuevo al final de MIGRATIONS; nunca se edita uno ya publicado.
+
+def _m001_base_tables(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS users(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -61,37 +198,578 @@ def init_db():
             note TEXT
         )
     """)
-    conn.commit()
-    conn.close()
+
+def _m002_indexes(c):
+    # Presupuestos duplicados (mismo template y mes): los aportes pasan al de
+    # menor id y los sobrantes se borran, así el índice único puede crearse.
+    c.execute("""
+        UPDATE contributions
+        SET budget_id = (
+            SELECT MIN(b2.id) FROM budgets b1
+            JOIN budgets b2 ON b2.template_key = b1.template_key AND b2.month = b1.month
+            WHERE b1.id = contributions.budget_id
+        )
+        WHERE budget_id IN (
+            SELECT b.id FROM budgets b
+            WHERE b.id > (SELECT MIN(x.id) FROM budgets x
+                          WHERE x.template_key = b.template_key AND x.month = b.month)
+        )
+    """)
+    c.execute("""
+        DELETE FROM budgets
+        WHERE id NOT IN (SELECT MIN(id) FROM budgets GROUP BY template_key, month)
+    """)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_budgets_template_month ON budgets(template_key, month)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_budgets_month ON budgets(month)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_contributions_budget_user ON contributions(budget_id, user)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_incomes_user_ts ON incomes(user, ts)")
+
+def _m003_balances(c):
+    # Saldo aportado por (presupuesto, usuario), mantenido por triggers en la
+    # misma transacción que cada cambio en contributions.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS balances(
+            budget_id INTEGER NOT NULL,
+            user TEXT NOT NULL,
+            amount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(budget_id, user)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_contributions_ai AFTER INSERT ON contributions
+        BEGIN
+            INSERT INTO balances(budget_id, user, amount) VALUES(NEW.budget_id, NEW.user, NEW.amount)
+            ON CONFLICT(budget_id, user) DO UPDATE SET amount = amount + excluded.amount;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_contributions_ad AFTER DELETE ON contributions
+        BEGIN
+            UPDATE balances SET amount = amount - OLD.amount
+            WHERE budget_id = OLD.budget_id AND user = OLD.user;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_contributions_au AFTER UPDATE OF budget_id, user, amount ON contributions
+        BEGIN
+            UPDATE balances SET amount = amount - OLD.amount
+            WHERE budget_id = OLD.budget_id AND user = OLD.user;
+            INSERT INTO balances(budget_id, user, amount) VALUES(NEW.budget_id, NEW.user, NEW.amount)
+            ON CONFLICT(budget_id, user) DO UPDATE SET amount = amount + excluded.amount;
+        END
+    """)
+    _rebuild_balances(c)
+
+def _m004_distribution_links(c):
+    # Idempotencia de "Distribuir ahora" y vínculo aporte -> ingreso que lo originó.
+    c.execute("ALTER TABLE incomes ADD COLUMN idem_key TEXT")
+    c.execute("ALTER TABLE contributions ADD COLUMN income_id INTEGER")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_incomes_idem_key ON incomes(idem_key) WHERE idem_key IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_contributions_income ON contributions(income_id)")
+
+def _m005_category_shares(c):
+    # Fracción y tope por usuario de cada template, normalizados desde shares_json
+    # para que el "cuánto me falta" se pueda calcular en SQL.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS category_shares(
+            ckey TEXT NOT NULL,
+            user TEXT NOT NULL,
+            fraction REAL NOT NULL,
+            target INTEGER NOT NULL,
+            PRIMARY KEY(ckey, user)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_category_shares_user ON category_shares(user)")
+    users = [r[0] for r in c.execute("SELECT name FROM users ORDER BY id")]
+    templates = c.execute("SELECT ckey, ctype, owner, limit_total, shares_json FROM category_templates").fetchall()
+    for ckey, ctype, owner, limit_total, shares_json in templates:
+        shares = json.loads(shares_json) if shares_json else None
+        c.executemany(
+            "INSERT OR REPLACE INTO category_shares(ckey, user, fraction, target) VALUES(?,?,?,?)",
+            [(ckey,) + r for r in _share_rows(ctype, owner, limit_total, shares, users)],
+        )
+
+def _m006_template_versions(c):
+    # Versiones inmutables de cada template; los presupuestos apuntan a la
+    # versión con que se crearon. Los meses existentes quedan en la versión 1
+    # (el template vigente al migrar: no hay historia anterior guardada).
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS template_versions(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ckey TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            name TEXT,
+            ctype TEXT,
+            owner TEXT,
+            limit_total INTEGER,
+            shares_json TEXT,
+            created_at TEXT,
+            UNIQUE(ckey, version)
+        )
+    """)
+    c.execute("""
+        INSERT INTO template_versions(ckey, version, name, ctype, owner, limit_total, shares_json, created_at)
+        SELECT ckey, 1, name, ctype, owner, limit_total, shares_json, ? FROM category_templates
+    """, (now,))
+    c.execute("ALTER TABLE category_templates ADD COLUMN version_id INTEGER")
+    c.execute("""
+        UPDATE category_templates
+        SET version_id = (SELECT v.id FROM template_versions v WHERE v.ckey = category_templates.ckey)
+    """)
+    c.execute("ALTER TABLE budgets ADD COLUMN template_version_id INTEGER")
+    c.execute("""
+        UPDATE budgets
+        SET template_version_id = (SELECT t.version_id FROM category_templates t
+                                   WHERE t.ckey = budgets.template_key)
+    """)
+    # category_shares pasa a ser por versión.
+    c.execute("""
+        CREATE TABLE category_shares_new(
+            version_id INTEGER NOT NULL,
+            ckey TEXT NOT NULL,
+            user TEXT NOT NULL,
+            fraction REAL NOT NULL,
+            target INTEGER NOT NULL,
+            PRIMARY KEY(version_id, user)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        INSERT INTO category_shares_new(version_id, ckey, user, fraction, target)
+        SELECT t.version_id, s.ckey, s.user, s.fraction, s.target
+        FROM category_shares s JOIN category_templates t ON t.ckey = s.ckey
+    """)
+    c.execute("DROP TABLE category_shares")
+    c.execute("ALTER TABLE category_shares_new RENAME TO category_shares")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_category_shares_ckey_user ON category_shares(ckey, user)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_budgets_template_version ON budgets(template_version_id)")
+
+def _m007_data_version(c):
+    # Contador que sube con cada escritura; las lecturas en caché lo usan en su clave.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS data_version(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            n INTEGER NOT NULL
+        )
+    """)
+    c.execute("INSERT OR IGNORE INTO data_version(id, n) VALUES(1, 0)")
+
+def _m008_history_indexes(c):
+    # Historial paginado por (ts, id): el rowid va implícito al final del índice.
+    c.execute("CREATE INDEX IF NOT EXISTS ix_contributions_user_ts ON contributions(user, ts)")
+
+def _m009_month_closures(c):
+    # Cierre de mes: los aportes crudos se compactan en una fila por
+    # (presupuesto, usuario) marcada con rollup_n y los ingresos en income_rollups;
+    # el detalle se mueve a archivos comprimidos (ver archive.py).
+    c.execute("ALTER TABLE contributions ADD COLUMN rollup_n INTEGER")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS income_rollups(
+            month TEXT NOT NULL,
+            user TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY(month, user)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS month_closures(
+            month TEXT PRIMARY KEY,
+            closed_at TEXT,
+            contributions_file TEXT,
+            incomes_file TEXT,
+            n_contributions INTEGER,
+            n_incomes INTEGER
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_incomes_ts ON incomes(ts)")
+
+def _m010_orphan_income_links(c):
+    # Cerrar un mes borraba sus ingresos aunque tuvieran aportes en presupuestos
+    # de otros meses: esos income_id quedaron apuntando a nada.
+    c.execute("""
+        UPDATE contributions SET income_id = NULL
+        WHERE income_id IS NOT NULL AND income_id NOT IN (SELECT id FROM incomes)
+    """)
+
+def _m011_default_shares(c):
+    # Versiones compartidas cuyos 'shares' no nombran a un usuario quedaron sin
+    # fila para él (tope 0); la app siempre le dio el 50%.
+    c.execute("""
+        INSERT INTO category_shares(version_id, ckey, user, fraction, target)
+        SELECT t.id, t.ckey, u.name, 0.5, CAST(ROUND(t.limit_total * 0.5) AS INTEGER)
+        FROM template_versions t CROSS JOIN users u
+        WHERE t.ctype = 'shared'
+          AND NOT EXISTS (SELECT 1 FROM category_shares s WHERE s.version_id = t.id AND s.user = u.name)
+    """)
+    c.execute("UPDATE data_version SET n = n + 1 WHERE id=1")  # cambian los topes en caché
+
+def _m012_half_up_targets(c):
+    # _share_rows redondeaba con round() (mitades al par) y la migración 11 y
+    # _TARGET_SQL con ROUND de SQLite (mitades hacia arriba): un límite impar al
+    # 50% daba topes distintos según quién los calculara. Se recalculan con
+    # _round_target los que quedaron con la otra regla.
+    rows = c.execute("""
+        SELECT s.version_id, s.user, s.fraction, s.target, t.limit_total
+        FROM category_shares s JOIN template_versions t ON t.id = s.version_id
+    """).fetchall()
+    fixed = [(_round_target(limit_total * fraction), version_id, user)
+             for version_id, user, fraction, target, limit_total in rows
+             if _round_target(limit_total * fraction) != target]
+    if fixed:
+        c.executemany("UPDATE category_shares SET target = ? WHERE version_id = ? AND user = ?", fixed)
+        c.execute("UPDATE data_version SET n = n + 1 WHERE id=1")
+
+MIGRATIONS = [
+    (1, "tablas base", _m001_base_tables),
+    (2, "índices y unicidad de budgets(template_key, month)", _m002_indexes),
+    (3, "tabla balances mantenida por triggers", _m003_balances),
+    (4, "incomes.idem_key y contributions.income_id", _m004_distribution_links),
+    (5, "tabla category_shares (fracción y tope por usuario)", _m005_category_shares),
+    (6, "template_versions; budgets y category_shares referencian la versión", _m006_template_versions),
+    (7, "contador data_version para la caché de lecturas", _m007_data_version),
+    (8, "índice contributions(user, ts) para el historial", _m008_history_indexes),
+    (9, "cierre de mes: rollups y month_closures", _m009_month_closures),
+    (10, "contributions.income_id de ingresos archivados a NULL", _m010_orphan_income_links),
+    (11, "50% por defecto para usuarios que los shares no nombran", _m011_default_shares),
+    (12, "topes redondeados con mitades hacia arriba, como en SQL", _m012_half_up_targets),
+]
+
+def schema_version():
+    with connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(version),0) FROM schema_version").fetchone()[0]
+
+def _applied_versions():
+    """Versiones ya aplicadas, leídas sin tomar el lock de escritura."""
+    with connection() as conn:
+        try:
+            return {r[0] for r in conn.execute("SELECT version FROM schema_version")}
+        except sqlite3.OperationalError:  # base nueva: todavía no hay schema_version
+            return set()
+
+def migrate():
+    """Aplica en orden las migraciones pendientes. Devuelve la versión final."""
+    # Camino rápido (cada arranque y cada comando de cli.py): con la base al día
+    # no se abre ninguna transacción de escritura.
+    applied = _applied_versions()
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        return max(applied)
+    with transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version(
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT
+            )
+        """)
+    for version, description, step in pending:
+        with transaction() as conn:
+            # Se vuelve a leer dentro de la transacción: otro proceso pudo aplicarla.
+            done = conn.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone()
+            if done:
+                continue
+            step(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version(version, description, applied_at) VALUES(?,?,?)",
+                (version, description, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+    return schema_version()
+
+def init_db():
+    migrate()
+
+# === VERSIÓN DE DATOS / CACHÉ ================================================
+# Toda escritura llama a _bump_data_version() dentro de su transacción. Como el
+# contador vive en la DB, también invalida la caché de otros procesos.
+
+def data_version():
+    with connection() as conn:
+        return conn.execute("SELECT n FROM data_version WHERE id=1").fetchone()[0]
+
+def _bump_data_version(conn):
+    conn.execute("UPDATE data_version SET n = n + 1 WHERE id=1")
+
+def _cache_token():
+    # Dentro de una transacción de este hilo se ven escrituras sin confirmar:
+    # guardarlas bajo el data_version actual serviría a otras sesiones filas que
+    # un ROLLBACK puede deshacer (y ese número de versión se vuelve a usar).
+    held = getattr(_local, "held", None)
+    if held is not None and held[0] == current_path() and held[1].in_transaction:
+        return None
+    # El mes entra en la clave porque month=None significa "el mes actual".
+    return (current_path(), data_version(), current_month())
+
+cached_read = cache.versioned(_cache_token)
+
+# === ESCRITOR ÚNICO (write-behind) ===========================================
+# Modo opcional (BUDGET_WRITE_BEHIND=1 o enable_write_behind()): las funciones
+# marcadas con @write_op no abren su propia transacción sino que encolan la
+# operación para un único hilo escritor. Éste toma todo lo pendiente, lo
+# ejecuta en UNA transacción (un SAVEPOINT por operación, así un error sólo
+# deshace la suya) y hace un solo COMMIT: un fsync por grupo y sin peleas por
+# el lock de escritura entre sesiones. Las lecturas siguen usando el pool.
+#
+# La llamada normal espera el COMMIT de su grupo y devuelve el resultado (o
+# levanta la excepción) igual que en modo directo; fn.submit(...) o
+# submit(fn, ...) devuelven un Future sin esperar.
+# Dentro de una transacción ya abierta en el hilo, la operación corre ahí
+# mismo (no se puede partir una transacción entre dos hilos).
+
+WRITE_BATCH = int(os.environ.get("BUDGET_WRITE_BATCH", "256"))          # operaciones por COMMIT
+GROUP_COMMIT_MS = float(os.environ.get("BUDGET_GROUP_COMMIT_MS", "0"))  # espera extra para juntar más
+
+_write_behind = os.environ.get("BUDGET_WRITE_BEHIND") == "1"
+_writers = {}               # ruta -> _Writer
+_writers_lock = threading.Lock()
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.ops = self.batches = self.max_batch = 0
+        self.thread = threading.Thread(target=self._run, name=f"db-writer:{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, args, kwargs):
+        from concurrent.futures import Future
+        fut = Future()
+        self.queue.put((fn, args, kwargs, fut))
+        return fut
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _next_batch(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = GROUP_COMMIT_MS / 1000
+        while len(batch) < WRITE_BATCH:
+            try:
+                item = self.queue.get(timeout=deadline) if deadline else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # se procesa este grupo y después se termina
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = get_conn(self.path)
+        _local.path = self.path
+        _local.held = (self.path, conn)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._apply(conn, batch)
+        finally:
+            _local.held = None
+            conn.close()
+
+    def _apply(self, conn, batch):
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, kwargs, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    fut.set_exception(e)
+                    continue
+                conn.execute("RELEASE op")
+                done.append((fut, result))
+            conn.commit()
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for fut, _ in done:
+                fut.set_exception(e)
+            for _, _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.ops += len(batch)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        for fut, result in done:
+            fut.set_result(result)
+
+def _writer():
+    """Escritor para la DB actual, o None si la operación debe correr en este hilo."""
+    if not _write_behind:
+        return None
+    held = getattr(_local, "held", None)
+    if held is not None and held[1].in_transaction:
+        return None  # dentro de una transacción (o en el propio escritor)
+    with _writers_lock:
+        path = current_path()
+        w = _writers.get(path)
+        if w is None:
+            w = _writers[path] = _Writer(path)
+        return w
+
+def submit(fn, *args, **kwargs):
+    """Encola fn(*args, **kwargs) en el escritor; devuelve un Future (ya resuelto en modo directo)."""
+    fn = getattr(fn, "direct", fn)
+    w = _writer()
+    if w is not None:
+        return w.submit(fn, args, kwargs)
+    from concurrent.futures import Future
+    fut = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+def write_op(fn):
+    """Marca una función que escribe: en modo write-behind pasa por el escritor único."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        w = _writer()
+        if w is None:
+            return fn(*args, **kwargs)
+        return w.submit(fn, args, kwargs).result()
+
+    wrapper.direct = fn
+    wrapper.submit = functools.partial(submit, fn)
+    return wrapper
+
+def enable_write_behind():
+    global _write_behind
+    _write_behind = True
+
+def disable_write_behind():
+    """Vuelve al modo directo; espera a que los escritores vacíen su cola."""
+    global _write_behind
+    _write_behind = False
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for w in writers:
+        w.stop()
+
+def writer_stats():
+    with _writers_lock:
+        return {path: {"ops": w.ops, "batches": w.batches, "max_batch": w.max_batch,
+                       "pending": w.queue.qsize()} for path, w in _writers.items()}
+
+atexit.register(disable_write_behind)
 
 def ensure_users(usernames=("Jack","Jasmin")):
-    conn = get_conn()
-    c = conn.cursor()
-    for u in usernames:
-        c.execute("INSERT OR IGNORE INTO users(name) VALUES(?)", (u,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO users(name) VALUES(?)", [(u,) for u in usernames])
+
+def share_to_fraction(v) -> float:
+    """
+    Acepta 50 o '50%' -> 0.5 ; acepta 0.5 -> 0.5.
+    Si no se puede parsear, retorna 0.5.
+    """
+    try:
+        if isinstance(v, str):
+            v = v.strip().replace("%", "")
+        val = float(v)
+    except Exception:
+        return 0.5
+    return val if val <= 1 else (val / 100.0)
+
+def _share_rows(ctype, owner, limit_total, shares, users):
+    """
+    Filas (user, fraction, target) de category_shares para una versión de template.
+    Individual: sólo el dueño, con el 100%. Compartida sin 'shares': partes
+    iguales entre los usuarios registrados. Compartida con 'shares' que no
+    nombran a un usuario registrado: ese usuario aporta el 50%, como siempre
+    hizo la app (shares.get(user, 50)).
+    """
+    if ctype != "shared":
+        return [(owner, 1.0, int(limit_total))] if owner else []
+    if not shares:
+        shares = {u: 1.0 / len(users) for u in users} if users else {}
+    shares = dict(shares)
+    for user in users:
+        shares.setdefault(user, 50)
+    rows = []
+    for user, v in shares.items():
+        frac = share_to_fraction(v)
+        rows.append((user, frac, _round_target(int(limit_total) * frac)))
+    return rows
+
+def _round_target(x):
+    """
+    Redondeo de topes: mitades hacia arriba, igual que CAST(ROUND(x) AS INTEGER)
+    de SQLite (_TARGET_SQL, migración 11). round() de Python redondea mitades
+    al par: 30001 al 50% daría 15000 aquí y 15001 en SQL.
+    """
+    return int(math.floor(x + 0.5))
+
+@write_op
+def sync_templates(cats):
+    """
+    Sincroniza category_templates con una lista de categorías (formato budgets.yaml).
+    Sólo escribe las que cambiaron: cada cambio crea una versión nueva en
+    template_versions (con sus category_shares) y los meses ya creados siguen
+    apuntando a la versión anterior. Devuelve cuántas categorías cambiaron.
+    """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    with transaction() as conn:
+        users = [r[0] for r in conn.execute("SELECT name FROM users ORDER BY id")]
+        stored = {
+            r[0]: tuple(r[1:]) for r in conn.execute(
+                "SELECT ckey, name, ctype, owner, limit_total, shares_json, version_id FROM category_templates")
+        }
+        changed = 0
+        for cat in cats:
+            ckey = cat["key"]
+            row = (
+                cat["name"],
+                cat["type"],
+                cat.get("owner"),
+                int(cat["limit_total"]),
+                json.dumps(cat.get("shares", None)) if cat["type"] == "shared" else None,
+            )
+            old = stored.get(ckey)
+            if old is not None and old[:5] == row and old[5] is not None:
+                continue
+            version = conn.execute(
+                "SELECT COALESCE(MAX(version),0) + 1 FROM template_versions WHERE ckey=?", (ckey,)
+            ).fetchone()[0]
+            version_id = conn.execute("""
+                INSERT INTO template_versions(ckey, version, name, ctype, owner, limit_total, shares_json, created_at)
+                VALUES(?,?,?,?,?,?,?,?)
+            """, (ckey, version) + row + (now,)).lastrowid
+            conn.execute("""
+                INSERT INTO category_templates(ckey, name, ctype, owner, limit_total, shares_json, version_id)
+                VALUES(?,?,?,?,?,?,?)
+                ON CONFLICT(ckey) DO UPDATE SET
+                    name=excluded.name, ctype=excluded.ctype, owner=excluded.owner,
+                    limit_total=excluded.limit_total, shares_json=excluded.shares_json,
+                    version_id=excluded.version_id
+            """, (ckey,) + row + (version_id,))
+            conn.executemany(
+                "INSERT INTO category_shares(version_id, ckey, user, fraction, target) VALUES(?,?,?,?,?)",
+                [(version_id, ckey) + r for r in _share_rows(row[1], row[2], row[3], cat.get("shares"), users)],
+            )
+            changed += 1
+        if changed:
+            _bump_data_version(conn)
+    return changed
 
 def load_templates_from_yaml():
+    import yaml
     with open(YAML_PATH, "r", encoding="utf-8") as f:
         data = yaml.safe_load(f)
-    cats = data.get("categories", [])
-    conn = get_conn()
-    c = conn.cursor()
-    for cat in cats:
-        c.execute("""
-            INSERT OR REPLACE INTO category_templates(ckey, name, ctype, owner, limit_total, shares_json)
-            VALUES(?,?,?,?,?,?)
-        """, (
-            cat["key"],
-            cat["name"],
-            cat["type"],
-            cat.get("owner"),
-            int(cat["limit_total"]),
-            json.dumps(cat.get("shares", None)) if cat["type"] == "shared" else None
-        ))
-    conn.commit()
-    conn.close()
+    return sync_templates(data.get("categories", []))
 
 def current_month():
     return datetime.datetime.now().strftime("%Y-%m")
@@ -104,82 +782,370 @@ def month_name(month_ym=None):
     name = calendar.month_name[int(m)]
     return f"{name} {y}"
 
+_MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+def _check_month(month):
+    if not isinstance(month, str) or not _MONTH_RE.match(month):
+        raise ValueError(f"Mes inválido: {month!r} (formato YYYY-MM)")
+    return month
+
+def _next_month(month):
+    y, m = map(int, month.split("-"))
+    return f"{y + m // 12:04d}-{m % 12 + 1:02d}"
+
+@write_op
 def ensure_budgets_for_month(month=None):
+    """Crea los presupuestos que falten para el mes. Devuelve cuántos se crearon."""
     if not month:
         month = current_month()
-    conn = get_conn()
-    c = conn.cursor()
-    templates = c.execute("SELECT ckey, name, ctype, owner, limit_total, shares_json FROM category_templates").fetchall()
-    for ckey, name, ctype, owner, limit_total, shares_json in templates:
-        exists = c.execute("SELECT 1 FROM budgets WHERE template_key=? AND month=?", (ckey, month)).fetchone()
-        if not exists:
-            c.execute("INSERT INTO budgets(template_key, month, limit_total) VALUES(?,?,?)",
-                      (ckey, month, limit_total))
-    conn.commit()
-    conn.close()
+    _check_month(month)
+    with transaction() as conn:
+        cur = conn.execute("""
+            INSERT OR IGNORE INTO budgets(template_key, month, limit_total, template_version_id)
+            SELECT ckey, ?, limit_total, version_id FROM category_templates
+        """, (month,))
+        if cur.rowcount:
+            _bump_data_version(conn)
+        return cur.rowcount
 
+@write_op
+def ensure_budgets_for_range(start, end):
+    """
+    Crea (o completa) los presupuestos de todos los meses entre start y end,
+    ambos incluidos, en una sola sentencia y transacción. Devuelve cuántos creó.
+    """
+    _check_month(start)
+    _check_month(end)
+    if start > end:
+        raise ValueError(f"Rango de meses invertido: {start} > {end}")
+    with transaction() as conn:
+        before = conn.total_changes
+        conn.execute("""
+            WITH RECURSIVE months(m) AS (
+                SELECT ?
+                UNION ALL
+                SELECT strftime('%Y-%m', m || '-01', '+1 month') FROM months WHERE m < ?
+            )
+            INSERT OR IGNORE INTO budgets(template_key, month, limit_total, template_version_id)
+            SELECT t.ckey, months.m, t.limit_total, t.version_id
+            FROM months CROSS JOIN category_templates t
+        """, (start, end))
+        created = conn.total_changes - before
+        if created:
+            _bump_data_version(conn)
+        return created
+
+@cached_read
 def list_budgets(month=None):
     if not month:
         month = current_month()
-    conn = get_conn()
-    c = conn.cursor()
-    rows = c.execute("""
-        SELECT b.id, b.template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json
-        FROM budgets b
-        JOIN category_templates t ON t.ckey = b.template_key
-        WHERE b.month = ?
-        ORDER BY CASE t.ctype WHEN 'shared' THEN 0 ELSE 1 END, t.name
-    """, (month,)).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT b.id, b.template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json
+            FROM budgets b
+            JOIN template_versions t ON t.id = b.template_version_id
+            WHERE b.month = ?
+            ORDER BY CASE t.ctype WHEN 'shared' THEN 0 ELSE 1 END, t.name
+        """, (month,)).fetchall()
     return rows
 
 def sum_contribs(budget_id):
-    conn = get_conn()
-    c = conn.cursor()
-    total = c.execute("SELECT COALESCE(SUM(amount),0) FROM contributions WHERE budget_id=?", (budget_id,)).fetchone()[0]
-    conn.close()
+    with connection() as conn:
+        total = conn.execute("SELECT COALESCE(SUM(amount),0) FROM balances WHERE budget_id=?",
+                             (budget_id,)).fetchone()[0]
     return int(total or 0)
 
 def sum_contribs_by_user(budget_id, user):
-    conn = get_conn()
-    c = conn.cursor()
-    total = c.execute("SELECT COALESCE(SUM(amount),0) FROM contributions WHERE budget_id=? AND user=?",
-                      (budget_id, user)).fetchone()[0]
-    conn.close()
-    return int(total or 0)
+    with connection() as conn:
+        row = conn.execute("SELECT amount FROM balances WHERE budget_id=? AND user=?",
+                           (budget_id, user)).fetchone()
+    return int(row[0]) if row else 0
+
+# === SALDOS (balances) =======================================================
+def _rebuild_balances(c):
+    c.execute("DELETE FROM balances")
+    c.execute("""
+        INSERT INTO balances(budget_id, user, amount)
+        SELECT budget_id, user, SUM(amount) FROM contributions
+        WHERE budget_id IS NOT NULL AND user IS NOT NULL
+        GROUP BY budget_id, user
+    """)
+
+def verify_balances():
+    """
+    Recalcula los saldos desde contributions y los compara con balances.
+    Devuelve [(budget_id, user, guardado, real)] para cada diferencia.
+    """
+    with connection() as conn:
+        return conn.execute("""
+            SELECT budget_id, user, SUM(stored), SUM(actual) FROM (
+                SELECT budget_id, user, amount AS stored, 0 AS actual FROM balances
+                UNION ALL
+                SELECT budget_id, user, 0, amount FROM contributions
+                WHERE budget_id IS NOT NULL AND user IS NOT NULL
+            )
+            GROUP BY budget_id, user
+            HAVING SUM(stored) != SUM(actual)
+            ORDER BY budget_id, user
+        """).fetchall()
+
+def rebuild_balances():
+    """Reconstruye balances desde cero. Devuelve las diferencias encontradas antes de reconstruir."""
+    with transaction() as conn:
+        drift = verify_balances()
+        _rebuild_balances(conn.cursor())
+        _bump_data_version(conn)
+    return drift
+
+@cached_read
+def month_snapshot(month=None):
+    """
+    Foto del mes (lee balances y category_shares, no recorre contributions).
+    Devuelve (rows, contribs, targets):
+      rows    -> mismas tuplas que list_budgets
+      contribs-> {budget_id: {user: monto_aportado}}
+      targets -> {budget_id: {user: tope_personal}}
+    """
+    if not month:
+        month = current_month()
+    with connection() as conn:
+        data = conn.execute("""
+            SELECT b.id, b.template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json,
+                   s.user, s.amount
+            FROM budgets b
+            JOIN template_versions t ON t.id = b.template_version_id
+            LEFT JOIN balances s ON s.budget_id = b.id
+            WHERE b.month = ?
+            ORDER BY CASE t.ctype WHEN 'shared' THEN 0 ELSE 1 END, t.name, b.id
+        """, (month,)).fetchall()
+        shares = conn.execute(f"""
+            SELECT b.id, s.user, {_TARGET_SQL}
+            FROM budgets b
+            JOIN template_versions t ON t.id = b.template_version_id
+            JOIN category_shares s ON s.version_id = b.template_version_id
+            WHERE b.month = ?
+        """, (month,)).fetchall()
+    targets = {}
+    for budget_id, user, target in shares:
+        targets.setdefault(budget_id, {})[user] = int(target)
+    rows, contribs = [], {}
+    for *row, user, amount in data:
+        row = tuple(row)
+        if row[0] not in contribs:
+            rows.append(row)
+            contribs[row[0]] = {}
+        if user is not None:
+            contribs[row[0]][user] = int(amount or 0)
+    return rows, contribs, targets
+
+# Tope personal de un presupuesto: el precalculado de su versión de template si
+# el límite del mes coincide; si no (meses anteriores a las versiones), se
+# escala la fracción al límite de ese mes.
+_TARGET_SQL = """
+    CASE WHEN b.limit_total = t.limit_total THEN s.target
+         ELSE CAST(ROUND(b.limit_total * s.fraction) AS INTEGER) END
+"""
+
+@cached_read
+def remaining_for_user(month, user):
+    """
+    Categorías del mes donde `user` aún tiene saldo por completar, en una consulta.
+    Devuelve [(row, restante)] con row igual a las tuplas de list_budgets.
+    """
+    with connection() as conn:
+        data = conn.execute(f"""
+            SELECT b.id, b.template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json,
+                   {_TARGET_SQL} - COALESCE(bal.amount, 0) AS remaining
+            FROM budgets b
+            JOIN template_versions t ON t.id = b.template_version_id
+            JOIN category_shares s ON s.version_id = b.template_version_id AND s.user = ?
+            LEFT JOIN balances bal ON bal.budget_id = b.id AND bal.user = s.user
+            WHERE b.month = ? AND remaining > 0
+            ORDER BY CASE t.ctype WHEN 'shared' THEN 0 ELSE 1 END, t.name, b.id
+        """, (user, month)).fetchall()
+    return [(tuple(r[:-1]), int(r[-1])) for r in data]
+
+# === MESES CERRADOS ==========================================================
+# Un mes cerrado (archive.close_month) queda congelado: no acepta aportes ni ingresos.
+
+def closed_months():
+    with connection() as conn:
+        return {r[0] for r in conn.execute("SELECT month FROM month_closures")}
+
+def _assert_open(conn, months=(), budget_ids=()):
+    months, budget_ids = list(set(months)), list(set(budget_ids))
+    if budget_ids:
+        months += [r[0] for r in conn.execute(
+            f"SELECT DISTINCT month FROM budgets WHERE id IN ({','.join('?' * len(budget_ids))})",
+            budget_ids,
+        )]
+    if not months:
+        return
+    row = conn.execute(
+        f"SELECT month FROM month_closures WHERE month IN ({','.join('?' * len(months))}) LIMIT 1",
+        months,
+    ).fetchone()
+    if row:
+        raise ValueError(f"El mes {row[0]} está cerrado; no admite movimientos nuevos.")
 
+@write_op
 def add_contribution(budget_id, user, amount):
-    conn = get_conn()
-    c = conn.cursor()
     ts = datetime.datetime.now().isoformat(timespec="seconds")
-    c.execute("INSERT INTO contributions(budget_id, user, amount, ts) VALUES(?,?,?,?)",
-              (budget_id, user, int(amount), ts))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        _assert_open(conn, budget_ids=[budget_id])
+        conn.execute("INSERT INTO contributions(budget_id, user, amount, ts) VALUES(?,?,?,?)",
+                     (budget_id, user, int(amount), ts))
+        _bump_data_version(conn)
 
+@write_op
 def add_income(user, amount, note=""):
-    conn = get_conn()
-    c = conn.cursor()
     ts = datetime.datetime.now().isoformat(timespec="seconds")
-    c.execute(
-        "INSERT INTO incomes(user, amount, ts, note) VALUES(?,?,?,?)",
-        (user, int(amount), ts, note),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        _assert_open(conn, months=[ts[:7]])
+        conn.execute(
+            "INSERT INTO incomes(user, amount, ts, note) VALUES(?,?,?,?)",
+            (user, int(amount), ts, note),
+        )
+        _bump_data_version(conn)
+
+@write_op
+def record_distribution(user, amount, note="", allocations=(), idempotency_key=None, ts=None):
+    """
+    Registra un ingreso y todos sus aportes en una sola transacción.
+    allocations: iterable de (budget_id, monto); los montos <= 0 se ignoran.
+    Si idempotency_key ya fue usada no escribe nada.
+    ts: fecha ISO del ingreso (por defecto, ahora).
+    Devuelve (income_id, applied).
+    """
+    ts = ts or datetime.datetime.now().isoformat(timespec="seconds")
+    with transaction() as conn:
+        if idempotency_key is not None:
+            row = conn.execute("SELECT id FROM incomes WHERE idem_key=?", (idempotency_key,)).fetchone()
+            if row:
+                return row[0], False
+        allocations = [(int(b_id), int(amt)) for b_id, amt in allocations if int(amt) > 0]
+        _assert_open(conn, months=[ts[:7]], budget_ids=[b_id for b_id, _ in allocations])
+        cur = conn.execute(
+            "INSERT INTO incomes(user, amount, ts, note, idem_key) VALUES(?,?,?,?,?)",
+            (user, int(amount), ts, note, idempotency_key),
+        )
+        income_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO contributions(budget_id, user, amount, ts, income_id) VALUES(?,?,?,?,?)",
+            [(b_id, user, amt, ts, income_id) for b_id, amt in allocations],
+        )
+        _bump_data_version(conn)
+    return income_id, True
+
+@write_op
+def insert_incomes(rows):
+    """
+    Inserta en bloque [(user, amount, ts, note, idem_key)] en una transacción.
+    Las filas con idem_key ya existente se omiten. Devuelve cuántas se insertaron.
+    """
+    rows = list(rows)
+    with transaction() as conn:
+        _assert_open(conn, months=[r[2][:7] for r in rows])
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO incomes(user, amount, ts, note, idem_key) VALUES(?,?,?,?,?)",
+            rows,
+        )
+        inserted = conn.total_changes - before
+        if inserted:
+            _bump_data_version(conn)
+    return inserted
+
+def list_users():
+    with connection() as conn:
+        return [r[0] for r in conn.execute("SELECT name FROM users ORDER BY id")]
+
+def contributions_for_income(income_id):
+    """[(budget_id, monto)] aportados por un ingreso."""
+    with connection() as conn:
+        return conn.execute(
+            "SELECT budget_id, amount FROM contributions WHERE income_id=? ORDER BY id",
+            (income_id,),
+        ).fetchall()
 
+@cached_read
 def incomes_for_user(user, limit=20):
-    conn = get_conn()
-    c = conn.cursor()
-    rows = c.execute(
-        """
-        SELECT amount, ts, note
-        FROM incomes
-        WHERE user = ?
-        ORDER BY ts DESC
-        LIMIT ?
-        """,
-        (user, int(limit)),
-    ).fetchall()
-    conn.close()
+    with connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT amount, ts, note
+            FROM incomes
+            WHERE user = ?
+            ORDER BY ts DESC
+            LIMIT ?
+            """,
+            (user, int(limit)),
+        ).fetchall()
     return rows
+
+# === HISTORIAL PAGINADO ======================================================
+# Paginación por cursor (keyset) sobre (ts, id) descendente: cada página es una
+# búsqueda en el índice (user, ts), sin OFFSET ni ordenar la tabla completa.
+
+def _day_after(day):
+    d = datetime.date.fromisoformat(str(day))
+    return (d + datetime.timedelta(days=1)).isoformat()
+
+@cached_read
+def history_page(user, kind="incomes", cursor=None, limit=50,
+                 date_from=None, date_to=None, category=None):
+    """
+    Una página del historial de `user`, del más reciente al más antiguo.
+    kind      -> "incomes" o "contributions"
+    cursor    -> None (primera página) o el next_cursor de la página anterior
+    date_from / date_to -> fechas 'YYYY-MM-DD' (o date), ambas incluidas
+    category  -> template_key (sólo para contributions)
+    Devuelve (rows, next_cursor); next_cursor es None en la última página.
+      incomes:       (id, ts, amount, note)
+      contributions: (id, ts, amount, month, category_name, income_id)
+    """
+    where, params = ["x.user = ?"], [user]
+    if date_from:
+        where.append("x.ts >= ?")
+        params.append(str(date_from))
+    if date_to:
+        where.append("x.ts < ?")
+        params.append(_day_after(date_to))
+    if cursor is not None:
+        where.append("(x.ts, x.id) < (?, ?)")
+        params.extend(cursor)
+
+    if kind == "incomes":
+        if category:
+            raise ValueError("category sólo aplica a contributions")
+        sql = "SELECT x.id, x.ts, x.amount, x.note FROM incomes x"
+    elif kind == "contributions":
+        if category:
+            where.append("b.template_key = ?")
+            params.append(category)
+        sql = """
+            SELECT x.id, x.ts, x.amount, b.month, t.name, x.income_id
+            FROM contributions x
+            LEFT JOIN budgets b ON b.id = x.budget_id
+            LEFT JOIN template_versions t ON t.id = b.template_version_id
+        """
+    else:
+        raise ValueError(f"kind inválido: {kind!r}")
+
+    sql += " WHERE " + " AND ".join(where) + " ORDER BY x.ts DESC, x.id DESC LIMIT ?"
+    params.append(int(limit) + 1)
+    with connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1][1], rows[-1][0])
+    return rows, None
+
+@cached_read
+def list_categories():
+    """[(ckey, name, ctype, owner)] de los templates vigentes."""
+    with connection() as conn:
+        return conn.execute("""
+            SELECT ckey, name, ctype, owner FROM category_templates
+            ORDER BY CASE ctype WHEN 'shared' THEN 0 ELSE 1 END, name, ckey
+        """).fetchall()
@@ -0,0 +1,183 @@
+"""
+Importación masiva de ingresos desde CSV (cartolas, sueldos y quincenas históricas).
+
+Lee el archivo fila a fila (nunca lo carga completo), valida cada fila y
+escribe en bloques de `chunk` filas, cada bloque en una transacción.
+
+Columnas (encabezado obligatorio, sin importar mayúsculas):
+    fecha | date | ts          YYYY-MM-DD, YYYY-MM-DD HH:MM[:SS], DD/MM/YYYY o DD-MM-YYYY
+    monto | amount             pesos enteros ($1.234.567, 1,234,567, 1234567); se rechazan
+                               los montos con decimales (1.000,50 / 1234.56) y los de
+                               separadores ambiguos, en vez de leerlos como 100050
+    usuario | user             opcional si se pasa default_user
+    nota | note | descripcion  opcional
+
+Cada fila genera una clave de idempotencia a partir de su contenido, así que
+volver a importar el mismo archivo no duplica ingresos. Con replay=True cada
+ingreso se distribuye además con el motor de asignación en el mes de su fecha.
+"""
+import csv, datetime, hashlib, io, re, time
+
+import db
+from utils import parse_money, proportional_allocate
+
+COLUMNS = {
+    "ts": ("fecha", "date", "ts"),
+    "amount": ("monto", "amount"),
+    "user": ("usuario", "user"),
+    "note": ("nota", "note", "descripcion", "descripción", "glosa"),
+}
+MAX_REJECTED = 1000  # filas rechazadas que se guardan con detalle
+
+# Regex precompiladas: strptime probando formato por formato domina el tiempo
+# de importación en archivos grandes.
+_ISO_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2}))?)?$")
+_DMY_RE = re.compile(r"^(\d{1,2})[/-](\d{1,2})[/-](\d{4})$")
+_DECIMALS_RE = re.compile(r"[.,]\d{1,2}$")
+_THOUSANDS_RE = re.compile(r"^\d{1,3}(?:([.,])\d{3})(?:\1\d{3})*$")
+
+def check_amount(raw):
+    """
+    Pesos enteros o ValueError. parse_money descarta todo lo que no es dígito,
+    así que "1.000,50" daría 100050: esos montos se rechazan en vez de inflarlos.
+    """
+    core = re.sub(r"[^\d.,]", "", raw)
+    if _DECIMALS_RE.search(core):
+        raise ValueError(f"monto con decimales (se importan pesos enteros): {raw!r}")
+    if ("." in core or "," in core) and not _THOUSANDS_RE.match(core):
+        raise ValueError(f"monto con separadores ambiguos: {raw!r}")
+    return parse_money(core)
+
+def parse_ts(s):
+    s = (s or "").strip()
+    try:
+        m = _ISO_RE.match(s)
+        if m:
+            y, mo, d, hh, mi, ss = m.groups()
+            dt = datetime.datetime(int(y), int(mo), int(d), int(hh or 0), int(mi or 0), int(ss or 0))
+            return dt.isoformat(timespec="seconds")
+        m = _DMY_RE.match(s)
+        if m:
+            d, mo, y = m.groups()
+            return datetime.datetime(int(y), int(mo), int(d)).isoformat(timespec="seconds")
+    except ValueError:
+        pass
+    raise ValueError(f"fecha inválida: {s!r}")
+
+def _header_map(header):
+    names = [h.strip().lower() for h in header]
+    cols = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                cols[field] = names.index(alias)
+                break
+    missing = [f for f in ("ts", "amount") if f not in cols]
+    if missing:
+        raise ValueError(f"faltan columnas en el encabezado: {', '.join(missing)}")
+    return cols
+
+def iter_rows(stream, default_user=None, delimiter=None):
+    """
+    Genera (n_línea, fila_validada | None, motivo_rechazo | None) leyendo `stream`
+    de a una línea. fila_validada = (user, amount, ts, note).
+    """
+    first = stream.readline()
+    if not first:
+        return
+    if delimiter is None:
+        delimiter = ";" if first.count(";") > first.count(",") else ","
+    cols = _header_map(next(csv.reader([first], delimiter=delimiter)))
+    users = set(db.list_users())
+    closed = db.closed_months()
+
+    for line_no, rec in enumerate(csv.reader(stream, delimiter=delimiter), start=2):
+        if not any(field.strip() for field in rec):
+            continue
+        try:
+            def col(field, default=""):
+                i = cols.get(field)
+                return rec[i].strip() if i is not None and i < len(rec) else default
+
+            raw_amount = col("amount")
+            if raw_amount.startswith("-"):
+                raise ValueError(f"monto negativo (no es ingreso): {raw_amount!r}")
+            amount = check_amount(raw_amount)
+            if amount <= 0:
+                raise ValueError(f"monto inválido: {raw_amount!r}")
+            ts = parse_ts(col("ts"))
+            if ts[:7] in closed:
+                raise ValueError(f"mes cerrado: {ts[:7]}")
+            user = col("user") or default_user
+            if user not in users:
+                raise ValueError(f"usuario desconocido: {user!r}")
+            yield line_no, (user, amount, ts, col("note")), None
+        except ValueError as e:
+            yield line_no, None, str(e)
+
+def _idem_key(row, seen):
+    """Clave estable por contenido; filas idénticas dentro del archivo se numeran."""
+    base = "|".join(str(v) for v in row)
+    n = seen.get(base, 0)
+    seen[base] = n + 1
+    return "import:" + hashlib.sha1(f"{base}|{n}".encode("utf-8")).hexdigest()
+
+def import_incomes(stream, default_user=None, replay=False, chunk=5000, delimiter=None, progress=None):
+    """
+    Importa ingresos desde un stream de texto CSV.
+    progress: callback opcional progress(report) tras cada bloque.
+    Devuelve un reporte {read, inserted, duplicates, rejected, rejected_rows, seconds, rows_per_sec}.
+    """
+    t0 = time.perf_counter()
+    report = {"read": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "rejected_rows": []}
+    seen, batch, months = {}, [], set()
+
+    def flush():
+        if not batch:
+            return
+        if replay:
+            inserted = 0
+            with db.transaction():
+                for user, amount, ts, note, key in batch:
+                    month = ts[:7]
+                    if month not in months:
+                        db.ensure_budgets_for_month(month)
+                        months.add(month)
+                    _, _, applied = proportional_allocate(user, amount, month, note=note,
+                                                          idempotency_key=key, ts=ts)
+                    inserted += applied
+        else:
+            inserted = db.insert_incomes(batch)
+        report["inserted"] += inserted
+        report["duplicates"] += len(batch) - inserted
+        batch.clear()
+        if progress:
+            progress(report)
+
+    for line_no, row, reason in iter_rows(stream, default_user, delimiter):
+        report["read"] += 1
+        if row is None:
+            report["rejected"] += 1
+            if len(report["rejected_rows"]) < MAX_REJECTED:
+                report["rejected_rows"].append((line_no, reason))
+            continue
+        batch.append(row + (_idem_key(row, seen),))
+        if len(batch) >= chunk:
+            flush()
+    flush()
+
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    report["rows_per_sec"] = round(report["read"] / report["seconds"], 1) if report["seconds"] else None
+    return report
+
+def import_file(path, **kwargs):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return import_incomes(f, **kwargs)
+
+def import_upload(uploaded, **kwargs):
+    """Para st.file_uploader: envuelve el archivo binario sin leerlo entero."""
+    stream = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+    try:
+        return import_incomes(stream, **kwargs)
+    finally:
+        stream.detach()
@@ -0,0 +1,221 @@
+"""
+Libro contable completo (ingresos y aportes) en streaming, para exportar.
+
+iter_batches() recorre los cursores con fetchmany(batch_size) y entrega
+listas de tuplas en el orden de COLUMNS; iter_ledger() las aplana fila a
+fila. Nada arma la lista completa: los escritores (CSV, JSONL y Parquet)
+van bajando cada lote al archivo, así que la memoria no depende del tamaño
+del libro.
+
+  kind          income | income_rollup | contribution
+  month         income: mes de la fecha; contribution: mes del presupuesto
+  note          la del ingreso (en los aportes, la del ingreso que los originó;
+                vacía si ese ingreso ya se archivó al cerrar su mes)
+  income_id     NULL en los rollups y en aportes cuyo ingreso se archivó
+  category_*    de la versión de la plantilla con que se creó el presupuesto
+                (template_versions, la historia de category_templates)
+  rollup_n      en meses cerrados: cuántas filas resume el total (ver archive.py)
+
+Los ingresos salen por (ts, id) y los aportes por id, los dos sin ordenar en
+memoria (índice ix_incomes_ts y rowid). Todo se lee en una sola transacción de
+lectura sobre una conexión propia: una foto consistente aunque la app siga
+escribiendo (con WAL no bloquea a nadie) y sin tocar la conexión prestada al hilo.
+"""
+import csv, json, os, sys
+
+import db
+
+COLUMNS = ("kind", "id", "ts", "month", "user", "amount", "note", "income_id", "budget_id",
+           "category_key", "category", "category_type", "owner", "limit_total", "template_version",
+           "rollup_n")
+KINDS = ("incomes", "contributions")
+FORMATS = ("csv", "jsonl", "parquet")
+BATCH = 5000
+
+def _month_bounds(start, end):
+    if start is not None:
+        db._check_month(start)
+    if end is not None:
+        db._check_month(end)
+    if start is not None and end is not None and start > end:
+        raise ValueError(f"Rango de meses invertido: {start} > {end}")
+
+def _queries(start, end, user, kinds):
+    """[(sql, params)] de cada sección del libro, con los filtros aplicados."""
+    out = []
+    if "incomes" in kinds:
+        where, params = [], []
+        if start is not None:
+            where.append("i.ts >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("i.ts < ?")
+            params.append(db._next_month(end))
+        if user is not None:
+            where.append("i.user = ?")
+            params.append(user)
+        out.append((f"""
+            SELECT 'income', i.id, i.ts, substr(i.ts, 1, 7), i.user, i.amount, i.note,
+                   NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+            FROM incomes i INDEXED BY ix_incomes_ts
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY i.ts, i.id
+        """, params))
+
+        where, params = [], []
+        if start is not None:
+            where.append("r.month >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("r.month <= ?")
+            params.append(end)
+        if user is not None:
+            where.append("r.user = ?")
+            params.append(user)
+        out.append((f"""
+            SELECT 'income_rollup', NULL, NULL, r.month, r.user, r.amount, NULL,
+                   NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, r.n
+            FROM income_rollups r
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY r.month, r.user
+        """, params))
+
+    if "contributions" in kinds:
+        where, params = [], []
+        if start is not None:
+            where.append("b.month >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("b.month <= ?")
+            params.append(end)
+        if user is not None:
+            where.append("c.user = ?")
+            params.append(user)
+        # CROSS JOIN fija contributions como tabla externa: se recorre por rowid
+        # y el ORDER BY no necesita ordenar en un B-tree temporal.
+        out.append((f"""
+            SELECT 'contribution', c.id, c.ts, b.month, c.user, c.amount, i.note,
+                   c.income_id, c.budget_id, b.template_key, t.name, t.ctype, t.owner,
+                   b.limit_total, t.version, c.rollup_n
+            FROM contributions c
+            CROSS JOIN budgets b ON b.id = c.budget_id
+            LEFT JOIN template_versions t ON t.id = b.template_version_id
+            LEFT JOIN incomes i ON i.id = c.income_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY c.id
+        """, params))
+    return out
+
+def iter_batches(start=None, end=None, user=None, kinds=KINDS, batch_size=BATCH):
+    """
+    Lotes (listas de hasta batch_size tuplas, columnas COLUMNS) del libro entre
+    los meses start y end (YYYY-MM, inclusive; None = sin límite), opcionalmente
+    de un solo usuario. kinds: subconjunto de KINDS.
+    """
+    _month_bounds(start, end)
+    kinds = tuple(kinds)
+    unknown = set(kinds) - set(KINDS)
+    if unknown or not kinds:
+        raise ValueError(f"kinds inválido: {kinds!r} (opciones: {', '.join(KINDS)})")
+    # Validado acá y no dentro del generador: el error sale antes de escribir nada.
+    return _batches(_queries(start, end, user, kinds), batch_size)
+
+def _batches(queries, batch_size):
+    conn = db.get_conn(db.current_path())
+    try:
+        conn.execute("BEGIN")  # una sola foto para todas las secciones
+        for sql, params in queries:
+            cur = conn.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield batch
+        conn.commit()
+    finally:
+        conn.close()
+
+def iter_ledger(**filters):
+    """Fila a fila (tuplas en el orden de COLUMNS); mismos filtros que iter_batches."""
+    for batch in iter_batches(**filters):
+        yield from batch
+
+# === ESCRITORES ===============================================================
+# Cada uno recibe lotes de iter_batches() y devuelve cuántas filas escribió.
+
+def write_csv(batches, f):
+    w = csv.writer(f)
+    w.writerow(COLUMNS)
+    n = 0
+    for batch in batches:
+        w.writerows(batch)
+        n += len(batch)
+    return n
+
+def write_jsonl(batches, f):
+    n = 0
+    for batch in batches:
+        f.write("".join(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in batch))
+        n += len(batch)
+    return n
+
+def _parquet_schema(pa):
+    text, num = pa.string(), pa.int64()
+    types = {"kind": text, "ts": text, "month": text, "user": text, "note": text,
+             "category_key": text, "category": text, "category_type": text, "owner": text}
+    return pa.schema([(c, types.get(c, num)) for c in COLUMNS])
+
+def write_parquet(batches, f):
+    """Un row group por lote. Necesita pyarrow (viene con streamlit)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet necesita pyarrow (pip install pyarrow).") from None
+    schema = _parquet_schema(pa)
+    n = 0
+    with pq.ParquetWriter(f, schema) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+            n += len(batch)
+    return n
+
+def format_for(path, fmt=None):
+    """Formato pedido, o el de la extensión del archivo (por defecto csv)."""
+    if fmt is None:
+        ext = os.path.splitext(path or "")[1].lstrip(".").lower()
+        fmt = ext if ext in FORMATS else "csv"
+    if fmt not in FORMATS:
+        raise ValueError(f"formato inválido: {fmt!r} (opciones: {', '.join(FORMATS)})")
+    return fmt
+
+def write(f, fmt, **filters):
+    """Escribe el libro en el archivo abierto f (texto para csv/jsonl, binario para parquet)."""
+    writer = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}[format_for(None, fmt)]
+    return writer(iter_batches(**filters), f)
+
+def export(path, fmt=None, **filters):
+    """
+    Exporta a `path` ("-" o None = stdout, salvo parquet) de forma atómica.
+    Devuelve cuántas filas escribió.
+    """
+    fmt = format_for(path, fmt)
+    if path in (None, "-"):
+        if fmt == "parquet":
+            raise ValueError("Parquet necesita un archivo de salida (-o).")
+        return write(sys.stdout, fmt, **filters)
+    tmp = path + ".tmp"
+    try:
+        if fmt == "parquet":
+            with open(tmp, "wb") as f:
+                n = write(f, fmt, **filters)
+        else:
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                n = write(f, fmt, **filters)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return n
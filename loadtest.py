@@ -0,0 +1,329 @@
+"""
+Prueba de carga de app.py con muchas sesiones a la vez (nunca toca budget.db).
+
+    python loadtest.py                                   # 8 sesiones, 30 s
+    python loadtest.py --sessions 16 --duration 60 --save base.json
+    BUDGET_WRITE_BEHIND=1 python loadtest.py --compare base.json   # exit 1 si empeora
+
+Cada sesión virtual es un AppTest de Streamlit que corre el script real
+(sin navegador) contra una base sintética de bench.py, en su propio
+proceso: AppTest reemplaza el Runtime global de Streamlit en cada rerun,
+así que dos AppTest en hilos del mismo proceso se pisan. Las sesiones
+compiten entonces por el mismo archivo como varios workers; la caché y el
+pool son por proceso. Cada sesión repite, hasta cumplir --duration, una
+acción al azar según --mix:
+
+  rerun       rerun sin cambios (un clic cualquiera)
+  type        escribe un monto en "Monto recibido" (lo que pasa en cada tecla)
+  distribute  "Distribuir ahora" con un monto y nota nuevos
+  rebalance   "Rebalancear y aplicar" con la sugerencia del formulario
+              (dos reruns: escribir el monto y enviar)
+
+y registra la latencia del rerun, las excepciones que mostró la app
+(separando las de contención: "database is locked"/busy), el throughput y
+cuántas consultas pasaron BUDGET_SLOW_QUERY_MS (metrics).
+AppTest no ejecuta reruns parciales de fragmentos: cada acción es un rerun
+completo, así que las latencias son una cota superior de lo que ve el usuario.
+Tampoco ejecuta run_every: con BUDGET_REFRESH_S > 0 cada sesión hace además,
+cada esos segundos, lo que hace el refresco del Resumen (summary_rows: la
+consulta a data_version y, si hubo escrituras, la foto del mes), y aparece
+como "refresco" en el reporte.
+Al final verifica balances contra los aportes.
+
+Las variables de entorno (BUDGET_WRITE_BEHIND, BUDGET_DB_POOL, BUDGET_BACKEND,
+...) pasan a los procesos, así que se pueden comparar configuraciones.
+"""
+import argparse, datetime, json, logging, multiprocessing, os, platform, random, sqlite3, sys, tempfile, time
+
+import bench
+import db
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(ROOT, "app.py")
+ACTIONS = ("rerun", "type", "distribute", "rebalance")
+WRITES = ("distribute", "rebalance")
+DEFAULT_MIX = "rerun=5,type=3,distribute=1,rebalance=1"
+ENV_KNOBS = ("BUDGET_BACKEND", "BUDGET_WRITE_BEHIND", "BUDGET_WRITE_BATCH", "BUDGET_GROUP_COMMIT_MS",
+             "BUDGET_DB_POOL", "BUDGET_METRICS", "BUDGET_REFRESH_S")
+
+def parse_mix(text):
+    """"rerun=5,distribute=1" -> {"rerun": 5.0, "distribute": 1.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"acción desconocida en --mix: {name!r} (opciones: {', '.join(ACTIONS)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("--mix no tiene ninguna acción con peso > 0")
+    return mix
+
+# ---------- una sesión ----------
+
+def _is_lock(message):
+    message = message.lower()
+    return "locked" in message or "busy" in message
+
+def _button(at, label):
+    for b in at.button:
+        if b.label == label:
+            return b
+    raise LookupError(f"no está el botón {label!r}")
+
+class Session:
+    """Un navegador virtual: un AppTest con su propio session_state."""
+
+    def __init__(self, user, rnd, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.user, self.rnd, self.timeout = user, rnd, timeout
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.n = 0
+
+    def start(self):
+        self.at.run()
+        self.at.sidebar.selectbox[0].select(self.user)
+        self.at.run()
+
+    def _amount(self):
+        return f"{self.rnd.randrange(10_000, 600_000, 1000):,}".replace(",", ".")
+
+    def rerun(self):
+        self.at.run()
+
+    def type(self):
+        self.at.text_input(key="ingreso_monto_display").input(self._amount())
+        self.at.run()
+
+    def distribute(self):
+        self.n += 1
+        self.at.text_input(key="ingreso_monto_display").input(self._amount())
+        # Nota distinta en cada intento: si no, la clave de idempotencia lo deduplica.
+        note = next(t for t in self.at.text_input if t.label == "Nota (opcional)" and t.key is None)
+        note.input(f"carga {os.getpid()}-{self.n}")
+        _button(self.at, "Distribuir ahora").click()
+        self.at.run()
+
+    def rebalance(self):
+        self.n += 1
+        self.at.text_input(key="manual_monto_display").input(self._amount())
+        self.at.text_input(key="manual_nota").input(f"carga {os.getpid()}-{self.n}")
+        self.at.run()
+        try:
+            submit = _button(self.at, "🔁 Rebalancear y aplicar")
+        except LookupError:
+            return  # sin categorías con capacidad: la app no muestra el formulario
+        submit.click()
+        self.at.run()
+
+    def refresh(self):
+        """El refresco periódico del Resumen (run_every), sin AppTest. Devuelve (ms, error)."""
+        import utils
+        t0 = time.perf_counter()
+        try:
+            utils.summary_rows(db.current_month(), self.user)
+        except Exception as e:
+            return (time.perf_counter() - t0) * 1000, "lock" if _is_lock(str(e)) else type(e).__name__
+        return (time.perf_counter() - t0) * 1000, None
+
+    def act(self, action):
+        """Corre la acción y devuelve (ms, error); error = None, "lock" o el tipo de excepción."""
+        t0 = time.perf_counter()
+        try:
+            getattr(self, action)()
+        except Exception as e:
+            return (time.perf_counter() - t0) * 1000, "lock" if _is_lock(str(e)) else type(e).__name__
+        ms = (time.perf_counter() - t0) * 1000
+        for exc in self.at.exception:
+            return ms, "lock" if _is_lock(exc.message) else "app:" + exc.message.split(":")[0][:40]
+        return ms, None
+
+# ---------- procesos ----------
+
+def worker(idx, cfg):
+    """Una sesión en este proceso. Devuelve ([(acción, ms, error)], consultas lentas)."""
+    os.environ["BUDGET_DB"] = cfg["db"]
+    db.DB_PATH = cfg["db"]
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    # Las consultas lentas se cuentan con metrics; no hace falta verlas una por una.
+    logging.getLogger("finanzas.sql").setLevel(logging.ERROR)
+    from streamlit.logger import set_log_level
+    set_log_level("warning")
+    rnd = random.Random(cfg["seed"] * 1000 + idx)
+    samples = []
+    try:
+        s = Session(bench.USERS[idx % len(bench.USERS)], rnd, cfg["timeout"])
+        t0 = time.perf_counter()
+        s.start()
+        samples.append(("inicio", (time.perf_counter() - t0) * 1000, None))
+    except Exception as e:
+        samples.append(("inicio", 0.0, "lock" if _is_lock(str(e)) else type(e).__name__))
+        return samples, 0
+    names, weights = zip(*cfg["mix"].items())
+    time.sleep(max(0.0, cfg["start_at"] - time.time()))
+    deadline = cfg["start_at"] + cfg["duration"]
+    refresh_s = cfg["refresh_s"]
+    next_refresh = cfg["start_at"] + rnd.uniform(0, refresh_s)
+    while time.time() < deadline:
+        if refresh_s and time.time() >= next_refresh:
+            next_refresh += refresh_s
+            samples.append(("refresco",) + s.refresh())
+            continue
+        action = rnd.choices(names, weights)[0]
+        ms, err = s.act(action)
+        samples.append((action, ms, err))
+        if cfg["think_ms"]:
+            time.sleep(rnd.uniform(0.5, 1.5) * cfg["think_ms"] / 1000)
+    db.close_all()
+    return samples, len(metrics.snapshot()["slow_queries"])
+
+# ---------- resultados ----------
+
+def summarize(samples, elapsed, slow_queries=0):
+    by_kind = {}
+    for kind, ms, err in samples:
+        by_kind.setdefault(kind, []).append((ms, err))
+    results = {}
+    for kind in ("inicio",) + ACTIONS + ("refresco",):
+        rows = by_kind.get(kind)
+        if not rows:
+            continue
+        ok = sorted(ms for ms, err in rows if err is None) or [0.0]
+        errors = {}
+        for _, err in rows:
+            if err is not None:
+                errors[err] = errors.get(err, 0) + 1
+        results[kind] = {
+            "n": len(rows),
+            "p50_ms": round(bench._pct(ok, 50), 2),
+            "p95_ms": round(bench._pct(ok, 95), 2),
+            "p99_ms": round(bench._pct(ok, 99), 2),
+            "max_ms": round(ok[-1], 2),
+            "errors": sum(errors.values()),
+            "lock_errors": errors.get("lock", 0),
+            "error_kinds": errors,
+        }
+    actions = [s for s in samples if s[0] not in ("inicio", "refresco")]
+    writes_ok = sum(1 for kind, _, err in actions if kind in WRITES and err is None)
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "actions": len(actions),
+        "actions_per_s": round(len(actions) / elapsed, 2) if elapsed else 0.0,
+        "writes_per_s": round(writes_ok / elapsed, 2) if elapsed else 0.0,
+        "errors": sum(1 for _, _, err in actions if err is not None),
+        "lock_errors": sum(1 for _, _, err in actions if err == "lock"),
+        "slow_queries": slow_queries,
+        "by_action": results,
+    }
+
+def report(summary, baseline=None, tolerance=1.25):
+    regressions = []
+    print(f"{'acción':12} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9} "
+          f"{'errores':>8} {'locks':>6}  vs base (p95)")
+    base_actions = (baseline or {}).get("by_action", {})
+    for kind, r in summary["by_action"].items():
+        extra = ""
+        base = base_actions.get(kind)
+        if base and base["p95_ms"] > 0 and kind != "inicio":
+            ratio = r["p95_ms"] / base["p95_ms"]
+            extra = f"x{ratio:.2f}"
+            if ratio > tolerance:
+                extra += "  <-- REGRESIÓN"
+                regressions.append(kind)
+        print(f"{kind:12} {r['n']:6d} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} "
+              f"{r['max_ms']:9.1f} {r['errors']:8d} {r['lock_errors']:6d}  {extra}")
+        others = {k: v for k, v in r["error_kinds"].items() if k != "lock"}
+        if others:
+            print(f"{'':12} otros errores: {others}")
+    print(f"{summary['actions']} acciones en {summary['elapsed_s']} s: "
+          f"{summary['actions_per_s']} acciones/s, {summary['writes_per_s']} escrituras/s, "
+          f"{summary['lock_errors']} errores de bloqueo, {summary['slow_queries']} consultas lentas")
+    if baseline is not None and summary["lock_errors"] > baseline.get("lock_errors", 0):
+        print(f"Más errores de bloqueo que el baseline ({baseline.get('lock_errors', 0)}).  <-- REGRESIÓN")
+        regressions.append("lock_errors")
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prueba de carga de app.py con sesiones concurrentes (AppTest)")
+    ap.add_argument("--sessions", type=int, default=8, help="sesiones simultáneas (un proceso cada una)")
+    ap.add_argument("--duration", type=float, default=30, help="segundos de carga")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"pesos de cada acción (por defecto {DEFAULT_MIX})")
+    ap.add_argument("--think-ms", type=float, default=0, help="pausa media entre acciones de una sesión")
+    ap.add_argument("--timeout", type=float, default=60, help="tope por rerun de AppTest (s)")
+    ap.add_argument("--size", choices=bench.SIZES, default="small", help="tamaño de la base sintética")
+    ap.add_argument("--db", help="ruta de la base sintética (por defecto, temporal)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--save", help="guarda los resultados como baseline JSON")
+    ap.add_argument("--compare", help="compara contra un baseline JSON")
+    ap.add_argument("--tolerance", type=float, default=1.25, help="p95 nuevo / p95 base tolerado")
+    args = ap.parse_args(argv)
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        sys.exit("loadtest.py necesita streamlit (pip install -r requirements.txt).")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="loadtest_"), "load.db")
+    if os.path.exists(path):
+        sys.exit(f"{path} ya existe; usa otra ruta para no pisar datos.")
+    cats, years, contribs, incs = bench.SIZES[args.size]
+    t0 = time.perf_counter()
+    bench.generate(path, cats, years, contribs, incs)
+    db.close_all()
+    refresh_s = float(os.environ.get("BUDGET_REFRESH_S", "0"))
+    params = {"size": args.size, "sessions": args.sessions, "duration": args.duration,
+              "mix": mix, "think_ms": args.think_ms, "refresh_s": refresh_s}
+    env = {k: os.environ[k] for k in ENV_KNOBS if k in os.environ}
+    print(f"Base sintética {path} ({time.perf_counter() - t0:.1f}s); {args.sessions} sesiones, "
+          f"{args.duration:g} s, mezcla {mix}" + (f", {env}" if env else ""))
+
+    # Margen para que todas las sesiones arranquen (primer rerun) antes de medir.
+    start_at = time.time() + 10 + 0.5 * args.sessions
+    cfg = {"db": path, "duration": args.duration, "mix": mix, "think_ms": args.think_ms,
+           "timeout": args.timeout, "seed": args.seed, "start_at": start_at, "refresh_s": refresh_s}
+    os.environ["BUDGET_DB"] = path
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "warning")
+    # spawn: procesos limpios, sin conexiones SQLite heredadas del padre.
+    with multiprocessing.get_context("spawn").Pool(args.sessions) as pool:
+        parts = pool.starmap(worker, [(i, cfg) for i in range(args.sessions)])
+    samples = [s for part, _ in parts for s in part]
+    elapsed = max(args.duration, time.time() - start_at)
+
+    summary = summarize(samples, elapsed, sum(slow for _, slow in parts))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            saved = json.load(f)
+        baseline = saved["summary"]
+        if saved.get("params") != json.loads(json.dumps(params)):
+            print(f"Ojo: el baseline usa otros parámetros {saved.get('params')}; la comparación no es 1:1.")
+    regressions = report(summary, baseline, args.tolerance)
+
+    drift = db.verify_balances()
+    if drift:
+        print(f"balances NO cuadra con contributions en {len(drift)} filas.  <-- ERROR")
+        regressions.append("balances")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "params": params,
+                "env": env,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "summary": summary,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Baseline guardado en {args.save}")
+    db.close_all()
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Instrumentación liviana: consultas SQL, conexiones y tiempos por sección.
+
+db.get_conn() abre las conexiones con TracedConnection, que mide cada
+execute/executemany/executescript, tanto de la conexión como de sus cursores
+(preparación + primer paso; lo que se itera después con fetch no entra), y lo
+acumula por sentencia. "connections" cuenta las conexiones creadas desde que
+arrancó el proceso, no las abiertas ahora. Las que pasan
+SLOW_QUERY_MS quedan en un log acotado y en el logger "finanzas.sql".
+
+En la app, cada rerun abre start_run()/end_run() y las partes de la página
+se envuelven en section("nombre"); el panel de depuración muestra el último
+rerun. snapshot() devuelve todo como dict y export(path) lo guarda en JSON.
+Con BUDGET_METRICS_FILE cada rerun se agrega además como una línea JSONL.
+
+BUDGET_METRICS=0 apaga la medición de consultas (las secciones siguen).
+"""
+import collections, datetime, json, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("BUDGET_METRICS", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("BUDGET_SLOW_QUERY_MS", "50"))
+SLOW_SECTION_MS = float(os.environ.get("BUDGET_SLOW_SECTION_MS", "500"))
+METRICS_FILE = os.environ.get("BUDGET_METRICS_FILE")
+SLOW_LOG_SIZE = 200
+RUNS_KEPT = 50
+
+def _log():
+    import logging  # sólo hace falta si algo resultó lento
+    return logging.getLogger("finanzas.sql")
+
+_lock = threading.Lock()
+_local = threading.local()
+
+def _empty():
+    return {
+        "connections": 0,
+        "queries": 0,
+        "query_ms": 0.0,
+        "statements": {},   # sql normalizado -> [veces, ms total, ms máx]
+        "sections": {},     # nombre -> [veces, ms total, ms máx, ms último]
+        "slow": collections.deque(maxlen=SLOW_LOG_SIZE),
+        "runs": collections.deque(maxlen=RUNS_KEPT),
+        "since": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+_totals = _empty()
+
+def _normalize(sql):
+    return " ".join(sql.split())[:300]
+
+# ---------- consultas ----------
+
+def record_query(sql, ms):
+    key = _normalize(sql)
+    slow = ms >= SLOW_QUERY_MS
+    with _lock:
+        _totals["queries"] += 1
+        _totals["query_ms"] += ms
+        st = _totals["statements"].setdefault(key, [0, 0.0, 0.0])
+        st[0] += 1
+        st[1] += ms
+        st[2] = max(st[2], ms)
+        if slow:
+            _totals["slow"].append({
+                "ts": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "ms": round(ms, 3), "sql": key, "thread": threading.current_thread().name,
+            })
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["queries"] += 1
+        run["query_ms"] += ms
+        if run["stack"]:
+            sec = run["open"][-1]
+            sec["queries"] += 1
+            sec["query_ms"] += ms
+    if slow:
+        _log().warning("consulta lenta (%.1f ms): %s", ms, key)
+
+def record_connection():
+    with _lock:
+        _totals["connections"] += 1
+
+def _timed(sql, call, *args):
+    if not ENABLED:
+        return call(sql, *args)
+    t0 = time.perf_counter()
+    try:
+        return call(sql, *args)
+    finally:
+        record_query(sql, (time.perf_counter() - t0) * 1000)
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor que mide sus sentencias (migraciones, reconstrucciones, inserts en bloque)."""
+
+    def execute(self, sql, *args):
+        return _timed(sql, super().execute, *args)
+
+    def executemany(self, sql, *args):
+        return _timed(sql, super().executemany, *args)
+
+    def executescript(self, script):
+        return _timed(script, super().executescript)
+
+class TracedConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection que mide sus sentencias (se usa como factory= en connect).
+    conn.execute() no pasa por cursor(), así que nada se cuenta dos veces.
+    """
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return _timed(sql, super().execute, *args)
+
+    def executemany(self, sql, *args):
+        return _timed(sql, super().executemany, *args)
+
+    def executescript(self, script):
+        return _timed(script, super().executescript)
+
+# ---------- reruns y secciones ----------
+
+def start_run(label="rerun"):
+    """Empieza a juntar tiempos del rerun en curso (por hilo)."""
+    _local.run = {
+        "label": label,
+        "started": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "t0": time.perf_counter(),
+        "queries": 0,
+        "query_ms": 0.0,
+        "sections": [],
+        "stack": [],
+        "open": [],
+    }
+
+def end_run():
+    """Cierra el rerun actual, lo guarda (y lo escribe en METRICS_FILE) y lo devuelve."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    _local.run = None
+    out = {
+        "label": run["label"],
+        "started": run["started"],
+        "total_ms": round((time.perf_counter() - run["t0"]) * 1000, 3),
+        "queries": run["queries"],
+        "query_ms": round(run["query_ms"], 3),
+        "sections": run["sections"],
+    }
+    with _lock:
+        _totals["runs"].append(out)
+    if METRICS_FILE:
+        with open(METRICS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(out, ensure_ascii=False) + "\n")
+    return out
+
+def current_run():
+    """Copia del rerun en curso hasta ahora (para mostrarla antes de end_run)."""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    return {
+        "label": run["label"],
+        "total_ms": round((time.perf_counter() - run["t0"]) * 1000, 3),
+        "queries": run["queries"],
+        "query_ms": round(run["query_ms"], 3),
+        "sections": list(run["sections"]),
+    }
+
+@contextmanager
+def section(name):
+    """
+    with section("tab Resumen"): ...  -> mide la sección (anidable: "a / b").
+    Se registra aunque salga por excepción (p. ej. st.stop()).
+    """
+    run = getattr(_local, "run", None)
+    full = " / ".join((run["stack"] if run else []) + [name])
+    sec = {"queries": 0, "query_ms": 0.0}
+    if run is not None:
+        run["stack"].append(name)
+        run["open"].append(sec)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        with _lock:
+            s = _totals["sections"].setdefault(full, [0, 0.0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += ms
+            s[2] = max(s[2], ms)
+            s[3] = ms
+        if run is not None:
+            run["stack"].pop()
+            run["open"].pop()
+            if run["open"]:
+                parent = run["open"][-1]
+                parent["queries"] += sec["queries"]
+                parent["query_ms"] += sec["query_ms"]
+            run["sections"].append({
+                "name": full, "ms": round(ms, 3),
+                "queries": sec["queries"], "query_ms": round(sec["query_ms"], 3),
+            })
+        if ms >= SLOW_SECTION_MS:
+            _log().warning("sección lenta (%.1f ms): %s", ms, full)
+
+# ---------- reporte ----------
+
+def snapshot(top=50):
+    """Todo lo acumulado en el proceso, como dict serializable a JSON."""
+    with _lock:
+        statements = sorted(_totals["statements"].items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "since": _totals["since"],
+            "thresholds": {"slow_query_ms": SLOW_QUERY_MS, "slow_section_ms": SLOW_SECTION_MS},
+            "connections": _totals["connections"],
+            "queries": _totals["queries"],
+            "query_ms": round(_totals["query_ms"], 3),
+            "statements": [
+                {"sql": sql, "count": n, "total_ms": round(total, 3), "max_ms": round(mx, 3),
+                 "mean_ms": round(total / n, 4)}
+                for sql, (n, total, mx) in statements[:top]
+            ],
+            "sections": {
+                name: {"count": n, "total_ms": round(total, 3), "max_ms": round(mx, 3), "last_ms": round(last, 3)}
+                for name, (n, total, mx, last) in sorted(_totals["sections"].items())
+            },
+            "slow_queries": list(_totals["slow"]),
+            "runs": list(_totals["runs"]),
+        }
+
+def export(path, top=200):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(top), f, indent=2, ensure_ascii=False)
+    return path
+
+def reset():
+    global _totals
+    with _lock:
+        _totals = _empty()
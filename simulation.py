@@ -0,0 +1,180 @@
+"""
+Proyección Monte Carlo de los próximos meses (sin escribir en la DB).
+
+Cada escenario sortea los ingresos mensuales de cada usuario y los reparte
+con las mismas reglas que utils.proportional_allocate: proporcional a lo que
+falta en cada categoría y sin pasarse del tope. Con pesos = capacidad, el
+water-filling de allocation.allocate_capped tiene solución cerrada: todas las
+categorías del usuario se llenan en la misma fracción
+
+    f = min(1, ingreso / suma de sus topes del mes)
+
+(y varios ingresos en el mes dan lo mismo que su suma), así que todos los
+escenarios y meses se calculan de una vez como arreglos
+(escenarios × meses × usuarios) sin llamar al asignador por escenario.
+
+Supuestos: los meses proyectados empiezan en el próximo mes con las
+plantillas actuales (budgets.yaml ya sincronizado); lo que no cabe en las
+metas queda sin asignar, como en la app.
+"""
+import numpy as np
+
+import db
+
+# Categorías que cuentan como ahorro (prefijo de la key en budgets.yaml). Sólo
+# las individuales son ahorro de su dueño: lo que cada uno pone en una
+# compartida (p. ej. el fondo de emergencia) es de los dos, no ahorro personal.
+SAVINGS_KEYS = ("ahorro", "emergencia")
+PERCENTILES = (10, 50, 90)
+
+def load_targets():
+    """
+    Topes por categoría y usuario de las plantillas vigentes.
+    Devuelve (ckeys, names, owners, users, targets) con targets de shape (C, U);
+    owners[i] es None en las compartidas.
+    """
+    with db.connection() as conn:
+        rows = conn.execute("""
+            SELECT ct.ckey, ct.name, ct.ctype, ct.owner, s.user, s.target
+            FROM category_templates ct
+            JOIN category_shares s ON s.version_id = ct.version_id
+            ORDER BY CASE ct.ctype WHEN 'shared' THEN 0 ELSE 1 END, ct.name, ct.ckey
+        """).fetchall()
+    users = db.list_users()
+    ckeys, names, owners = [], {}, {}
+    for ckey, name, ctype, owner, _, _ in rows:
+        if ckey not in names:
+            ckeys.append(ckey)
+            names[ckey] = name if ctype == "shared" else f"{name} ({owner})"
+            owners[ckey] = None if ctype == "shared" else owner
+    targets = np.zeros((len(ckeys), len(users)))
+    pos_c = {k: i for i, k in enumerate(ckeys)}
+    pos_u = {u: i for i, u in enumerate(users)}
+    for ckey, _, _, _, user, target in rows:
+        if user in pos_u:
+            targets[pos_c[ckey], pos_u[user]] = target
+    return ckeys, [names[k] for k in ckeys], [owners[k] for k in ckeys], users, targets
+
+def income_history(users, months=12, end=None):
+    """
+    Ingresos mensuales por usuario de los `months` meses terminados antes de `end`
+    (por defecto el actual). Devuelve (meses, arreglo (N, U)); meses sin datos = 0.
+    """
+    end = end or db.current_month()
+    y, m = map(int, end.split("-"))
+    last = y * 12 + m - 2
+    hist = [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(last - months + 1, last + 1)]
+    with db.connection() as conn:
+        rows = conn.execute("""
+            SELECT substr(ts, 1, 7), user, SUM(amount) FROM incomes
+            WHERE ts >= ? AND ts < ? GROUP BY 1, 2
+            UNION ALL
+            SELECT month, user, amount FROM income_rollups WHERE month BETWEEN ? AND ?
+        """, (hist[0], end, hist[0], hist[-1])).fetchall()
+    pos_m = {mm: i for i, mm in enumerate(hist)}
+    pos_u = {u: i for i, u in enumerate(users)}
+    out = np.zeros((len(hist), len(users)))
+    for month, user, amount in rows:
+        if month in pos_m and user in pos_u:
+            out[pos_m[month], pos_u[user]] += amount
+    return hist, out
+
+def sample_incomes(history, scenarios, months, method="bootstrap", seed=0):
+    """
+    Escenarios de ingreso (S, M, U) a partir del historial (N, U).
+      bootstrap: cada mes futuro repite un mes histórico al azar (ambos usuarios
+                 juntos, así se conserva la correlación entre ellos).
+      normal:    normal con la media y desviación histórica de cada usuario, truncada en 0.
+    """
+    rng = np.random.default_rng(seed)
+    if method == "bootstrap":
+        idx = rng.integers(0, history.shape[0], size=(scenarios, months))
+        return history[idx]
+    if method == "normal":
+        mu, sd = history.mean(axis=0), history.std(axis=0)
+        return np.maximum(0.0, rng.normal(mu, sd, size=(scenarios, months, history.shape[1])))
+    raise ValueError(f"método desconocido: {method!r}")
+
+def simulate(incomes, targets, savings_mask):
+    """
+    incomes      -> (S, M, U) ingreso de cada usuario por escenario y mes
+    targets      -> (C, U) tope mensual de cada usuario en cada categoría
+    savings_mask -> (C,) bool, categorías de ahorro personal (individuales)
+    Devuelve dict de arreglos:
+      fill     (S, M, U)  fracción de sus metas que cubrió cada usuario
+      funded   (S, M, C)  monto aportado a cada categoría
+      complete (S, M, C)  la categoría quedó completa
+      leftover (S, M, U)  ingreso que no cupo en las metas
+      savings  (S, M, U)  ahorro acumulado de cada usuario
+    """
+    per_user = targets.sum(axis=0)                              # (U,)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fill = np.where(per_user > 0, np.minimum(1.0, incomes / per_user), 0.0)
+    funded = np.einsum("smu,cu->smc", fill, targets)
+    need = targets.sum(axis=1)                                  # (C,)
+    complete = funded >= need - 0.5
+    leftover = np.maximum(0.0, incomes - per_user)
+    saved = fill * targets[savings_mask].sum(axis=0)            # (S, M, U)
+    return {
+        "fill": fill,
+        "funded": funded,
+        "complete": complete,
+        "leftover": leftover,
+        "savings": np.cumsum(saved, axis=1),
+    }
+
+def bands(x, percentiles=PERCENTILES):
+    """Percentiles sobre escenarios (eje 0): arreglo (len(percentiles), ...)."""
+    return np.percentile(x, percentiles, axis=0)
+
+@db.cached_read
+def project(months=24, scenarios=10_000, history=12, method="bootstrap", savings_goal=0, seed=0):
+    """
+    Proyección desde el próximo mes. Devuelve un dict con:
+      months, users, categories, owners, history_months (meses con ingresos usados)
+      savings        {usuario: (P, M)} ahorro acumulado, percentiles PERCENTILES
+      leftover       {usuario: (P, M)} sin asignar por mes
+      complete_prob  (C, M) probabilidad de que cada categoría quede completa
+      goal_prob      {usuario: (M,)} probabilidad de haber llegado a savings_goal
+      goal_month     {usuario: índice del mes mediano en que se llega, o None}
+    Si no hay ingresos en el historial levanta ValueError.
+    """
+    ckeys, names, owners, users, targets = load_targets()
+    hist_months, hist = income_history(users, history)
+    # Sólo meses con ingresos registrados (antes de usar la app no hay datos, no ingresos 0).
+    used = hist.sum(axis=1) > 0
+    if not used.any():
+        raise ValueError(f"No hay ingresos en los últimos {history} meses para proyectar.")
+    hist_months = [mm for mm, u in zip(hist_months, used) if u]
+    hist = hist[used]
+    start = db._next_month(db.current_month())
+    future = [start]
+    for _ in range(months - 1):
+        future.append(db._next_month(future[-1]))
+
+    savings_mask = np.array([o is not None and k.startswith(SAVINGS_KEYS)
+                             for k, o in zip(ckeys, owners)], dtype=bool)
+    incomes = sample_incomes(hist, scenarios, months, method, seed)
+    sim = simulate(incomes, targets, savings_mask)
+
+    out = {
+        "months": future,
+        "users": users,
+        "categories": names,
+        "owners": owners,
+        "history_months": hist_months,
+        "savings": {},
+        "leftover": {},
+        "complete_prob": sim["complete"].mean(axis=0).T,
+        "goal_prob": {},
+        "goal_month": {},
+    }
+    for j, user in enumerate(users):
+        out["savings"][user] = bands(sim["savings"][:, :, j])
+        out["leftover"][user] = bands(sim["leftover"][:, :, j])
+        if savings_goal > 0:
+            prob = (sim["savings"][:, :, j] >= savings_goal).mean(axis=0)
+            out["goal_prob"][user] = prob
+            reached = np.flatnonzero(prob >= 0.5)
+            out["goal_month"][user] = int(reached[0]) if reached.size else None
+    return out
@@ -0,0 +1,482 @@
+"""
+Backends de almacenamiento intercambiables.
+
+Un backend es cualquier objeto con las operaciones de OPERATIONS (mismos
+nombres, argumentos y resultados que las funciones de db.py) más
+transaction(). Vienen tres:
+
+  "sqlite"         SQLiteBackend()                 db.py sobre el archivo DB_PATH (el de siempre)
+  "sqlite-memory"  SQLiteBackend(":memory:budget") db.py sobre SQLite en memoria compartida
+  "memory"         MemoryBackend()                 Python puro con dicts indexados, sin SQL ni disco
+
+get_backend() devuelve el elegido con BUDGET_BACKEND (por defecto "sqlite").
+También se puede pasar uno explícito por llamada:
+
+    mem = storage.MemoryBackend()
+    mem.ensure_users(); mem.sync_templates(cats); mem.ensure_budgets_for_month("2025-10")
+    utils.proportional_allocate("Jack", 500_000, "2025-10", backend=mem)
+    utils.summary_rows_from(mem, "2025-10", "Jack")
+
+Lo que trabaja con SQL directo (analytics, simulation, archive, importer,
+bench) sigue necesitando un backend SQLite.
+"""
+import datetime, functools, json, os, threading
+from contextlib import contextmanager, nullcontext
+
+import db
+
+OPERATIONS = (
+    "init_db", "schema_version", "data_version",
+    "ensure_users", "list_users",
+    "sync_templates", "load_templates_from_yaml", "list_categories",
+    "ensure_budgets_for_month", "ensure_budgets_for_range", "list_budgets",
+    "sum_contribs", "sum_contribs_by_user", "verify_balances", "rebuild_balances",
+    "month_snapshot", "remaining_for_user", "closed_months",
+    "add_contribution", "add_income", "record_distribution", "insert_incomes",
+    "contributions_for_income", "incomes_for_user", "history_page",
+)
+
+# === SQLITE ===================================================================
+
+class SQLiteBackend:
+    """
+    Las funciones de db.py apuntando a `path` (archivo o ":memory:nombre").
+    path=None sigue a db.DB_PATH y devuelve las funciones tal cual, sin envoltorio.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def __repr__(self):
+        return f"SQLiteBackend({self.path or db.DB_PATH!r})"
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+        fn = getattr(db, name)
+        if self.path is None:
+            return fn
+        path = self.path
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            with db.use(path):
+                return fn(*args, **kwargs)
+
+        if hasattr(fn, "uncached"):
+            def uncached(*args, **kwargs):
+                with db.use(path):
+                    return fn.uncached(*args, **kwargs)
+            call.uncached = uncached
+        return call
+
+    @contextmanager
+    def transaction(self):
+        if self.path is None:
+            with db.transaction():
+                yield self
+            return
+        with db.use(self.path), db.transaction():
+            yield self
+
+# === PYTHON PURO ==============================================================
+
+class MemoryBackend:
+    """
+    Mismas operaciones que db.py sobre dicts indexados: sin SQL, sin disco.
+    Pensado para tests y benchmarks de la lógica de reparto y del Resumen.
+    Las transacciones se serializan con un lock y se deshacen con un registro
+    de deshacer; los meses no se pueden cerrar (no hay archivo).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._undo = None
+        self._meta = {"version": 0, "users": 0, "versions": 0, "budgets": 0, "contributions": 0, "incomes": 0}
+        self.users = {}           # nombre -> id
+        self.templates = {}       # ckey -> (name, ctype, owner, limit_total, shares_json, version_id)
+        self.versions = {}        # id -> (ckey, version, name, ctype, owner, limit_total, shares_json)
+        self.shares = {}          # version_id -> {user: (fraction, target)}
+        self.budgets = {}         # id -> (template_key, month, limit_total, version_id)
+        self.by_month = {}        # month -> {template_key: budget_id}
+        self.contributions = {}   # id -> (budget_id, user, amount, ts, income_id)
+        self.incomes = {}         # id -> (user, amount, ts, note, idem_key)
+        self.by_idem = {}         # idem_key -> income_id
+        self.by_income = {}       # income_id -> [contribution ids]
+        self.contribs_by_user = {}  # user -> [contribution ids]
+        self.incomes_by_user = {}   # user -> [income ids]
+        self.balances = {}        # (budget_id, user) -> monto
+
+    def __repr__(self):
+        return f"MemoryBackend({len(self.budgets)} presupuestos, {len(self.contributions)} aportes)"
+
+    # ---------- transacciones ----------
+
+    @contextmanager
+    def transaction(self):
+        """Como db.transaction(): las anidadas se unen a la exterior; un error deshace todo."""
+        with self._lock:
+            outer = self._undo is None
+            if outer:
+                self._undo = []
+            try:
+                yield self
+            except BaseException:
+                if outer:
+                    for undo in reversed(self._undo):
+                        undo()
+                raise
+            finally:
+                if outer:
+                    self._undo = None
+
+    def _set(self, d, key, value):
+        if self._undo is not None:
+            if key in d:
+                old = d[key]
+                self._undo.append(lambda: d.__setitem__(key, old))
+            else:
+                self._undo.append(lambda: d.pop(key, None))
+        d[key] = value
+
+    def _append(self, d, key, value):
+        lst = d.get(key)
+        if lst is None:
+            self._set(d, key, [])
+            lst = d[key]
+        lst.append(value)
+        if self._undo is not None:
+            self._undo.append(lst.pop)
+
+    def _next_id(self, kind):
+        n = self._meta[kind] + 1
+        self._set(self._meta, kind, n)
+        return n
+
+    def _bump(self):
+        self._set(self._meta, "version", self._meta["version"] + 1)
+
+    # ---------- esquema / versión ----------
+
+    def init_db(self):
+        pass
+
+    def schema_version(self):
+        return db.MIGRATIONS[-1][0]
+
+    def data_version(self):
+        return self._meta["version"]
+
+    # ---------- usuarios y plantillas ----------
+
+    def ensure_users(self, usernames=("Jack", "Jasmin")):
+        with self.transaction():
+            for u in usernames:
+                if u not in self.users:
+                    self._set(self.users, u, self._next_id("users"))
+
+    def list_users(self):
+        with self._lock:
+            return sorted(self.users, key=self.users.get)
+
+    def sync_templates(self, cats):
+        with self.transaction():
+            users = self.list_users()
+            changed = 0
+            for cat in cats:
+                ckey = cat["key"]
+                row = (
+                    cat["name"],
+                    cat["type"],
+                    cat.get("owner"),
+                    int(cat["limit_total"]),
+                    json.dumps(cat.get("shares", None)) if cat["type"] == "shared" else None,
+                )
+                old = self.templates.get(ckey)
+                if old is not None and old[:5] == row:
+                    continue
+                version = 1 + max((v[1] for v in self.versions.values() if v[0] == ckey), default=0)
+                version_id = self._next_id("versions")
+                self._set(self.versions, version_id, (ckey, version) + row)
+                self._set(self.templates, ckey, row + (version_id,))
+                self._set(self.shares, version_id, {
+                    user: (frac, target)
+                    for user, frac, target in db._share_rows(row[1], row[2], row[3], cat.get("shares"), users)
+                })
+                changed += 1
+            if changed:
+                self._bump()
+            return changed
+
+    def load_templates_from_yaml(self):
+        import yaml
+        with open(db.YAML_PATH, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+        return self.sync_templates(data.get("categories", []))
+
+    def list_categories(self):
+        with self._lock:
+            rows = [(ckey, t[0], t[1], t[2]) for ckey, t in self.templates.items()]
+        return sorted(rows, key=lambda r: (r[2] != "shared", r[1], r[0]))
+
+    # ---------- presupuestos ----------
+
+    def ensure_budgets_for_month(self, month=None):
+        month = db._check_month(month or db.current_month())
+        with self.transaction():
+            existing = self.by_month.get(month)
+            if existing is None:
+                self._set(self.by_month, month, {})
+                existing = self.by_month[month]
+            created = 0
+            for ckey, t in self.templates.items():
+                if ckey in existing:
+                    continue
+                budget_id = self._next_id("budgets")
+                self._set(self.budgets, budget_id, (ckey, month, t[3], t[5]))
+                self._set(existing, ckey, budget_id)
+                created += 1
+            if created:
+                self._bump()
+            return created
+
+    def ensure_budgets_for_range(self, start, end):
+        db._check_month(start)
+        db._check_month(end)
+        if start > end:
+            raise ValueError(f"Rango de meses invertido: {start} > {end}")
+        with self.transaction():
+            created, month = 0, start
+            while month <= end:
+                created += self.ensure_budgets_for_month(month)
+                month = db._next_month(month)
+            return created
+
+    def _row(self, budget_id):
+        ckey, _, limit_total, version_id = self.budgets[budget_id]
+        v = self.versions[version_id]
+        return (budget_id, ckey, v[2], v[3], v[4], limit_total, v[6])
+
+    def _month_rows(self, month):
+        rows = [self._row(b) for b in self.by_month.get(month, {}).values()]
+        return sorted(rows, key=lambda r: (r[3] != "shared", r[2], r[0]))
+
+    def _target(self, budget_id, user):
+        _, _, limit_total, version_id = self.budgets[budget_id]
+        fraction, target = self.shares[version_id][user]
+        if limit_total == self.versions[version_id][5]:
+            return int(target)
+        return db._round_target(limit_total * fraction)
+
+    def list_budgets(self, month=None):
+        with self._lock:
+            return self._month_rows(month or db.current_month())
+
+    def sum_contribs(self, budget_id):
+        with self._lock:
+            return sum(self.balances.get((budget_id, u), 0) for u in self.users)
+
+    def sum_contribs_by_user(self, budget_id, user):
+        with self._lock:
+            return self.balances.get((budget_id, user), 0)
+
+    def _actual_balances(self):
+        actual = {}
+        for budget_id, user, amount, _, _ in self.contributions.values():
+            actual[(budget_id, user)] = actual.get((budget_id, user), 0) + amount
+        return actual
+
+    def verify_balances(self):
+        with self._lock:
+            actual = self._actual_balances()
+            keys = sorted(set(actual) | set(self.balances))
+            return [(b, u, self.balances.get((b, u), 0), actual.get((b, u), 0))
+                    for b, u in keys if self.balances.get((b, u), 0) != actual.get((b, u), 0)]
+
+    def rebuild_balances(self):
+        with self.transaction():
+            drift = self.verify_balances()
+            actual = self._actual_balances()
+            for key in list(self.balances):
+                if key not in actual:
+                    self._undo.append(functools.partial(self.balances.__setitem__, key, self.balances[key]))
+                    del self.balances[key]
+            for key, amount in actual.items():
+                self._set(self.balances, key, amount)
+            self._bump()
+            return drift
+
+    def month_snapshot(self, month=None):
+        with self._lock:
+            rows = self._month_rows(month or db.current_month())
+            contribs, targets = {}, {}
+            for r in rows:
+                b = r[0]
+                contribs[b] = {u: self.balances[(b, u)] for u in self.users if (b, u) in self.balances}
+                version_id = self.budgets[b][3]
+                shares = self.shares.get(version_id, {})
+                if shares:
+                    targets[b] = {u: self._target(b, u) for u in shares}
+            return rows, contribs, targets
+
+    def remaining_for_user(self, month, user):
+        with self._lock:
+            out = []
+            for r in self._month_rows(month):
+                if user not in self.shares.get(self.budgets[r[0]][3], {}):
+                    continue
+                remaining = self._target(r[0], user) - self.balances.get((r[0], user), 0)
+                if remaining > 0:
+                    out.append((r, remaining))
+            return out
+
+    def closed_months(self):
+        return set()
+
+    # ---------- movimientos ----------
+
+    def _insert_contribution(self, budget_id, user, amount, ts, income_id=None):
+        cid = self._next_id("contributions")
+        self._set(self.contributions, cid, (budget_id, user, amount, ts, income_id))
+        self._set(self.balances, (budget_id, user), self.balances.get((budget_id, user), 0) + amount)
+        self._append(self.contribs_by_user, user, cid)
+        if income_id is not None:
+            self._append(self.by_income, income_id, cid)
+        return cid
+
+    def _insert_income(self, user, amount, ts, note, idem_key=None):
+        income_id = self._next_id("incomes")
+        self._set(self.incomes, income_id, (user, amount, ts, note, idem_key))
+        self._append(self.incomes_by_user, user, income_id)
+        if idem_key is not None:
+            self._set(self.by_idem, idem_key, income_id)
+        return income_id
+
+    def add_contribution(self, budget_id, user, amount):
+        ts = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.transaction():
+            self._insert_contribution(budget_id, user, int(amount), ts)
+            self._bump()
+
+    def add_income(self, user, amount, note=""):
+        ts = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.transaction():
+            self._insert_income(user, int(amount), ts, note)
+            self._bump()
+
+    def record_distribution(self, user, amount, note="", allocations=(), idempotency_key=None, ts=None):
+        ts = ts or datetime.datetime.now().isoformat(timespec="seconds")
+        with self.transaction():
+            if idempotency_key is not None and idempotency_key in self.by_idem:
+                return self.by_idem[idempotency_key], False
+            allocations = [(int(b_id), int(amt)) for b_id, amt in allocations if int(amt) > 0]
+            income_id = self._insert_income(user, int(amount), ts, note, idempotency_key)
+            for b_id, amt in allocations:
+                self._insert_contribution(b_id, user, amt, ts, income_id)
+            self._bump()
+        return income_id, True
+
+    def insert_incomes(self, rows):
+        with self.transaction():
+            inserted = 0
+            for user, amount, ts, note, idem_key in rows:
+                if idem_key is not None and idem_key in self.by_idem:
+                    continue
+                self._insert_income(user, amount, ts, note, idem_key)
+                inserted += 1
+            if inserted:
+                self._bump()
+            return inserted
+
+    # ---------- lecturas de movimientos ----------
+
+    def contributions_for_income(self, income_id):
+        with self._lock:
+            return [(self.contributions[c][0], self.contributions[c][2]) for c in self.by_income.get(income_id, [])]
+
+    def incomes_for_user(self, user, limit=20):
+        with self._lock:
+            ids = sorted(self.incomes_by_user.get(user, []),
+                         key=lambda i: (self.incomes[i][2], i), reverse=True)[:int(limit)]
+            return [(self.incomes[i][1], self.incomes[i][2], self.incomes[i][3]) for i in ids]
+
+    def history_page(self, user, kind="incomes", cursor=None, limit=50,
+                     date_from=None, date_to=None, category=None):
+        if kind == "incomes":
+            if category:
+                raise ValueError("category sólo aplica a contributions")
+            table, index = self.incomes, self.incomes_by_user
+            ts_of = lambda i: self.incomes[i][2]
+        elif kind == "contributions":
+            table, index = self.contributions, self.contribs_by_user
+            ts_of = lambda i: self.contributions[i][3]
+        else:
+            raise ValueError(f"kind inválido: {kind!r}")
+        lo = str(date_from) if date_from else None
+        hi = db._day_after(date_to) if date_to else None
+        cursor = tuple(cursor) if cursor is not None else None
+
+        with self._lock:
+            keys = []
+            for i in index.get(user, []):
+                ts = ts_of(i)
+                if lo is not None and ts < lo or hi is not None and ts >= hi:
+                    continue
+                if cursor is not None and (ts, i) >= cursor:
+                    continue
+                if category and self.budgets.get(table[i][0], (None,))[0] != category:
+                    continue
+                keys.append((ts, i))
+            keys.sort(reverse=True)
+            keys = keys[:int(limit) + 1]
+            rows = []
+            for ts, i in keys:
+                if kind == "incomes":
+                    _, amount, _, note, _ = table[i]
+                    rows.append((i, ts, amount, note))
+                else:
+                    budget_id, _, amount, _, income_id = table[i]
+                    b = self.budgets.get(budget_id)
+                    name = self.versions[b[3]][2] if b else None
+                    rows.append((i, ts, amount, b[1] if b else None, name, income_id))
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1][1], rows[-1][0])
+        return rows, None
+
+# === SELECCIÓN ================================================================
+
+BACKENDS = {
+    "sqlite": lambda: SQLiteBackend(),
+    "sqlite-memory": lambda: SQLiteBackend(db.MEMORY_PREFIX + "budget"),
+    "memory": MemoryBackend,
+}
+
+def is_default(backend):
+    """True si es db.py sobre DB_PATH (el único con caché de lecturas y escritor único)."""
+    return isinstance(backend, SQLiteBackend) and backend.path is None
+
+def sql_scope(backend):
+    """
+    Contexto para correr código con SQL directo (analytics, simulation, importer)
+    sobre la base de `backend`. None si el backend no es SQLite.
+    """
+    if not isinstance(backend, SQLiteBackend):
+        return None
+    return db.use(backend.path) if backend.path else nullcontext()
+
+_default = {}
+_default_lock = threading.Lock()
+
+def get_backend(name=None):
+    """
+    Backend por nombre ("sqlite", "sqlite-memory", "memory"); sin nombre, el de
+    BUDGET_BACKEND. Cada nombre da siempre la misma instancia dentro del proceso.
+    """
+    name = name or os.environ.get("BUDGET_BACKEND", "sqlite")
+    if name not in BACKENDS:
+        raise ValueError(f"backend desconocido: {name!r} (opciones: {', '.join(BACKENDS)})")
+    with _default_lock:
+        if name not in _default:
+            _default[name] = BACKENDS[name]()
+        return _default[name]
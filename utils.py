@@ -1,60 +1,82 @@
-from db import list_budgets, sum_contribs, sum_contribs_by_user, add_contribution
-import json, math
+from db import month_snapshot, cached_read, write_op
+from allocation import allocate_capped
+import re
+import storage
+
+_DB = storage.SQLiteBackend()  # db.py sobre DB_PATH (funciones con caché tal cual)
 
 def fmt_clp(n: int) -> str:
     n = int(n)
     s = f"{n:,}".replace(",", ".")
     return f"${s}"
 
-def _remaining_for_user_row(row, user):
-    budget_id, template_key, name, ctype, owner, limit_total, shares_json = row
-    if ctype == "shared":
-        shares = json.loads(shares_json or "{}")
-        share = float(shares.get(user, 0.0))
-        target_user = int(round(limit_total * share))
-        done_by_user = sum_contribs_by_user(budget_id, user)
-        remaining = max(0, target_user - done_by_user)
-    else:
-        if owner != user:
-            return 0
-        total_done = sum_contribs_by_user(budget_id, user)
-        remaining = max(0, int(limit_total) - int(total_done))
-    return remaining
-
-def proportional_allocate(user: str, amount: int, month: str):
-    rows = list_budgets(month)
-    candidates = []
-    for r in rows:
-        rem = _remaining_for_user_row(r, user)
-        if rem > 0:
-            candidates.append((r, rem))
-    total_need = sum(rem for _, rem in candidates)
-    allocs = []
-    if total_need == 0 or amount <= 0:
-        return allocs, int(amount)
-
-    provisional = []
-    for r, rem in candidates:
-        weight = rem / total_need
-        provisional_amt = int(math.floor(amount * weight))
-        provisional.append((r, min(provisional_amt, rem)))
-
-    assigned = sum(a for _, a in provisional)
-    leftover = amount - assigned
-
-    i = 0
-    while leftover > 0 and i < len(provisional):
-        r, already = provisional[i]
-        _, rem2 = next(item for item in candidates if item[0] == r)
-        if already < rem2:
-            provisional[i] = (r, already + 1)
-            leftover -= 1
-        i = (i + 1) % len(provisional)
+def parse_money(s: str) -> int:
+    """Convierte '$200.000', '200000', '200,000' -> 200000 (int)."""
+    if not s:
+        return 0
+    digits = re.sub(r"[^\d]", "", s)
+    return int(digits) if digits else 0
+
+def contrib_of(contribs, budget_id, user=None) -> int:
+    """Aporte desde la foto del mes (db.month_snapshot): de un usuario o total."""
+    by_user = contribs.get(budget_id, {})
+    if user is None:
+        return int(sum(by_user.values()))
+    return int(by_user.get(user, 0))
+
+def target_of(targets, budget_id, user) -> int:
+    """Tope personal desde la foto del mes (category_shares normalizado)."""
+    return int(targets.get(budget_id, {}).get(user, 0))
+
+def proportional_allocate(user: str, amount: int, month: str, note: str = "", idempotency_key=None, ts=None,
+                          backend=None):
+    """
+    Reparte `amount` entre las categorías con saldo pendiente del usuario y
+    registra el ingreso junto con sus aportes en una sola transacción
+    (en modo write-behind, la lectura y la escritura corren en el escritor único).
+    Devuelve (allocs, leftover, applied). Si idempotency_key ya se había usado,
+    no escribe nada (applied=False) y allocs describe lo registrado la primera vez.
+    ts: fecha ISO del ingreso (por defecto, ahora; la usa el importador).
+    backend: otro backend de storage (p. ej. MemoryBackend); por defecto db.py.
+    """
+    if backend is None or storage.is_default(backend):
+        return _proportional_allocate_db(user, amount, month, note, idempotency_key, ts)
+    return _proportional_allocate(backend, user, amount, month, note, idempotency_key, ts)
 
+@write_op
+def _proportional_allocate_db(user, amount, month, note="", idempotency_key=None, ts=None):
+    return _proportional_allocate(_DB, user, amount, month, note, idempotency_key, ts)
+
+# Encolar sin esperar (sólo db.py): proportional_allocate.submit(...) -> Future.
+proportional_allocate.submit = _proportional_allocate_db.submit
+
+def _proportional_allocate(b, user, amount, month, note, idempotency_key, ts):
+    if amount <= 0:
+        return [], int(amount), False
+    with b.transaction():
+        # Sin caché: es un camino de escritura y la versión de datos cambia enseguida.
+        remaining = b.remaining_for_user
+        candidates = getattr(remaining, "uncached", remaining)(month, user)
+
+        # Proporcional a lo que le falta a cada categoría, sin pasarse del tope.
+        amounts, leftover = allocate_capped(int(amount), [rem for _, rem in candidates])
+        provisional = [(r, amt) for (r, _), amt in zip(candidates, amounts)]
+
+        income_id, applied = b.record_distribution(
+            user, int(amount), note,
+            [(r[0], amt) for r, amt in provisional],
+            idempotency_key=idempotency_key, ts=ts,
+        )
+        if not applied:
+            done = dict(b.contributions_for_income(income_id))
+            rows, _, _ = b.month_snapshot(month)
+            provisional = [(r, done[r[0]]) for r in rows if r[0] in done]
+            leftover = int(amount) - sum(done.values())
+
+    allocs = []
     for r, amt in provisional:
         if amt <= 0:
             continue
-        add_contribution(r[0], user, int(amt))
         allocs.append({
             "budget_id": r[0],
             "name": r[2],
@@ -64,10 +86,76 @@ def proportional_allocate(user: str, amount: int, month: str):
             "allocated": int(amt)
         })
 
-    return allocs, int(leftover)
+    return allocs, int(leftover), applied
 
-def progress_of_row(row):
+def progress_of_row(row, contribs):
     budget_id, template_key, name, ctype, owner, limit_total, shares_json = row
-    total = sum_contribs(budget_id)
+    total = contrib_of(contribs, budget_id)
     pct = min(1.0, (total / limit_total) if limit_total else 0.0)
-    return total, pct, (total >= limit_total)
\ No newline at end of file
+    return total, pct, (total >= limit_total)
+
+@cached_read
+def summary_rows(month: str, username: str):
+    """
+    Datos del tab Resumen a partir de una sola foto del mes.
+    Devuelve (sdata, pdata): filas de compartidos y de categorías propias.
+    """
+    return _summary(month_snapshot(month), username)
+
+def summary_rows_from(backend, month: str, username: str):
+    """summary_rows sobre cualquier backend de storage (el SQLite por defecto pasa por la caché)."""
+    if storage.is_default(backend):
+        return summary_rows(month, username)
+    return _summary(backend.month_snapshot(month), username)
+
+def _summary(snapshot, username):
+    rows, contribs, targets = snapshot
+    # r = (b.id, template_key, t.name, t.ctype, t.owner, b.limit_total, t.shares_json)
+    shared_rows = [r for r in rows if r[3] == "shared"]
+    my_rows     = [r for r in rows if (r[3] == "individual" and r[4] == username)]
+
+    sdata = []
+    for r in shared_rows:
+        b_id, tkey, name, ctype, owner, limit_total, shares_json = r
+
+        # Topes individuales (precalculados desde los shares de budgets.yaml)
+        tope_jack   = target_of(targets, b_id, "Jack")
+        tope_jasmin = target_of(targets, b_id, "Jasmin")
+
+        # Aportes realizados
+        ap_jack   = contrib_of(contribs, b_id, "Jack")
+        ap_jasmin = contrib_of(contribs, b_id, "Jasmin")
+
+        # Estados individuales
+        est_jack   = "✅ Listo" if ap_jack >= tope_jack else f"⏳ {fmt_clp(ap_jack)}/{fmt_clp(tope_jack)}"
+        est_jasmin = "✅ Listo" if ap_jasmin >= tope_jasmin else f"⏳ {fmt_clp(ap_jasmin)}/{fmt_clp(tope_jasmin)}"
+
+        # Estado general (como referencia global)
+        total, pct, done = progress_of_row(r, contribs)
+        est_general = "✅ GASTO LISTO" if done else "⏳ En progreso"
+
+        sdata.append({
+            "Categoría":       name,
+            "Aportado Jack":   fmt_clp(ap_jack),
+            "Tope Jack":       fmt_clp(tope_jack),
+            "Estado Jack":     est_jack,
+            "Aportado Jasmin": fmt_clp(ap_jasmin),
+            "Tope Jasmin":     fmt_clp(tope_jasmin),
+            "Estado Jasmin":   est_jasmin,
+            "Aportado total":  fmt_clp(total),
+            "Límite total":    fmt_clp(limit_total),
+            "Estado general":  est_general,
+        })
+
+    pdata = []
+    for r in my_rows:
+        total_u = contrib_of(contribs, r[0], username)
+        total_cat, pct, done = progress_of_row(r, contribs)
+        state = "✅ GASTO LISTO" if done else "⏳ En progreso"
+        pdata.append({
+            "Categoría":            r[2],
+            "Tu aporte":            fmt_clp(total_u),
+            "Límite (tu objetivo)": fmt_clp(r[5]),
+            "Estado":               state
+        })
+    return sdata, pdata